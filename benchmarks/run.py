@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+"""
+Runs the wiki benchmarks, printing the time, memory allocated and
+number of queries of each scenario, optionally saving the results as
+JSON and comparing them with the results of an earlier run::
+
+    python benchmarks/run.py -o before.json
+    python benchmarks/run.py -b before.json
+
+Compared with a baseline, the run fails if a scenario got slower by
+more than the threshold, or made more queries. Allocations are only
+measured on Pythons with ``tracemalloc``.
+"""
+from __future__ import print_function
+
+import gc
+import json
+import os
+import platform
+import sys
+from argparse import ArgumentParser
+from time import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-o", "--output",
+                        help="File to save the results to, as JSON.")
+    parser.add_argument("-b", "--baseline",
+                        help="Results of an earlier run to compare with.")
+    parser.add_argument("-k", dest="filter", default="",
+                        help="Only run scenarios whose name contains this.")
+    parser.add_argument("-n", "--repeat", type=int, default=20,
+                        help="Number of times each scenario is timed.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Slowdown compared with the baseline that "
+                             "fails the run, as a fraction.")
+    parser.add_argument("--pages", type=int, default=200,
+                        help="Number of pages in the wiki.")
+    parser.add_argument("--revisions", type=int, default=10,
+                        help="Average number of revisions of each page.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for the generated wiki.")
+    return parser.parse_args(argv)
+
+
+def setup(options):
+    """
+    Creates the database, with a generated wiki and a superuser for the
+    scenarios to log in as.
+    """
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from mezzanine_wiki.generate import generate
+    call_command("syncdb", interactive=False, verbosity=0)
+    user = User.objects.create_superuser("benchmark", "", "benchmark")
+    generate(user, options.pages, revisions=options.revisions,
+             max_revisions=100, seed=options.seed)
+
+
+def count_queries(func):
+    """
+    Calls the function, returning the number of queries it made.
+    """
+    from django.db import connection
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    start = len(connection.queries)
+    try:
+        func()
+        return len(connection.queries) - start
+    finally:
+        connection.use_debug_cursor = use_debug_cursor
+
+
+def measure_allocations(func):
+    """
+    Calls the function, returning the peak memory it allocated in KiB
+    and the number of blocks it left allocated, or ``None`` for both
+    without ``tracemalloc``.
+    """
+    if tracemalloc is None:
+        func()
+        return None, None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        func()
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before,
+                                                             "filename"))
+    return round(peak / 1024.0, 1), blocks
+
+
+def measure(func, repeat):
+    """
+    Returns the results for a scenario's function, called once to warm
+    up caches and imports before it's measured.
+    """
+    func()
+    queries = count_queries(func)
+    peak, blocks = measure_allocations(func)
+    times = []
+    gc.disable()
+    try:
+        for i in range(repeat):
+            start = time()
+            func()
+            times.append(time() - start)
+    finally:
+        gc.enable()
+    times.sort()
+    return {
+        "min": times[0],
+        "median": times[len(times) // 2],
+        "queries": queries,
+        "alloc_peak_kib": peak,
+        "alloc_blocks": blocks,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints each scenario's results relative to the baseline, returning
+    the names of the scenarios that regressed.
+    """
+    regressed = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = result["median"] / base["median"] if base["median"] else 1
+        queries = result["queries"] - base["queries"]
+        failed = ratio > 1 + threshold or queries > 0
+        print("%-20s %6.2fx time %+4d queries%s" %
+              (name, ratio, queries, "  REGRESSED" if failed else ""))
+        if failed:
+            regressed.append(name)
+    return regressed
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    import django
+    from benchmarks.scenarios import scenarios
+    setup(options)
+    results = {}
+    print("%-20s %10s %10s %8s %10s" %
+          ("scenario", "min ms", "median ms", "queries", "peak KiB"))
+    for name, scenario in scenarios:
+        if options.filter not in name:
+            continue
+        result = results[name] = measure(scenario(options), options.repeat)
+        print("%-20s %10.2f %10.2f %8d %10s" %
+              (name, result["min"] * 1000, result["median"] * 1000,
+               result["queries"], result["alloc_peak_kib"]))
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "options": vars(options),
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)["results"]
+        print()
+        if compare(results, baseline, options.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
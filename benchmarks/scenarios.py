@@ -0,0 +1,115 @@
+"""
+The benchmarked code paths. Each scenario is set up once with the
+wiki created for the run, and returns the function that's timed.
+"""
+from random import Random
+
+from django.contrib.sites.models import Site
+from django.core.urlresolvers import reverse
+from django.db.models import Count
+from django.test.client import Client
+
+from mezzanine_wiki.diff import diff_texts
+from mezzanine_wiki.filters import md_wikilinks
+from mezzanine_wiki.generate import document, page_titles, revise
+from mezzanine_wiki.models import WikiPage
+from mezzanine_wiki.templatetags.mezawiki_tags import html_diff
+
+
+# ``(name, setup)`` for each scenario, in the order they're run.
+scenarios = []
+
+
+def scenario(name):
+    """
+    Decorator that registers a scenario's setup function, which is
+    called with the run's options and returns the function to time.
+    """
+    def decorator(setup):
+        scenarios.append((name, setup))
+        return setup
+    return decorator
+
+
+def get_client():
+    # Requests for the site's domain, which Mezzanine otherwise looks up
+    # for every query of site related models.
+    client = Client(HTTP_HOST=Site.objects.get_current().domain)
+    client.login(username="benchmark", password="benchmark")
+    return client
+
+
+def get(client, url, data=None):
+    def run():
+        response = client.get(url, data or {})
+        assert response.status_code == 200, (url, response.status_code)
+    return run
+
+
+def busiest_page():
+    """
+    Returns the page with the most revisions.
+    """
+    return (WikiPage.objects.annotate(count=Count("wikipagerevision"))
+            .order_by("-count", "id")[0])
+
+
+@scenario("render_small")
+def render_small(options):
+    content = document(Random(1), 3, page_titles(50), 0.02)
+    return lambda: md_wikilinks(content)
+
+
+@scenario("render_large")
+def render_large(options):
+    content = document(Random(2), 300, page_titles(50), 0.02)
+    return lambda: md_wikilinks(content)
+
+
+@scenario("render_links")
+def render_links(options):
+    content = document(Random(3), 30, page_titles(500), 0.3)
+    return lambda: md_wikilinks(content)
+
+
+@scenario("html_diff")
+def html_diff_revisions(options):
+    rand = Random(4)
+    old = document(rand, 40)
+    new = revise(rand, old, edits=8)
+    return lambda: html_diff(diff_texts(old, new)[0])
+
+
+@scenario("wiki_page_diff")
+def wiki_page_diff(options):
+    page = busiest_page()
+    revisions = page.wikipagerevision_set.order_by("-created", "-id")
+    # The latest edit, as linked to from the page's history.
+    to_rev, from_rev = revisions[:2]
+    return get(get_client(), reverse("wiki_page_diff", args=[page.slug]),
+               {"from_revision_pk": from_rev.pk, "to_revision_pk": to_rev.pk})
+
+
+@scenario("wiki_page_undo")
+def wiki_page_undo(options):
+    page = busiest_page()
+    revisions = list(page.wikipagerevision_set.order_by("created", "id"))
+    client = get_client()
+    # An edit from the middle of the history, which the edits after it
+    # have to be patched around, and which can be undone cleanly.
+    middle = len(revisions) // 2
+    for revision in revisions[middle:0:-1] + revisions[middle + 1:]:
+        url = reverse("wiki_page_undo", args=[page.slug, revision.pk])
+        if client.get(url).status_code == 200:
+            return get(client, url)
+    raise ValueError("No revision of %s can be undone" % page.slug)
+
+
+@scenario("wiki_page_list")
+def wiki_page_list(options):
+    return get(get_client(), reverse("wiki_page_list"))
+
+
+@scenario("wiki_page_changes")
+def wiki_page_changes(options):
+    return get(get_client(), reverse("wiki_page_changes"))
@@ -0,0 +1,96 @@
+"""
+Settings for running the benchmarks against a throwaway SQLite
+database. The database is created in a temporary directory unless
+``BENCHMARK_DATABASE`` names a file.
+"""
+import os
+import tempfile
+
+
+BENCHMARK_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+DEBUG = False
+SECRET_KEY = "benchmarks"
+SITE_ID = 1
+USE_TZ = True
+TIME_ZONE = "UTC"
+LANGUAGE_CODE = "en"
+USE_I18N = False
+ALLOWED_HOSTS = ["*"]
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ.get("BENCHMARK_DATABASE") or os.path.join(
+            tempfile.mkdtemp(prefix="wiki-benchmarks-"), "wiki.db"),
+    }
+}
+
+# Nothing is cached between runs of a scenario, so each run measures
+# the full work of the code path.
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+}
+
+ROOT_URLCONF = "benchmarks.urls"
+STATIC_URL = "/static/"
+MEDIA_URL = "/media/"
+MEDIA_ROOT = os.path.join(BENCHMARK_ROOT, "media")
+
+# A bare base template, so that the wiki's templates are measured
+# rather than a site's theme.
+TEMPLATE_DIRS = (os.path.join(BENCHMARK_ROOT, "templates"),)
+
+AUTHENTICATION_BACKENDS = ("mezzanine.core.auth_backends.MezzanineBackend",)
+
+INSTALLED_APPS = (
+    "django.contrib.admin",
+    "django.contrib.auth",
+    "django.contrib.contenttypes",
+    "django.contrib.redirects",
+    "django.contrib.sessions",
+    "django.contrib.sites",
+    "django.contrib.sitemaps",
+    "django.contrib.staticfiles",
+    "mezzanine.boot",
+    "mezzanine.conf",
+    "mezzanine.core",
+    "mezzanine.generic",
+    "mezzanine.pages",
+    "mezzanine_wiki",
+)
+
+TEMPLATE_CONTEXT_PROCESSORS = (
+    "django.contrib.auth.context_processors.auth",
+    "django.contrib.messages.context_processors.messages",
+    "django.core.context_processors.debug",
+    "django.core.context_processors.i18n",
+    "django.core.context_processors.static",
+    "django.core.context_processors.media",
+    "django.core.context_processors.request",
+    "django.core.context_processors.tz",
+    "mezzanine.conf.context_processors.settings",
+    "mezzanine.pages.context_processors.page",
+)
+
+MIDDLEWARE_CLASSES = (
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.middleware.csrf.CsrfViewMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "django.contrib.messages.middleware.MessageMiddleware",
+    "mezzanine.core.request.CurrentRequestMiddleware",
+    "mezzanine.core.middleware.TemplateForDeviceMiddleware",
+    "mezzanine.core.middleware.TemplateForHostMiddleware",
+    "mezzanine.core.middleware.SitePermissionMiddleware",
+    "mezzanine.pages.middleware.PageMiddleware",
+)
+
+PACKAGE_NAME_FILEBROWSER = "filebrowser_safe"
+PACKAGE_NAME_GRAPPELLI = "grappelli_safe"
+OPTIONAL_APPS = ()
+TESTING = False
+GRAPPELLI_INSTALLED = False
+
+from mezzanine.utils.conf import set_dynamic_settings
+set_dynamic_settings(globals())
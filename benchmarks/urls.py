@@ -0,0 +1,6 @@
+from django.conf.urls import patterns, include, url
+
+
+urlpatterns = patterns("",
+    url(r"^wiki/", include("mezzanine_wiki.urls")),
+)
@@ -19,6 +19,8 @@ if settings.WIKI_USE_FEATURED_IMAGE:
 class WikiPageRevisionInline(StackedDynamicInlineAdmin):
     model = WikiPageRevision
     extra = 0
+    exclude = ("stored_content",)
+    readonly_fields = ("content",)
 
 
 class WikiPageAdmin(DisplayableAdmin, OwnableAdmin):
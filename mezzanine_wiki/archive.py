@@ -0,0 +1,438 @@
+"""
+Archives of wiki pages with their history, written by the
+``wiki_export`` command and read by ``wiki_import``.
+
+An archive is a text file with a JSON record on each line, gzipped
+when its name ends with ``.gz``. A header record comes first, then the
+categories, then each page followed by its revisions, oldest first.
+Archives are written and read a record at a time, so that memory use
+doesn't grow with the size of the wiki.
+"""
+import gzip
+import json
+import sys
+from datetime import datetime
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from mezzanine.conf import settings
+from mezzanine.generic.models import AssignedKeyword, Keyword
+from mezzanine.utils.sites import current_site_id
+
+from mezzanine_wiki.cache import page_cache, sidebar_cache, slug_cache
+from mezzanine_wiki.jobs import batch, on_commit
+from mezzanine_wiki.models import WikiCategory, WikiPage, WikiPageRevision
+from mezzanine_wiki.utils import atomic, queryset_chunks
+
+
+ARCHIVE_FORMAT = "mezzanine_wiki"
+ARCHIVE_VERSION = 1
+
+PAGE_FIELDS = ("title", "slug", "content", "status", "publish_date",
+               "expiry_date", "created", "updated", "description",
+               "gen_description", "in_sitemap", "allow_comments")
+
+REVISION_FIELDS = ("description", "created", "updated")
+
+DATE_FIELDS = ("publish_date", "expiry_date", "created", "updated")
+
+# Largest number of values used in a single ``__in`` lookup, which
+# some databases limit.
+MAX_LOOKUP = 500
+
+
+def open_archive(path, mode="rb"):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+class ArchiveJSONEncoder(DjangoJSONEncoder):
+    """
+    Writes dates with their microseconds, which ``DjangoJSONEncoder``
+    drops, so that they're imported exactly as they were exported.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super(ArchiveJSONEncoder, self).default(o)
+
+
+def dump_record(record):
+    """
+    Returns the line of an archive for a record.
+    """
+    return json.dumps(record, cls=ArchiveJSONEncoder) + "\n"
+
+
+def parse_date(value):
+    """
+    Returns the datetime for a date in an archive, made aware or naive
+    to match the ``USE_TZ`` setting.
+    """
+    if not value:
+        return None
+    date = parse_datetime(value)
+    if settings.USE_TZ and timezone.is_naive(date):
+        date = timezone.make_aware(date, timezone.utc)
+    elif not settings.USE_TZ and timezone.is_aware(date):
+        date = timezone.make_naive(date, timezone.get_default_timezone())
+    return date
+
+
+def export_records(batch_size=500):
+    """
+    Yields the records of an archive of the current site's wiki.
+    Pages are loaded ``batch_size`` at a time, with the revisions of
+    each batch streamed from a single query.
+    """
+    yield {"type": "header", "format": ARCHIVE_FORMAT,
+           "version": ARCHIVE_VERSION}
+    for category in WikiCategory.objects.order_by("id").iterator():
+        yield {"type": "category", "slug": category.slug,
+               "title": category.title}
+    pages = WikiPage.objects.prefetch_related("categories",
+                                              "keywords__keyword")
+    for chunk in queryset_chunks(pages, batch_size):
+        usernames = dict(User.objects.filter(
+            id__in=set(page.user_id for page in chunk))
+            .values_list("id", "username"))
+        revisions = (WikiPageRevision.objects
+                     .filter(page__in=[page.pk for page in chunk])
+                     .select_related("user")
+                     .order_by("page__id", "created", "id"))
+        revisions = WikiPageRevision.objects.with_content(revisions)
+        revision, content = next(revisions, (None, None))
+        for page in chunk:
+            record = dict((name, getattr(page, name)) for name in PAGE_FIELDS)
+            record.update({
+                "type": "page",
+                "user": usernames.get(page.user_id),
+                "categories": [c.slug for c in page.categories.all()],
+                "keywords": [a.keyword.title for a in page.keywords.all()],
+            })
+            yield record
+            while revision is not None and revision.page_id == page.pk:
+                record = dict((name, getattr(revision, name))
+                              for name in REVISION_FIELDS)
+                record.update({
+                    "type": "revision",
+                    "content": content,
+                    "user": revision.user.username if revision.user else None,
+                })
+                yield record
+                revision, content = next(revisions, (None, None))
+
+
+def get_owner(username=None):
+    """
+    Returns the user with the username, or the first superuser without
+    one, to own imported pages whose user doesn't exist. Returns
+    ``None`` if there's no such user.
+    """
+    users = User.objects.order_by("id")
+    if username:
+        users = users.filter(username=username)
+    else:
+        users = users.filter(is_superuser=True)
+    return users[0] if users else None
+
+
+class Importer(object):
+    """
+    Inserts pages along with their revisions, categories and keywords
+    into the current site's wiki, in bulk. Pages are inserted in a
+    transaction a batch at a time, once the pages and revisions added
+    reach ``batch_size``. Pages with the slug of an existing page are
+    skipped along with their revisions, so that an interrupted import
+    can be run again.
+
+    A page with more revisions than fit in a batch is inserted while
+    its revisions are added, within a transaction that's committed once
+    the next page is added or the import ends, so that a page is only
+    ever imported with all of its revisions. Importers must be used as
+    context managers, whose block ending commits that transaction after
+    inserting the last batch, or rolls it back if anything raises an
+    exception, so that it's never left open.
+
+    Pages are inserted without saving each one, so the links between
+    them, the search index and the statistics stored with revisions
+    are left to the ``wiki_links``, ``wiki_search_index`` and
+    ``wiki_revision_stats`` commands.
+    """
+
+    def __init__(self, user, batch_size=1000):
+        self.user = user
+        self.batch_size = batch_size
+        self.site_id = current_site_id()
+        self.categories = dict(WikiCategory.objects.values_list("slug",
+                                                                "id"))
+        self.keywords = {}
+        self.user_ids = {}
+        self.pages = []
+        self.pending = 0
+        # Whether the revisions of the page added last are dropped, as
+        # it was skipped while they were added.
+        self.skipping = False
+        self.page_transaction = None
+        self.page_count = self.revision_count = self.skipped = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            try:
+                self.insert_pending()
+            except Exception:
+                self.end_page(*sys.exc_info())
+                raise
+        self.end_page(*exc_info)
+
+    def get_user_id(self, username):
+        """
+        Returns the ID of the user with the username, or ``None``.
+        """
+        if not username:
+            return None
+        try:
+            return self.user_ids[username]
+        except KeyError:
+            ids = User.objects.filter(username=username).values_list(
+                "id", flat=True)
+            user_id = self.user_ids[username] = ids[0] if ids else None
+            return user_id
+
+    def get_keyword_id(self, title):
+        try:
+            return self.keywords[title]
+        except KeyError:
+            keyword, created = Keyword.objects.get_or_create(title=title)
+            self.keywords[title] = keyword.id
+            return keyword.id
+
+    def add_category(self, slug, title):
+        if slug not in self.categories:
+            category = WikiCategory.objects.create(slug=slug, title=title)
+            self.categories[slug] = category.id
+
+    def add_page(self, record):
+        """
+        Adds a page from an archive record, which its revisions are
+        added after. Returns ``True`` if the pages added before were
+        inserted first.
+        """
+        flushed = (self.pending >= self.batch_size or
+                   self.page_transaction is not None)
+        if flushed:
+            self.flush()
+        self.skipping = False
+        page = WikiPage(site_id=self.site_id,
+                        user_id=(self.get_user_id(record.get("user")) or
+                                 self.user.id))
+        for name in PAGE_FIELDS:
+            if name in record:
+                value = record[name]
+                if name in DATE_FIELDS:
+                    value = parse_date(value)
+                setattr(page, name, value)
+        page.created = page.created or timezone.now()
+        page.updated = page.updated or page.created
+        page.publish_date = page.publish_date or page.created
+        keywords = record.get("keywords") or []
+        page.keywords_string = " ".join(keywords)
+        self.pages.append({"page": page, "revisions": [], "size": 0,
+                           "revision_count": 0,
+                           "categories": record.get("categories") or [],
+                           "keywords": keywords})
+        self.pending += 1
+        return flushed
+
+    def add_revision(self, record):
+        """
+        Adds a revision from an archive record to the page added last.
+        """
+        if self.skipping:
+            return
+        entry = self.pages[-1]
+        if self.pending >= self.batch_size:
+            if self.page_transaction is None:
+                # Left by ``end_page``, which the importer's block
+                # ending always calls.
+                self.page_transaction = atomic()
+                self.page_transaction.__enter__()
+            self.insert_pending()
+            if entry["page"].pk is None:
+                self.skipping = True
+                return
+            self.pages.append(entry)
+        revision = WikiPageRevision(user_id=self.get_user_id(
+            record.get("user")))
+        for name in REVISION_FIELDS:
+            if name in record:
+                value = record[name]
+                if name in DATE_FIELDS:
+                    value = parse_date(value)
+                setattr(revision, name, value)
+        revision.content = record.get("content", "")
+        revision.created = revision.created or entry["page"].created
+        revision.updated = revision.updated or revision.created
+        revision.size = len(revision.content.encode("utf-8"))
+        revision.size_change = revision.size - entry["size"]
+        if not entry["revision_count"]:
+            revision.chars_added = len(revision.content)
+        entry["size"] = revision.size
+        entry["revisions"].append(revision)
+        entry["revision_count"] += 1
+        self.pending += 1
+
+    def update_page(self, record):
+        """
+        Updates the page added last from an archive record with fields
+        only known once its revisions have been added, such as its
+        latest content and categories.
+        """
+        if self.skipping:
+            return
+        entry = self.pages[-1]
+        page = entry["page"]
+        values = {}
+        for name in PAGE_FIELDS:
+            if name in record:
+                value = record[name]
+                if name in DATE_FIELDS:
+                    value = parse_date(value)
+                values[name] = value
+                setattr(page, name, value)
+        if page.pk is not None and values:
+            WikiPage.objects.filter(pk=page.pk).update(**values)
+        if "categories" in record:
+            entry["categories"] = record["categories"] or []
+
+    def flush(self):
+        """
+        Inserts the pages added since the last flush, and commits the
+        transaction of a page inserted while its revisions were added.
+        """
+        self.insert_pending()
+        self.end_page()
+
+    def insert_pending(self):
+        entries = self.pages
+        self.pages = []
+        self.pending = 0
+        if not entries:
+            return
+        with batch(), atomic():
+            entries = self.skip_existing(entries)
+            if entries:
+                self.insert(entries)
+        if entries and self.page_transaction is None:
+            slug_cache.invalidate(self.site_id)
+            sidebar_cache.invalidate()
+
+    def end_page(self, *exc_info):
+        """
+        Commits the transaction of a page inserted while its revisions
+        were added, or rolls it back given an exception's info.
+        """
+        transaction, self.page_transaction = self.page_transaction, None
+        if transaction is None:
+            return
+        if not exc_info:
+            exc_info = (None, None, None)
+        transaction.__exit__(*exc_info)
+        if exc_info[0] is None:
+            slug_cache.invalidate(self.site_id)
+            sidebar_cache.invalidate()
+
+    def skip_existing(self, entries):
+        """
+        Returns the entries for pages whose slugs aren't taken, along
+        with the ones for pages already inserted.
+        """
+        existing = set()
+        slugs = [entry["page"].slug for entry in entries
+                 if entry["page"].pk is None]
+        for i in range(0, len(slugs), MAX_LOOKUP):
+            existing.update(WikiPage.objects.filter(
+                site_id=self.site_id, slug__in=slugs[i:i + MAX_LOOKUP])
+                .values_list("slug", flat=True))
+        new = []
+        for entry in entries:
+            slug = entry["page"].slug
+            if entry["page"].pk is not None:
+                new.append(entry)
+            elif slug in existing:
+                self.skipped += 1
+            else:
+                existing.add(slug)
+                new.append(entry)
+        return new
+
+    def insert(self, entries):
+        """
+        Inserts the pages of the entries that haven't been inserted yet,
+        and the revisions, categories and keywords of all of them.
+        """
+        created = [entry for entry in entries if entry["page"].pk is None]
+        WikiPage.objects.bulk_create([entry["page"] for entry in created],
+                                     batch_size=MAX_LOOKUP)
+        slugs = [entry["page"].slug for entry in created]
+        ids = {}
+        for i in range(0, len(slugs), MAX_LOOKUP):
+            chunk = slugs[i:i + MAX_LOOKUP]
+            ids.update(WikiPage.objects.filter(site_id=self.site_id,
+                                               slug__in=chunk)
+                       .values_list("slug", "id"))
+            # Pages rendered with links to these slugs as missing.
+            linking = WikiPage.objects.filter(site_id=self.site_id,
+                                              links__target_slug__in=chunk)
+            on_commit(page_cache.invalidate_pages, linking)
+            WikiPage.objects.filter(pk__in=list(linking.values_list(
+                "id", flat=True))).update(content_hash="")
+        through = WikiPage.categories.through
+        content_type = ContentType.objects.get_for_model(WikiPage)
+        categories = []
+        keywords = []
+        revisions = []
+        for entry in created:
+            entry["page"].pk = ids[entry["page"].slug]
+        for entry in entries:
+            page_id = entry["page"].pk
+            for slug in entry["categories"]:
+                if slug in self.categories:
+                    categories.append(through(
+                        wikipage_id=page_id,
+                        wikicategory_id=self.categories[slug]))
+            for i, title in enumerate(entry["keywords"]):
+                keywords.append(AssignedKeyword(
+                    content_type=content_type, object_pk=page_id,
+                    keyword_id=self.get_keyword_id(title), _order=i))
+            for revision in entry["revisions"]:
+                revision.page_id = page_id
+                revisions.append(revision)
+            # Dropped, so that entries carried on with the rest of their
+            # page's revisions are only given them once.
+            entry["categories"] = []
+            entry["keywords"] = []
+            entry["revisions"] = []
+        through.objects.bulk_create(categories, batch_size=MAX_LOOKUP)
+        AssignedKeyword.objects.bulk_create(keywords, batch_size=MAX_LOOKUP)
+        WikiPageRevision.objects.bulk_create(revisions, batch_size=MAX_LOOKUP)
+        page_ids = [entry["page"].pk for entry in entries]
+        for i in range(0, len(page_ids), MAX_LOOKUP):
+            latest = (WikiPageRevision.objects
+                      .filter(page__in=page_ids[i:i + MAX_LOOKUP])
+                      .order_by().values("page")
+                      .annotate(latest=Max("id")))
+            for row in latest:
+                WikiPage.objects.filter(pk=row["page"]).update(
+                    latest_revision=row["latest"])
+        self.page_count += len(created)
+        self.revision_count += len(revisions)
@@ -0,0 +1,286 @@
+from collections import OrderedDict
+from hashlib import md5
+from threading import Lock, Thread
+from time import time
+
+from django.core.cache import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
+from mezzanine.conf import settings
+from mezzanine.core.request import _thread_local, current_request
+from mezzanine.utils.sites import current_site_id
+
+from mezzanine_wiki.jobs import InlineExecutor, get_executor
+from mezzanine_wiki.metrics import count_cache
+
+
+# Cache backends whose entries aren't shared between processes.
+PRIVATE_CACHE_BACKENDS = (DummyCache, LocMemCache)
+
+
+class SlugCache(object):
+    """
+    Process-local cache of the wiki page slugs on each site, each
+    mapped to the ID and updated time of its page, or ``None`` for
+    slugs without a page. Up to ``WIKI_SLUG_CACHE_SIZE`` slugs are kept
+    per site, discarding the least recently used.
+
+    Saving or deleting a page increments a version number for its site
+    in Django's cache once the change is committed, which discards the
+    local copies held by every process on their next lookup. Without a
+    shared cache backend nothing is cached locally, as other processes
+    couldn't be told about changed pages.
+    """
+
+    version_key = "mezzanine_wiki.slugs.%s"
+
+    def __init__(self):
+        self._sites = {}
+        self._lock = Lock()
+
+    def get_version(self, site_id):
+        key = self.version_key % site_id
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, 1, None)
+            version = cache.get(key)
+        return version
+
+    def is_enabled(self, site_id=None):
+        """
+        Whether slugs are cached locally, which needs a shared cache
+        backend.
+        """
+        if isinstance(cache, PRIVATE_CACHE_BACKENDS):
+            return False
+        if site_id is None:
+            site_id = current_site_id()
+        return self.get_version(site_id) is not None
+
+    def get_local(self, site_id):
+        """
+        Returns the version number and the local ordered dict of slugs
+        for the site, least recently used first, or ``None`` for both
+        if they can't be kept.
+        """
+        if not self.is_enabled(site_id):
+            return None, None
+        version = self.get_version(site_id)
+        cached_version, slugs = self._sites.get(site_id, (None, None))
+        if cached_version != version:
+            slugs = OrderedDict()
+            self._sites[site_id] = (version, slugs)
+        return version, slugs
+
+    def get_many(self, slugs, site_id=None):
+        """
+        Returns a dict mapping each of the slugs to the ID and updated
+        time of its page, or ``None``, with at most one query for slugs
+        that aren't known locally.
+        """
+        from mezzanine_wiki.models import WikiPage
+        if site_id is None:
+            site_id = current_site_id()
+        slugs = set(slugs)
+        found = {}
+        with self._lock:
+            version, known = self.get_local(site_id)
+            if known is not None:
+                for slug in slugs:
+                    if slug in known:
+                        # Moved to the end as the most recently used.
+                        found[slug] = known[slug] = known.pop(slug)
+        unknown = slugs - set(found)
+        count_cache("slug", len(found), len(unknown))
+        if unknown:
+            pages = WikiPage.objects.filter(site_id=site_id, slug__in=unknown)
+            loaded = dict((slug, (pk, updated)) for slug, pk, updated in
+                          pages.values_list("slug", "id", "updated"))
+            for slug in unknown:
+                found[slug] = loaded.get(slug)
+            with self._lock:
+                # Not kept if pages changed while they were loaded, as
+                # they may have been loaded before the change.
+                loaded_version = version
+                version, known = self.get_local(site_id)
+                if known is not None and version == loaded_version:
+                    for slug in unknown:
+                        known[slug] = found[slug]
+                    while len(known) > settings.WIKI_SLUG_CACHE_SIZE:
+                        known.popitem(last=False)
+        return found
+
+    def get(self, slug, site_id=None):
+        """
+        Returns the ID and updated time of the page with the slug, or
+        ``None`` if there isn't one.
+        """
+        return self.get_many([slug], site_id)[slug]
+
+    def existing(self, slugs, site_id=None):
+        """
+        Returns the set of the given slugs that have a page.
+        """
+        return set(slug for slug, page in self.get_many(slugs, site_id)
+                   .items() if page is not None)
+
+    def invalidate(self, site_id):
+        """
+        Discards the cached slugs for the site in all processes.
+        """
+        key = self.version_key % site_id
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, None)
+        with self._lock:
+            self._sites.pop(site_id, None)
+
+
+class VersionedCache(object):
+    """
+    Values computed from the database that are cached in Django's
+    cache for each site, until the version number shared by all of them
+    is incremented when the data they're computed from changes, or
+    ``WIKI_SIDEBAR_CACHE_TIMEOUT`` seconds pass.
+
+    With the ``WIKI_SIDEBAR_BACKGROUND_REFRESH`` setting, an outdated
+    value is returned while a new one is computed in a thread, instead
+    of making the request wait for it. Like jobs, the value is computed
+    right away when they're run by ``InlineExecutor``.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.version_key = "mezzanine_wiki.%s.version" % name
+        self.invalidated_key = "mezzanine_wiki.%s.invalidated" % name
+
+    def get_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, 1, None)
+            version = cache.get(self.version_key)
+        return version
+
+    def get(self, name, func):
+        """
+        Returns the cached value with the given name, calling ``func``
+        to compute it if needed.
+        """
+        key = "mezzanine_wiki.%s.%s.%s" % (self.name, current_site_id(), name)
+        version = self.get_version()
+        cached = cache.get(key)
+        if cached is not None:
+            cached_version, expires, value = cached
+            if cached_version == version and expires > time():
+                count_cache(self.name, hits=1)
+                return value
+            if (settings.WIKI_SIDEBAR_BACKGROUND_REFRESH and
+                    not isinstance(get_executor(), InlineExecutor)):
+                if cache.add(key + ".refresh", True, 60):
+                    thread = Thread(target=self.refresh_thread,
+                                    args=(current_request(), key, version,
+                                          func))
+                    thread.daemon = True
+                    thread.start()
+                return value
+        count_cache(self.name, misses=1)
+        return self.refresh(key, version, func)
+
+    def refresh(self, key, version, func):
+        value = func()
+        expires = time() + settings.WIKI_SIDEBAR_CACHE_TIMEOUT
+        cache.set(key, (version, expires, value), None)
+        return value
+
+    def refresh_thread(self, request, key, version, func):
+        # The request is used to look up the same site as the request
+        # that started the thread.
+        _thread_local.request = request
+        try:
+            self.refresh(key, version, func)
+        finally:
+            cache.delete(key + ".refresh")
+            _thread_local.request = None
+            connection.close()
+
+    def get_invalidated(self):
+        """
+        Returns the time the values were last outdated, in whole seconds
+        since the epoch, or ``None`` if it isn't known.
+        """
+        return cache.get(self.invalidated_key)
+
+    def invalidate(self):
+        """
+        Outdates all the values for every site.
+        """
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            cache.add(self.version_key, 1, None)
+        cache.set(self.invalidated_key, int(time()), None)
+
+
+class PageCache(object):
+    """
+    Wiki pages as rendered for anonymous users, cached for the number
+    of seconds given by the ``WIKI_PAGE_CACHE_TIMEOUT`` setting, which
+    turns the cache on. Entries are deleted when anything shown on the
+    page changes, and outdated by changes to the sidebar.
+    """
+
+    def get_key(self, slug, site_id=None):
+        if site_id is None:
+            site_id = current_site_id()
+        return "mezzanine_wiki.page.%s.%s" % (
+            site_id, md5(slug.encode("utf-8")).hexdigest())
+
+    def get(self, slug, variant):
+        """
+        Returns the cached response for the page as a dict, or ``None``.
+        ``variant`` identifies other things the page was rendered for,
+        such as the language.
+        """
+        if not settings.WIKI_PAGE_CACHE_TIMEOUT:
+            return None
+        entry = cache.get(self.get_key(slug))
+        if entry is not None:
+            entry_variant, sidebar_version, response = entry
+            if (entry_variant == variant and
+                    sidebar_version == sidebar_cache.get_version()):
+                count_cache("page", hits=1)
+                return response
+        count_cache("page", misses=1)
+        return None
+
+    def set(self, slug, variant, sidebar_version, response, timeout=None):
+        """
+        Caches a response dict for the page, rendered with the given
+        sidebar version.
+        """
+        if timeout is None:
+            timeout = settings.WIKI_PAGE_CACHE_TIMEOUT
+        cache.set(self.get_key(slug), (variant, sidebar_version, response),
+                  timeout)
+
+    def invalidate(self, slugs, site_id):
+        """
+        Deletes the cached pages with the given slugs.
+        """
+        if settings.WIKI_PAGE_CACHE_TIMEOUT:
+            cache.delete_many([self.get_key(slug, site_id) for slug in slugs])
+
+    def invalidate_pages(self, pages):
+        """
+        Deletes the cached pages for a queryset of pages.
+        """
+        if settings.WIKI_PAGE_CACHE_TIMEOUT:
+            cache.delete_many([self.get_key(slug, site_id) for site_id, slug
+                               in pages.values_list("site_id", "slug")])
+
+
+slug_cache = SlugCache()
+sidebar_cache = VersionedCache("sidebar")
+page_cache = PageCache()
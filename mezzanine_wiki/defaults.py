@@ -26,6 +26,15 @@ register_setting(
     default=10,
 )
 
+register_setting(
+    name="WIKI_CHANGES_PER_PAGE",
+    label=_("Wiki changes per page"),
+    description=_("Number of revisions shown on each page of recent "
+                  "wiki changes"),
+    editable=True,
+    default=50,
+)
+
 register_setting(
     name="WIKI_TEXT_FILTER",
     description=_("Wiki markup language filter"),
@@ -33,6 +42,188 @@ register_setting(
     default="mezzanine_wiki.filters.md_wikilinks",
 )
 
+register_setting(
+    name="WIKI_TEXT_FILTER_VERSION",
+    description=_("Version of the wiki markup filter output. Increase it "
+                  "to re-render all stored wiki content."),
+    editable=False,
+    default=1,
+)
+
+register_setting(
+    name="WIKI_REVISION_SNAPSHOT_INTERVAL",
+    description=_("Store the content of every Nth wiki page revision in "
+                  "full, and the revisions in between as patches against "
+                  "it. Set to 0 to store every revision in full."),
+    editable=False,
+    default=0,
+)
+
+register_setting(
+    name="WIKI_SEARCH_BACKEND",
+    description=_("Dotted path to the search backend for wiki pages."),
+    editable=False,
+    default="mezzanine_wiki.search.IndexSearchBackend",
+)
+
+register_setting(
+    name="WIKI_SEARCH_WEIGHTS",
+    description=_("Weights of the wiki page fields used when ranking "
+                  "search results."),
+    editable=False,
+    default={"title": 3, "categories": 2, "content": 1},
+)
+
+register_setting(
+    name="WIKI_SEARCH_SNIPPET_LENGTH",
+    description=_("Number of characters of wiki page content shown with "
+                  "each search result."),
+    editable=False,
+    default=200,
+)
+
+register_setting(
+    name="WIKI_DENORMALIZED_LISTS",
+    description=_("If ``True``, the categories and keywords of each wiki "
+                  "page are stored with the page, so that page lists "
+                  "don't need to query them. Run the ``wiki_page_lists`` "
+                  "command after turning it on."),
+    editable=False,
+    default=False,
+)
+
+register_setting(
+    name="WIKI_DIFF_TIMEOUT",
+    description=_("Number of seconds spent refining a diff between two "
+                  "revisions before a coarser diff is shown. 0 means no "
+                  "limit."),
+    editable=False,
+    default=1.0,
+)
+
+register_setting(
+    name="WIKI_DIFF_LINE_MODE_THRESHOLD",
+    description=_("Revisions longer than this many characters are always "
+                  "compared line by line."),
+    editable=False,
+    default=50000,
+)
+
+register_setting(
+    name="WIKI_DIFF_CACHE_TIMEOUT",
+    description=_("Number of seconds diffs between revisions are cached."),
+    editable=False,
+    default=60 * 60 * 24,
+)
+
+register_setting(
+    name="WIKI_SECTION_CACHE_TIMEOUT",
+    description=_("Number of seconds the rendered sections of wiki pages "
+                  "are cached, so that editing a section of a page only "
+                  "renders that section again. 0 turns the cache off."),
+    editable=False,
+    default=60 * 60 * 24,
+)
+
+register_setting(
+    name="WIKI_PAGE_CACHE_TIMEOUT",
+    description=_("Number of seconds wiki pages are cached for anonymous "
+                  "users. Pages are also removed from the cache when "
+                  "they change. 0 turns the cache off."),
+    editable=False,
+    default=0,
+)
+
+register_setting(
+    name="WIKI_SIDEBAR_CACHE_TIMEOUT",
+    description=_("Number of seconds the recent pages, categories, authors "
+                  "and tags in the wiki sidebar are cached for. They're "
+                  "also updated when pages, categories or tags change."),
+    editable=False,
+    default=300,
+)
+
+register_setting(
+    name="WIKI_SIDEBAR_BACKGROUND_REFRESH",
+    description=_("If ``True``, outdated wiki sidebar contents are shown "
+                  "while they're updated in a background thread, unless "
+                  "``WIKI_JOB_EXECUTOR`` runs jobs inline."),
+    editable=False,
+    default=False,
+)
+
+register_setting(
+    name="WIKI_SLUG_CACHE_SIZE",
+    description=_("Maximum number of page slugs cached by each process "
+                  "when checking which wikilinks lead to missing pages. "
+                  "Slugs are only cached with a cache backend shared "
+                  "between processes, not the local-memory or dummy "
+                  "cache."),
+    editable=False,
+    default=10000,
+)
+
+register_setting(
+    name="WIKI_JOB_EXECUTOR",
+    description=_("Dotted path to the executor that runs the jobs updating "
+                  "the search index and other data derived from wiki pages "
+                  "once they're saved. One of "
+                  "``mezzanine_wiki.jobs.InlineExecutor``, "
+                  "``mezzanine_wiki.jobs.ThreadExecutor`` or "
+                  "``mezzanine_wiki.jobs.DatabaseExecutor``, whose jobs are "
+                  "run by the ``wiki_worker`` command."),
+    editable=False,
+    default="mezzanine_wiki.jobs.InlineExecutor",
+)
+
+register_setting(
+    name="WIKI_JOB_THREADS",
+    description=_("Number of threads running jobs in each process with "
+                  "``ThreadExecutor``."),
+    editable=False,
+    default=2,
+)
+
+register_setting(
+    name="WIKI_JOB_RETRIES",
+    description=_("Number of times a failed job is retried."),
+    editable=False,
+    default=3,
+)
+
+register_setting(
+    name="WIKI_JOB_RETRY_DELAY",
+    description=_("Number of seconds before a failed job is first retried, "
+                  "doubled for each retry after."),
+    editable=False,
+    default=10,
+)
+
+register_setting(
+    name="WIKI_JOB_TIMEOUT",
+    description=_("Number of seconds a job claimed by ``wiki_worker`` is "
+                  "left to run before another worker may run it again."),
+    editable=False,
+    default=300,
+)
+
+register_setting(
+    name="WIKI_QUERY_BUDGETS",
+    description=_("Most queries each wiki view should make, by the name of "
+                  "the view, replacing the budgets the views declare."),
+    editable=False,
+    default={},
+)
+
+register_setting(
+    name="WIKI_QUERY_REPEAT_THRESHOLD",
+    description=_("Number of times a query can be repeated by a wiki view "
+                  "before it's reported as a query made for each item "
+                  "shown."),
+    editable=False,
+    default=5,
+)
+
 register_setting(
     name="WIKI_TEXT_WIDGET_CLASS",
     description=_("Wiki text widget class"),
@@ -0,0 +1,200 @@
+import re
+import sys
+from time import time
+
+from diff_match_patch import diff_match_patch
+from django.core.cache import cache
+
+from mezzanine.conf import settings
+from mezzanine_wiki.metrics import count_cache, timed, timer
+
+
+DIFF_DELETE = diff_match_patch.DIFF_DELETE
+DIFF_INSERT = diff_match_patch.DIFF_INSERT
+DIFF_EQUAL = diff_match_patch.DIFF_EQUAL
+
+# Whitespace, words and single other characters.
+WORD_RE = re.compile(r"\s+|\w+|[^\w\s]", re.UNICODE)
+
+
+def tokens_to_chars(text1, text2, pattern):
+    """
+    Like ``diff_match_patch.diff_linesToChars``, but splitting the texts
+    into the tokens matched by the pattern instead of lines. Returns
+    ``None`` if there are too many distinct tokens to encode.
+    """
+    tokens = [""]
+    token_ids = {}
+
+    def encode(text):
+        chars = []
+        for token in pattern.findall(text):
+            if token not in token_ids:
+                token_ids[token] = len(tokens)
+                tokens.append(token)
+            chars.append(unichr(token_ids[token]))
+        return "".join(chars)
+
+    try:
+        return encode(text1), encode(text2), tokens
+    except ValueError:
+        return None
+
+
+@timed("diff")
+def diff_texts(text1, text2, mode="chars"):
+    """
+    Returns a list of ``(op, text)`` diffs between two texts, compared
+    by ``chars``, ``words`` or ``lines``, and whether the diff is
+    coarser than asked for.
+
+    Texts longer than ``WIKI_DIFF_LINE_MODE_THRESHOLD`` are always
+    compared by lines, and the diff stops being refined once
+    ``WIKI_DIFF_TIMEOUT`` seconds have passed since the call. Comparing
+    chars gets half of that time, and past its deadline is started over
+    by lines, which is much faster, in the time left. Diffs cut short by
+    either deadline are marked as coarse.
+    """
+    dmp = diff_match_patch()
+    timeout = settings.WIKI_DIFF_TIMEOUT
+    start = time()
+    deadline = start + timeout if timeout > 0 else sys.maxint
+    coarse = False
+    if max(len(text1), len(text2)) > settings.WIKI_DIFF_LINE_MODE_THRESHOLD:
+        coarse = mode != "lines"
+        mode = "lines"
+    if mode == "chars":
+        chars_deadline = start + timeout / 2.0 if timeout > 0 else deadline
+        diffs = dmp.diff_main(text1, text2, True, chars_deadline)
+        if time() < chars_deadline:
+            dmp.diff_cleanupSemantic(diffs)
+            return diffs, False
+        coarse = True
+        mode = "lines"
+    encoded = None
+    if mode == "words":
+        encoded = tokens_to_chars(text1, text2, WORD_RE)
+        coarse = coarse or encoded is None
+    if encoded is None:
+        encoded = dmp.diff_linesToChars(text1, text2)
+    chars1, chars2, tokens = encoded
+    diffs = dmp.diff_main(chars1, chars2, False, deadline)
+    dmp.diff_charsToLines(diffs, tokens)
+    if time() >= deadline:
+        coarse = True
+    return diffs, coarse
+
+
+def diff_stats(text1, text2):
+    """
+    Returns the number of characters added and removed by the changes
+    from one text to another.
+    """
+    diffs, coarse = diff_texts(text1, text2)
+    added = sum(len(text) for op, text in diffs if op == DIFF_INSERT)
+    removed = sum(len(text) for op, text in diffs if op == DIFF_DELETE)
+    return added, removed
+
+
+def merge_texts(base, mine, theirs):
+    """
+    Applies the changes from ``base`` to ``mine`` onto ``theirs``, a
+    different version of ``base``. Returns the merged text and whether
+    all of the changes applied cleanly.
+    """
+    dmp = diff_match_patch()
+    dmp.Diff_Timeout = settings.WIKI_DIFF_TIMEOUT
+    # Only apply changes where their context matches closely, anywhere
+    # in the text.
+    dmp.Match_Threshold = 0.1
+    dmp.Match_Distance = max(len(theirs), 1000)
+    with timer("patch"):
+        patches = dmp.patch_make(base, mine)
+        merged, results = dmp.patch_apply(patches, theirs)
+    return merged, all(results)
+
+
+def get_revision_diff(from_revision, to_revision, mode="chars"):
+    """
+    Returns ``diff_texts`` for the content of two revisions. Revisions
+    don't change once saved, so the result is cached by their IDs and
+    their content is only loaded when it isn't cached.
+    """
+    key = "mezzanine_wiki.diff.%s.%s.%s" % (from_revision.pk,
+                                            to_revision.pk, mode)
+    result = cache.get(key)
+    if result is None:
+        count_cache("diff", misses=1)
+        result = diff_texts(from_revision.content, to_revision.content, mode)
+        cache.set(key, result, settings.WIKI_DIFF_CACHE_TIMEOUT)
+    else:
+        count_cache("diff", hits=1)
+    return result
+
+
+def diff_lines(diffs):
+    """
+    Splits diffs compared by lines into an ``(op, line)`` per line.
+    """
+    lines = []
+    for op, text in diffs:
+        lines.extend((op, line) for line in text.splitlines())
+    return lines
+
+
+def context_rows(rows, changed, context):
+    """
+    Replaces runs of rows more than ``context`` rows away from a
+    changed row with a single ``None``.
+    """
+    keep = set()
+    for i, row in enumerate(rows):
+        if changed(row):
+            keep.update(range(i - context, i + context + 1))
+    result = []
+    for i, row in enumerate(rows):
+        if i in keep:
+            result.append(row)
+        elif not result or result[-1] is not None:
+            result.append(None)
+    return result
+
+
+def unified_rows(diffs, context=3):
+    """
+    Returns ``(op, line)`` rows for a unified view of diffs compared by
+    lines, with unchanged lines away from changes left out.
+    """
+    return context_rows(diff_lines(diffs), lambda row: row[0] != DIFF_EQUAL,
+                        context)
+
+
+def split_rows(diffs, context=3):
+    """
+    Returns ``(left_op, left_line, right_op, right_line)`` rows for a
+    side by side view of diffs compared by lines. Deleted lines are
+    shown next to the lines inserted in their place.
+    """
+    rows = []
+    deleted = []
+    inserted = []
+
+    def pair():
+        for i in range(max(len(deleted), len(inserted))):
+            left = deleted[i] if i < len(deleted) else None
+            right = inserted[i] if i < len(inserted) else None
+            rows.append((DIFF_DELETE if left is not None else None, left,
+                         DIFF_INSERT if right is not None else None, right))
+        del deleted[:]
+        del inserted[:]
+
+    for op, line in diff_lines(diffs):
+        if op == DIFF_DELETE:
+            deleted.append(line)
+        elif op == DIFF_INSERT:
+            inserted.append(line)
+        else:
+            pair()
+            rows.append((DIFF_EQUAL, line, DIFF_EQUAL, line))
+    pair()
+    return context_rows(rows, lambda row: row[0] != DIFF_EQUAL, context)
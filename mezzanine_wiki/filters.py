@@ -1,13 +1,215 @@
-from django.core.urlresolvers import reverse
-from markdown import markdown
+import re
+from hashlib import sha1
+from threading import local
+
+from django.core.cache import cache
+from django.core.urlresolvers import reverse, get_script_prefix, get_urlconf
+from markdown import Markdown
+from mezzanine.conf import settings
 from mezzanine_wiki.mdx_wikilinks_extra import WikiLinkExtraExtension
+from mezzanine_wiki.metrics import count_cache
+
+
+# Headings that start a block, which nothing before them can continue.
+SECTION_RE = re.compile(r"\n[ \t]*\n(?=#)")
+
+# Raw HTML blocks and reference link definitions, which can't be
+# rendered apart from the rest of the document.
+UNSPLITTABLE_RE = re.compile(r"^(?:<|[ ]{0,3}\[[^\]]+\]:)", re.MULTILINE)
+
+
+def split_sections(content):
+    """
+    Splits markdown into sections at its headings, which render to the
+    same HTML separately as they do together, joined by newlines.
+    Content with raw HTML blocks or reference links isn't split.
+    """
+    content = content.replace("\r\n", "\n").replace("\r", "\n")
+    if UNSPLITTABLE_RE.search(content):
+        return [content]
+    starts = [0] + [match.end() for match in SECTION_RE.finditer(content)]
+    return [content[start:end] for start, end in
+            zip(starts, starts[1:] + [len(content)])]
+
+
+class MarkdownRenderer(object):
+    """
+    Renders content with a ``Markdown`` instance that is set up once
+    per thread and reset between documents, instead of setting up the
+    instance and its extensions again for every document.
+    """
+
+    def __init__(self):
+        self._local = local()
+
+    def get_extensions(self):
+        """
+        Returns the extensions for a new ``Markdown`` instance.
+        """
+        return []
+
+    def get_markdown(self):
+        md = getattr(self._local, "markdown", None)
+        if md is None:
+            md = Markdown(extensions=self.get_extensions())
+            self._local.markdown = md
+        return md
+
+    def convert(self, content):
+        """
+        Renders a document or a section of one, returning the HTML and
+        the set of slugs linked to by wikilinks in it.
+        """
+        md = self.get_markdown()
+        try:
+            return md.convert(content), set(getattr(md, "wikilinks", ()))
+        finally:
+            md.reset()
+
+    def render(self, content):
+        return self.render_with_links(content)[0]
+
+    def render_with_links(self, content):
+        """
+        Renders content, returning the HTML and the set of slugs
+        linked to by wikilinks in it. Content with several sections is
+        rendered a section at a time, with each section's HTML cached
+        for ``WIKI_SECTION_CACHE_TIMEOUT`` seconds, so that only the
+        sections changed since content was last rendered are rendered.
+        """
+        if not settings.WIKI_SECTION_CACHE_TIMEOUT:
+            return self.convert(content)
+        sections = split_sections(content)
+        if len(sections) < 2:
+            return self.convert(content)
+        return self.render_sections(sections)
+
+    def get_section_states(self, sections):
+        """
+        Returns a string for each section identifying anything other
+        than its content that its HTML depends on.
+        """
+        return [""] * len(sections)
+
+    def get_section_key(self, section, state):
+        from mezzanine_wiki.utils import get_renderer_version
+        key = "\0".join((type(self).__name__, get_renderer_version(),
+                          state, section))
+        return "mezzanine_wiki.section.%s" % sha1(
+            key.encode("utf-8")).hexdigest()
+
+    def render_sections(self, sections):
+        """
+        Renders each section, or takes its HTML from the cache, and
+        joins them together.
+        """
+        keys = [self.get_section_key(section, state) for section, state in
+                zip(sections, self.get_section_states(sections))]
+        cached = cache.get_many(keys)
+        rendered = {}
+        html = []
+        links = set()
+        for key, section in zip(keys, sections):
+            if key in cached:
+                section_html, section_links = cached[key]
+            else:
+                section_html, section_links = self.convert(section)
+                rendered[key] = (section_html, section_links)
+            if section_html:
+                html.append(section_html)
+            links.update(section_links)
+        count_cache("section", len(keys) - len(rendered), len(rendered))
+        if rendered:
+            cache.set_many(rendered, settings.WIKI_SECTION_CACHE_TIMEOUT)
+        return "\n".join(html), links
+
+    def render_many(self, contents):
+        """
+        Renders a sequence of documents, returning a list of HTML.
+        """
+        return [self.render(content) for content in contents]
+
+
+class WikiLinksRenderer(MarkdownRenderer):
+    """
+    Markdown renderer with the wikilinks extension. Links are relative
+    to the wiki index, which is only reversed once for each script
+    prefix and URLconf, with a ``Markdown`` instance for each.
+    """
+
+    def __init__(self):
+        super(WikiLinksRenderer, self).__init__()
+        self._base_urls = {}
+
+    def get_base_url(self):
+        key = (get_script_prefix(), get_urlconf())
+        try:
+            return self._base_urls[key]
+        except KeyError:
+            base_url = self._base_urls[key] = reverse("wiki_index")
+            return base_url
+
+    def get_extensions(self):
+        configs = {"base_url": self.get_base_url(), "exists": self.existing}
+        return [WikiLinkExtraExtension(configs=configs)]
+
+    def existing(self, slugs):
+        """
+        Returns the set of the given slugs that have a page, using the
+        slugs already looked up for the sections of the document being
+        rendered.
+        """
+        from mezzanine_wiki.cache import slug_cache
+        known = getattr(self._local, "existing", None)
+        if known is not None and slugs <= known[0]:
+            return slugs & known[1]
+        return slug_cache.existing(slugs)
+
+    def get_section_states(self, sections):
+        """
+        Returns the base URL of links and the slugs linked to that have
+        a page for each section, looked up for all of them at once.
+        """
+        from mezzanine_wiki.cache import slug_cache
+        from mezzanine_wiki.utils import extract_wikilinks
+        section_links = [extract_wikilinks(section) for section in sections]
+        slugs = set().union(*section_links)
+        existing = slug_cache.existing(slugs) if slugs else set()
+        self._local.existing = (slugs, existing)
+        base_url = self.get_base_url()
+        return ["%s %s" % (base_url, " ".join(sorted(links & existing)))
+                for links in section_links]
+
+    def render_sections(self, sections):
+        try:
+            return super(WikiLinksRenderer, self).render_sections(sections)
+        finally:
+            self._local.existing = None
+
+    def get_markdown(self):
+        base_url = self.get_base_url()
+        instances = getattr(self._local, "instances", None)
+        if instances is None:
+            instances = self._local.instances = {}
+        md = instances.get(base_url)
+        if md is None:
+            md = instances[base_url] = Markdown(
+                extensions=self.get_extensions())
+        return md
+
+
+plain_renderer = MarkdownRenderer()
+wikilinks_renderer = WikiLinksRenderer()
 
 
 def md_plain(content):
     """
     Renders content using markdown.
     """
-    return markdown(content)
+    return plain_renderer.render(content)
+
+md_plain.render_many = plain_renderer.render_many
+md_plain.render_with_links = plain_renderer.render_with_links
 
 
 def md_wikilinks(content):
@@ -15,8 +217,7 @@ def md_wikilinks(content):
     Renders content using markdown with wikilinks.
     Format: [[link|optional label]]
     """
-    base_url = reverse('wiki_index')
-    configs = {'base_url': base_url}
-    wikilinks_extra = WikiLinkExtraExtension(configs=configs)
-    return markdown(content,[wikilinks_extra])
+    return wikilinks_renderer.render(content)
 
+md_wikilinks.render_many = wikilinks_renderer.render_many
+md_wikilinks.render_with_links = wikilinks_renderer.render_with_links
@@ -14,6 +14,9 @@ class PlainWidget(forms.Textarea):
 class WikiPageForm(forms.ModelForm):
     summary = forms.CharField(label=_("Edit summary"),
                                   max_length=400, required=False)
+    # The page's latest revision when editing started.
+    base_revision = forms.IntegerField(widget=forms.HiddenInput,
+                                       required=False)
 
     class Meta:
         model = WikiPage
@@ -0,0 +1,240 @@
+"""
+Generating wikis of made up pages for the ``wiki_generate`` command,
+to test and benchmark the wiki at scale.
+
+Everything is generated from a seed, so that the same options always
+generate the same wiki. Pages are inserted in bulk by the archive
+``Importer``, so as with imports, the data derived from the pages is
+left to the ``wiki_links``, ``wiki_search_index`` and
+``wiki_revision_stats`` commands.
+"""
+from datetime import datetime, timedelta
+from random import Random
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+from mezzanine.conf import settings
+from mezzanine.core.models import CONTENT_STATUS_PUBLISHED
+from mezzanine.utils.urls import slugify
+
+from mezzanine_wiki.archive import MAX_LOOKUP, Importer
+from mezzanine_wiki.mdx_wikilinks_extra import clean_label
+
+
+WORDS = """
+    a about above across after again against all almost alone along also
+    always among an and another any anyone anything are around as ask at
+    away back be because become been before began behind being below
+    best better between big both but by call came can case change child
+    city close come could country course day did different do does down
+    during each early end enough even every eye face fact family far feel
+    few find first follow for form found from get give go good great group
+    hand hard has have head help here high home house how if important in
+    into is it keep kind know large last late later leave left life light
+    like line little live long look made make man many may mean might more
+    most move much must name need never new next night no not now number
+    of off often old on once one only open or order other our out over
+    own part people place point possible power present problem program
+    public put question quite rather read really right room run same say
+    school seem set several she should show side since small so some
+    something start state still story study such system take than that
+    the their them then there these they thing think this those though
+    three through time to together too turn two under until up upon us
+    use very want water way we well were what when where which while who
+    why will with word work world would write year yet you young
+""".split()
+
+DISTRIBUTIONS = ("constant", "uniform", "pareto")
+
+# Shape of the pareto distribution of revision counts, where most
+# pages have a few revisions and a few pages have very many.
+PARETO_ALPHA = 1.5
+
+# Date the history of generated wikis starts from.
+START_DATE = datetime(2010, 1, 1)
+
+
+def sentence(rand, titles=(), link_ratio=0.0):
+    # Indexing with ``random()`` is a good deal faster than ``choice``.
+    random = rand.random
+    words = [WORDS[int(random() * len(WORDS))]
+             for i in range(rand.randint(6, 18))]
+    if titles and link_ratio:
+        for i in range(len(words)):
+            if random() < link_ratio:
+                words[i] = "[[%s]]" % titles[int(random() * len(titles))]
+    words[0] = words[0].capitalize()
+    return " ".join(words) + "."
+
+
+def paragraph(rand, titles=(), link_ratio=0.0):
+    return " ".join(sentence(rand, titles, link_ratio)
+                    for i in range(rand.randint(2, 6)))
+
+
+def document(rand, paragraphs, titles=(), link_ratio=0.0):
+    """
+    Returns a markdown document of about the given number of
+    paragraphs, with headings, lists and emphasis, where roughly
+    ``link_ratio`` of the words are wikilinks to the titles.
+    """
+    blocks = []
+    for i in range(paragraphs):
+        if i % 5 == 0:
+            blocks.append("%s %s" % ("#" * rand.randint(1, 3),
+                                     sentence(rand).rstrip(".")))
+        if rand.random() < 0.2:
+            blocks.append("\n".join("* %s" % sentence(rand, titles,
+                                                       link_ratio)
+                                    for j in range(rand.randint(2, 5))))
+        else:
+            text = paragraph(rand, titles, link_ratio)
+            if rand.random() < 0.3:
+                word = rand.choice(WORDS)
+                text = text.replace(" %s " % word, " **%s** " % word, 1)
+            blocks.append(text)
+    return "\n\n".join(blocks)
+
+
+def revise(rand, content, edits=3, titles=(), link_ratio=0.0):
+    """
+    Returns the content with a few paragraphs changed, added or
+    removed, like a typical edit.
+    """
+    blocks = content.split("\n\n")
+    for i in range(edits):
+        action = rand.random()
+        position = rand.randrange(len(blocks) + 1)
+        if action < 0.6 and position < len(blocks):
+            words = blocks[position].split(" ")
+            for j in range(rand.randint(1, 4)):
+                words[rand.randrange(len(words))] = rand.choice(WORDS)
+            blocks[position] = " ".join(words)
+        elif action < 0.85 or len(blocks) < 2:
+            blocks.insert(position, paragraph(rand, titles, link_ratio))
+        else:
+            del blocks[min(position, len(blocks) - 1)]
+    return "\n\n".join(blocks)
+
+
+def page_titles(count):
+    """
+    Returns ``count`` distinct page titles.
+    """
+    return ["%s %s" % (WORDS[i % len(WORDS)].capitalize(), i)
+            for i in range(count)]
+
+
+def revision_count(rand, distribution, mean, maximum):
+    """
+    Returns the number of revisions for a page, drawn from the given
+    distribution of counts averaging about ``mean``.
+    """
+    if distribution == "constant":
+        count = mean
+    elif distribution == "uniform":
+        count = rand.randint(1, max(mean * 2 - 1, 1))
+    elif distribution == "pareto":
+        scale = mean * (PARETO_ALPHA - 1) / PARETO_ALPHA
+        count = int(round(scale * rand.paretovariate(PARETO_ALPHA)))
+    else:
+        raise ValueError("Unknown distribution: %s" % distribution)
+    return min(max(count, 1), maximum)
+
+
+def create_authors(count):
+    """
+    Returns the usernames of ``count`` users to author pages, creating
+    the ones that don't exist.
+    """
+    usernames = ["wiki-author-%s" % i for i in range(count)]
+    existing = set()
+    for i in range(0, count, MAX_LOOKUP):
+        existing.update(User.objects.filter(
+            username__in=usernames[i:i + MAX_LOOKUP])
+            .values_list("username", flat=True))
+    users = []
+    for username in usernames:
+        if username not in existing:
+            user = User(username=username, email="%s@example.com" % username)
+            user.set_unusable_password()
+            users.append(user)
+    User.objects.bulk_create(users, batch_size=MAX_LOOKUP)
+    return usernames
+
+
+def date_string(date):
+    if settings.USE_TZ:
+        date = timezone.make_aware(date, timezone.utc)
+    return date.isoformat()
+
+
+def generate(owner, pages, revisions=5, distribution="pareto",
+             max_revisions=1000, authors=20, categories=20, keywords=50,
+             link_ratio=0.02, anonymous_ratio=0.05, seed=0,
+             batch_size=1000, progress=None):
+    """
+    Generates ``pages`` pages with about ``revisions`` revisions each,
+    returning the ``Importer`` that inserted them. Pages whose slugs
+    are taken are skipped, so generating a wiki again with the same
+    options adds nothing. ``progress`` is called with the importer
+    each time a batch of pages is inserted.
+    """
+    rand = Random(seed)
+    titles = page_titles(pages)
+    usernames = create_authors(authors)
+    keyword_titles = rand.sample(WORDS, min(keywords, len(WORDS)))
+    importer = Importer(owner, batch_size)
+    category_slugs = []
+    for title in page_titles(categories):
+        slug = slugify(title)
+        importer.add_category(slug, title)
+        category_slugs.append(slug)
+    span = timedelta(days=365 * 3).total_seconds()
+    with importer:
+        for title in titles:
+            count = revision_count(rand, distribution, revisions,
+                                   max_revisions)
+            date = START_DATE + timedelta(seconds=rand.random() * span)
+            content = document(rand, rand.randint(3, 20), titles, link_ratio)
+            history = []
+            for i in range(count):
+                if i:
+                    content = revise(rand, content, rand.randint(1, 4), titles,
+                                     link_ratio)
+                    date += timedelta(minutes=rand.randint(1, 60 * 24 * 7))
+                if not usernames or rand.random() < anonymous_ratio:
+                    author = None
+                else:
+                    author = rand.choice(usernames)
+                history.append({
+                    "type": "revision",
+                    "content": content,
+                    "description": (sentence(rand) if rand.random() < 0.5
+                                    else ""),
+                    "user": author,
+                    "created": date_string(date),
+                })
+            page_categories = category_slugs and rand.sample(
+                category_slugs, rand.randint(0, min(3, len(category_slugs))))
+            page_keywords = keyword_titles and rand.sample(
+                keyword_titles, rand.randint(0, min(5, len(keyword_titles))))
+            flushed = importer.add_page({
+                "type": "page",
+                "title": title,
+                "slug": clean_label(title),
+                "content": content,
+                "status": CONTENT_STATUS_PUBLISHED,
+                "user": history[0]["user"],
+                "created": history[0]["created"],
+                "updated": history[-1]["created"],
+                "categories": page_categories,
+                "keywords": page_keywords,
+            })
+            for record in history:
+                importer.add_revision(record)
+            if flushed and progress is not None:
+                progress(importer)
+    if progress is not None:
+        progress(importer)
+    return importer
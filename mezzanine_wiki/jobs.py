@@ -0,0 +1,397 @@
+"""
+Work that keeps data derived from wiki pages up to date, such as the
+search index, done once the changes it's derived from are saved.
+
+Jobs are identified by a name and the ID of the object they update,
+and recompute everything from the object as it is when they run, so
+scheduling the same job several times only needs running it once, and
+a failed job can simply be run again. Jobs scheduled within ``batch``,
+or while handling a request, are collected and handed to the executor
+given by the ``WIKI_JOB_EXECUTOR`` setting at the end of the batch or
+request, after the changes have been committed. Cached copies of the
+changes are discarded at the same point, with ``on_commit``.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timedelta
+from logging import getLogger
+from operator import or_
+from Queue import Queue
+from threading import Lock, Thread, Timer, local
+
+from django.core.signals import request_finished, request_started
+from django.db import connection
+from django.db.models import Q
+from django.dispatch import receiver
+from django.utils.timezone import now
+from mezzanine.conf import settings
+from mezzanine.core.request import _thread_local, current_request
+from mezzanine.utils.importing import import_dotted_path
+from mezzanine.utils.sites import current_site_id
+
+
+logger = getLogger(__name__)
+
+# Job functions, keyed by name.
+_jobs = {}
+
+# Executors instantiated so far, keyed by dotted path.
+_executors = {}
+
+# Jobs scheduled by the current thread that haven't been submitted.
+_local = local()
+
+
+def register(name):
+    """
+    Decorator that registers a function as the job with the given
+    name. The function is called with the ID of an object.
+    """
+    def decorator(func):
+        _jobs[name] = func
+        return func
+    return decorator
+
+
+def get_executor():
+    """
+    Returns the executor specified by the ``WIKI_JOB_EXECUTOR``
+    setting.
+    """
+    path = settings.WIKI_JOB_EXECUTOR
+    try:
+        return _executors[path]
+    except KeyError:
+        executor = _executors[path] = import_dotted_path(path)()
+        return executor
+
+
+class SiteRequest(object):
+    """
+    Stands in for the current request while a job runs, so that
+    ``current_site_id`` returns the site the job was scheduled on.
+    """
+
+    def __init__(self, site_id):
+        self.site_id = site_id
+
+
+def run_job(name, object_id, site_id):
+    """
+    Runs a job for the object with the given ID, on the given site.
+    """
+    request = current_request()
+    _thread_local.request = SiteRequest(site_id)
+    try:
+        _jobs[name](object_id)
+    finally:
+        _thread_local.request = request
+
+
+def in_transaction():
+    return getattr(connection, "in_atomic_block", False)
+
+
+def on_commit(func, *args):
+    """
+    Calls ``func`` with the arguments once the changes made so far are
+    committed, such as to discard cached copies of them, which could
+    otherwise be cached again from the database by other requests
+    before the changes are committed. Within a transaction in a batch
+    or request, the call is made when the batch or request ends, once
+    for the same function and arguments, which must be hashable, and
+    otherwise right away.
+    """
+    if getattr(_local, "pending", None) is not None and in_transaction():
+        callbacks = getattr(_local, "callbacks", None)
+        if callbacks is None:
+            callbacks = _local.callbacks = OrderedDict()
+        callbacks[(func, args)] = True
+    else:
+        func(*args)
+
+
+def run_callbacks():
+    """
+    Makes the calls collected by ``on_commit`` for the current thread.
+    """
+    callbacks = getattr(_local, "callbacks", None)
+    _local.callbacks = None
+    if callbacks:
+        for func, args in callbacks:
+            func(*args)
+
+
+def schedule(name, object_id):
+    """
+    Schedules a job for the object with the given ID. Outside of a
+    batch or request, the job is submitted right away.
+    """
+    job = (name, object_id, current_site_id())
+    pending = getattr(_local, "pending", None)
+    if pending is not None:
+        pending[job] = True
+    else:
+        get_executor().submit([job])
+
+
+def submit_pending():
+    """
+    Submits the jobs collected for the current thread, each once.
+    """
+    pending = getattr(_local, "pending", None)
+    _local.pending = None
+    if pending:
+        get_executor().submit(list(pending))
+
+
+@contextmanager
+def batch():
+    """
+    Collects the jobs scheduled within the block, and submits them when
+    it ends, such as once a transaction in the block is committed.
+    Nothing is submitted if the block raises an exception. Calls
+    deferred with ``on_commit`` are made when the block ends outside of
+    a transaction, or when the outermost block ends.
+    """
+    depth = getattr(_local, "depth", 0)
+    if not depth and getattr(_local, "pending", None) is None:
+        _local.pending = OrderedDict()
+        outermost = True
+    else:
+        outermost = False
+    _local.depth = depth + 1
+    try:
+        yield
+    except:
+        if outermost:
+            _local.pending = None
+        raise
+    finally:
+        _local.depth = depth
+        if outermost or not in_transaction():
+            run_callbacks()
+    if outermost:
+        submit_pending()
+
+
+@receiver(request_started)
+def request_jobs_collect(sender, **kwargs):
+    _local.pending = OrderedDict()
+    _local.callbacks = None
+
+
+@receiver(request_finished)
+def request_jobs_submit(sender, **kwargs):
+    if not getattr(_local, "depth", 0):
+        run_callbacks()
+        submit_pending()
+
+
+class InlineExecutor(object):
+    """
+    Runs jobs as soon as they're submitted, in the thread that
+    submitted them. Exceptions raised by jobs aren't caught.
+    """
+
+    def submit(self, jobs):
+        for job in jobs:
+            run_job(*job)
+
+    def stats(self):
+        """
+        Returns a dict of the number of jobs in each state.
+        """
+        return {"pending": 0}
+
+
+class ThreadExecutor(object):
+    """
+    Runs jobs in a pool of ``WIKI_JOB_THREADS`` background threads in
+    each process. Failed jobs are retried up to ``WIKI_JOB_RETRIES``
+    times, waiting ``WIKI_JOB_RETRY_DELAY`` seconds before the first
+    retry and twice as long before each one after. Jobs still waiting
+    to run are lost when the process exits.
+    """
+
+    def __init__(self):
+        self._queue = Queue()
+        self._queued = set()
+        self._running = 0
+        self._threads = []
+        self._lock = Lock()
+
+    def submit(self, jobs):
+        with self._lock:
+            while len(self._threads) < settings.WIKI_JOB_THREADS:
+                thread = Thread(target=self.work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            for job in jobs:
+                if job not in self._queued:
+                    self._queued.add(job)
+                    self._queue.put((job, 0))
+
+    def retry(self, job, attempts):
+        with self._lock:
+            if job not in self._queued:
+                self._queued.add(job)
+                self._queue.put((job, attempts))
+
+    def work(self):
+        while True:
+            job, attempts = self._queue.get()
+            with self._lock:
+                # Removed before running, so that changes made while the
+                # job runs schedule it again.
+                self._queued.discard(job)
+                self._running += 1
+            try:
+                run_job(*job)
+            except Exception:
+                if attempts < settings.WIKI_JOB_RETRIES:
+                    delay = settings.WIKI_JOB_RETRY_DELAY * 2 ** attempts
+                    timer = Timer(delay, self.retry, (job, attempts + 1))
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    logger.exception("Wiki job %s failed" % (job,))
+            finally:
+                connection.close()
+                with self._lock:
+                    self._running -= 1
+
+    def stats(self):
+        return {"pending": self._queue.qsize(), "running": self._running}
+
+
+class DatabaseExecutor(object):
+    """
+    Stores jobs in the database, to be run by the ``wiki_worker``
+    management command. A job that's already waiting to run isn't
+    stored again. Failed jobs are retried like with ``ThreadExecutor``,
+    and kept as failed after that.
+    """
+
+    def submit(self, jobs):
+        from mezzanine_wiki.models import WikiJob
+        waiting = WikiJob.objects.filter(claimed_until__isnull=True,
+                                         failed=False)
+        query = reduce(or_, [Q(name=name, object_id=object_id,
+                               site_id=site_id)
+                             for name, object_id, site_id in jobs])
+        existing = set(waiting.filter(query).values_list("name", "object_id",
+                                                         "site_id"))
+        created = now()
+        WikiJob.objects.bulk_create([
+            WikiJob(name=name, object_id=object_id, site_id=site_id,
+                    created=created, run_after=created)
+            for name, object_id, site_id in jobs
+            if (name, object_id, site_id) not in existing])
+
+    def run_pending(self, limit=100):
+        """
+        Runs up to ``limit`` of the jobs that are due, returning the
+        number of jobs run. Each job is claimed for ``WIKI_JOB_TIMEOUT``
+        seconds first, so that workers running at the same time don't
+        run the same job, and jobs claimed by a worker that stopped are
+        run again once their claim expires.
+        """
+        from mezzanine_wiki.models import WikiJob
+        started = now()
+        unclaimed = (Q(claimed_until__isnull=True) |
+                     Q(claimed_until__lt=started))
+        due = (WikiJob.objects.filter(unclaimed, failed=False,
+                                      run_after__lte=started)
+               .order_by("run_after", "id"))
+        count = 0
+        for job in due[:limit]:
+            claimed_until = now() + timedelta(
+                seconds=settings.WIKI_JOB_TIMEOUT)
+            claimed = WikiJob.objects.filter(unclaimed, pk=job.pk).update(
+                claimed_until=claimed_until)
+            if claimed != 1:
+                continue
+            count += 1
+            try:
+                run_job(job.name, job.object_id, job.site_id)
+            except Exception as e:
+                self.failed(job, e)
+            else:
+                job.delete()
+        return count
+
+    def failed(self, job, error):
+        """
+        Schedules a job that raised an exception to be retried, or marks
+        it as failed once it's been retried ``WIKI_JOB_RETRIES`` times.
+        """
+        attempts = job.attempts + 1
+        delay = settings.WIKI_JOB_RETRY_DELAY * 2 ** job.attempts
+        type(job).objects.filter(pk=job.pk).update(
+            attempts=attempts, claimed_until=None, error=repr(error),
+            failed=attempts > settings.WIKI_JOB_RETRIES,
+            run_after=now() + timedelta(seconds=delay))
+        if attempts > settings.WIKI_JOB_RETRIES:
+            logger.error("Wiki job %s for %s failed: %r" %
+                         (job.name, job.object_id, error))
+
+    def stats(self):
+        from mezzanine_wiki.models import WikiJob
+        started = now()
+        jobs = WikiJob.objects.filter(failed=False)
+        return {
+            "pending": jobs.filter(Q(claimed_until__isnull=True) |
+                                   Q(claimed_until__lt=started)).count(),
+            "running": jobs.filter(claimed_until__gte=started).count(),
+            "failed": WikiJob.objects.filter(failed=True).count(),
+        }
+
+
+@register("index")
+def index_page(page_id):
+    """
+    Updates the page's entry in the search index.
+    """
+    from mezzanine_wiki.models import WikiPage
+    from mezzanine_wiki.search import get_search_backend
+    for page in WikiPage.objects.filter(pk=page_id):
+        get_search_backend().update(page)
+
+
+@register("lists")
+def update_page_lists(page_id):
+    """
+    Stores the page's categories and keywords with the page.
+    """
+    from mezzanine_wiki.models import WikiPage
+    pages = WikiPage.objects.filter(pk=page_id)
+    for page in pages.prefetch_related("categories", "keywords__keyword"):
+        page.update_lists()
+
+
+@register("render")
+def render_page(page_id):
+    """
+    Renders the page's content if the stored copy is out of date, such
+    as when it was edited or a page it links to was created or deleted,
+    and updates its wikilinks. The page is removed from the page cache
+    if it was rendered.
+    """
+    from mezzanine_wiki.cache import page_cache
+    from mezzanine_wiki.models import WikiPage
+    for page in WikiPage.objects.filter(pk=page_id):
+        if page.update_rendered():
+            page_cache.invalidate((page.slug,), page.site_id)
+
+
+@register("revision_stats")
+def revision_stats(revision_id):
+    """
+    Compares the revision's content with the previous revision's.
+    """
+    from mezzanine_wiki.models import WikiPageRevision
+    revisions = WikiPageRevision.objects.select_related("parent")
+    for revision in revisions.filter(pk=revision_id):
+        revision.update_diff_stats()
@@ -0,0 +1,123 @@
+from optparse import make_option
+from time import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mezzanine.conf import settings
+from mezzanine_wiki.models import WikiPage, WikiPageRevision
+from mezzanine_wiki.utils import (atomic, get_content_hash, make_delta,
+                                  queryset_chunks)
+
+
+class Command(BaseCommand):
+    """
+    Rewrites the stored content of existing revisions to match the
+    ``WIKI_REVISION_SNAPSHOT_INTERVAL`` setting, one page at a time.
+    """
+
+    help = ("Stores wiki page revisions as patches against periodic "
+            "full snapshots, or in full with --expand.")
+
+    option_list = BaseCommand.option_list + (
+        make_option("--interval", type="int", dest="interval",
+                    help="Snapshot interval to use instead of the "
+                         "WIKI_REVISION_SNAPSHOT_INTERVAL setting."),
+        make_option("--expand", action="store_true", dest="expand",
+                    default=False,
+                    help="Store every revision in full."),
+        make_option("--check", action="store_true", dest="check",
+                    default=False,
+                    help="Only check that the content of revisions stored "
+                         "as patches can be reconstructed, and time it."),
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=100,
+                    help="Number of pages to load at a time."),
+    )
+
+    def handle(self, **options):
+        self.verbosity = int(options.get("verbosity", 1))
+        if options["check"]:
+            return self.check()
+        interval = options["interval"]
+        if interval is None:
+            interval = settings.WIKI_REVISION_SNAPSHOT_INTERVAL
+        if options["expand"]:
+            interval = 0
+        if interval < 0:
+            raise CommandError("The interval can't be negative.")
+        stored = deltas = 0
+        for chunk in queryset_chunks(WikiPage.objects.all(),
+                                     options["batch_size"]):
+            for page in chunk:
+                # A page's revisions are rewritten in a transaction, so
+                # that no patch is left against a revision that was
+                # never stored as a snapshot.
+                with atomic():
+                    page_stored, page_deltas = self.compress(page, interval)
+                stored += page_stored
+                deltas += page_deltas
+        if self.verbosity >= 1:
+            self.stdout.write("%s revisions, %s stored as patches\n" %
+                              (stored, deltas))
+
+    def compress(self, page, interval):
+        """
+        Walks the page's revisions from oldest to newest, storing one
+        in full every ``interval`` revisions and the rest as patches
+        against it.
+        """
+        revisions = WikiPageRevision.objects.filter(page=page)
+        snapshot = None
+        count = deltas = 0
+        for revision, content in WikiPageRevision.objects.history(page):
+            count += 1
+            delta = None
+            if interval and snapshot is not None and (
+                    snapshot[2] < interval - 1):
+                delta = make_delta(snapshot[1], content)
+                if delta is not None and len(delta) >= len(content):
+                    delta = None
+            if delta is None:
+                snapshot = [revision.id, content, 0]
+                update = {"stored_content": content, "snapshot": None,
+                          "chain_length": 0}
+            else:
+                snapshot[2] += 1
+                deltas += 1
+                update = {"stored_content": delta, "snapshot": snapshot[0],
+                          "chain_length": snapshot[2]}
+            if (update["snapshot"] != revision.snapshot_id or
+                    update["chain_length"] != revision.chain_length or
+                    update["stored_content"] != revision.stored_content):
+                revisions.filter(pk=revision.pk).update(**update)
+        return count, deltas
+
+    def check(self):
+        """
+        Reconstructs the content of every revision stored as a patch,
+        reporting failures and the time taken.
+        """
+        count = failed = 0
+        total = longest = 0
+        deltas = WikiPageRevision.objects.filter(snapshot__isnull=False)
+        for chunk in queryset_chunks(deltas.select_related("snapshot")):
+            for revision in chunk:
+                start = time()
+                content = revision.content
+                elapsed = time() - start
+                total += elapsed
+                longest = max(longest, elapsed)
+                count += 1
+                if (revision.content_hash and
+                        revision.content_hash != get_content_hash(content)):
+                    failed += 1
+                    if self.verbosity >= 1:
+                        self.stdout.write("Revision %s doesn't match its "
+                                          "content hash\n" % revision.pk)
+        if self.verbosity >= 1 and count:
+            self.stdout.write("%s revisions stored as patches, %s failed, "
+                              "%.2fms average, %.2fms longest\n" %
+                              (count, failed, total * 1000 / count,
+                               longest * 1000))
+        elif self.verbosity >= 1:
+            self.stdout.write("No revisions are stored as patches\n")
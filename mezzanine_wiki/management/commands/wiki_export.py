@@ -0,0 +1,40 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mezzanine_wiki.archive import dump_record, export_records, open_archive
+
+
+class Command(BaseCommand):
+    """
+    Writes the wiki's pages with their history, categories and keywords
+    to an archive that ``wiki_import`` can read, gzipped if its name
+    ends with ``.gz``.
+    """
+
+    help = "Exports wiki pages and their history to an archive."
+    args = "<archive>"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=500,
+                    help="Number of pages to load at a time."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage is wiki_export %s" % self.args)
+        verbosity = int(options.get("verbosity", 1))
+        pages = revisions = 0
+        with open_archive(args[0], "wb") as archive:
+            for record in export_records(options["batch_size"]):
+                archive.write(dump_record(record))
+                if record["type"] == "page":
+                    pages += 1
+                    if verbosity >= 2 and not pages % 1000:
+                        self.stdout.write("%s pages\n" % pages)
+                elif record["type"] == "revision":
+                    revisions += 1
+        if verbosity >= 1:
+            self.stdout.write("Exported %s pages, %s revisions\n" %
+                              (pages, revisions))
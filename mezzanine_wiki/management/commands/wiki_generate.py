@@ -0,0 +1,79 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mezzanine_wiki.archive import get_owner
+from mezzanine_wiki.generate import DISTRIBUTIONS, generate
+
+
+class Command(BaseCommand):
+    """
+    Generates a wiki of made up pages, with markdown content linking
+    the pages to each other, a history of revisions by a set of
+    authors, categories and keywords. The same options always generate
+    the same wiki, and pages that already exist are skipped.
+    """
+
+    help = "Generates wiki pages for testing and benchmarking."
+
+    option_list = BaseCommand.option_list + (
+        make_option("--pages", type="int", dest="pages", default=1000,
+                    help="Number of pages to generate."),
+        make_option("--revisions", type="int", dest="revisions", default=5,
+                    help="Average number of revisions of each page."),
+        make_option("--distribution", type="choice", dest="distribution",
+                    choices=DISTRIBUTIONS, default="pareto",
+                    help="Distribution of the number of revisions of each "
+                         "page: %s." % ", ".join(DISTRIBUTIONS)),
+        make_option("--max-revisions", type="int", dest="max_revisions",
+                    default=1000,
+                    help="Largest number of revisions of a page."),
+        make_option("--authors", type="int", dest="authors", default=20,
+                    help="Number of users authoring revisions."),
+        make_option("--categories", type="int", dest="categories",
+                    default=20,
+                    help="Number of categories to assign pages to."),
+        make_option("--keywords", type="int", dest="keywords", default=50,
+                    help="Number of keywords to assign pages."),
+        make_option("--link-ratio", type="float", dest="link_ratio",
+                    default=0.02,
+                    help="Fraction of words that are wikilinks."),
+        make_option("--seed", type="int", dest="seed", default=0,
+                    help="Seed the wiki is generated from."),
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=1000,
+                    help="Number of pages and revisions to insert at a "
+                         "time."),
+        make_option("--user", dest="username",
+                    help="Username to own pages whose first revision is "
+                         "anonymous. Defaults to the first superuser."),
+    )
+
+    def handle(self, **options):
+        verbosity = int(options.get("verbosity", 1))
+        owner = get_owner(options["username"])
+        if owner is None:
+            raise CommandError("No user to own the pages. Give one with "
+                               "--user.")
+
+        def progress(importer):
+            if verbosity >= 2:
+                self.stdout.write("%s pages, %s revisions\n" %
+                                  (importer.page_count,
+                                   importer.revision_count))
+
+        importer = generate(
+            owner, options["pages"], revisions=options["revisions"],
+            distribution=options["distribution"],
+            max_revisions=options["max_revisions"],
+            authors=options["authors"], categories=options["categories"],
+            keywords=options["keywords"], link_ratio=options["link_ratio"],
+            seed=options["seed"], batch_size=options["batch_size"],
+            progress=progress)
+        if verbosity >= 1:
+            self.stdout.write(
+                "Generated %s pages, %s revisions, skipped %s existing "
+                "pages\nRun wiki_links, wiki_search_index and "
+                "wiki_revision_stats to update the data derived from "
+                "them\n" % (importer.page_count, importer.revision_count,
+                            importer.skipped))
@@ -0,0 +1,96 @@
+import json
+import os
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mezzanine_wiki.archive import (ARCHIVE_FORMAT, ARCHIVE_VERSION,
+                                    Importer, get_owner, open_archive)
+
+
+class Command(BaseCommand):
+    """
+    Imports the pages in an archive written by ``wiki_export``. Pages
+    are inserted in batches, and the number of lines of the archive
+    imported is stored in a checkpoint file after each batch, so that
+    an interrupted import carries on from the last batch when run
+    again. Pages whose slug is taken are skipped.
+    """
+
+    help = "Imports wiki pages and their history from an archive."
+    args = "<archive>"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=1000,
+                    help="Number of pages and revisions to insert at a "
+                         "time."),
+        make_option("--user", dest="username",
+                    help="Username to own pages whose user doesn't exist. "
+                         "Defaults to the first superuser."),
+        make_option("--checkpoint", dest="checkpoint",
+                    help="Checkpoint file. Defaults to the archive's name "
+                         "followed by .checkpoint."),
+        make_option("--restart", action="store_true", dest="restart",
+                    default=False,
+                    help="Ignore the checkpoint and start from the "
+                         "beginning."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage is wiki_import %s" % self.args)
+        path = args[0]
+        verbosity = int(options.get("verbosity", 1))
+        checkpoint = options["checkpoint"] or path + ".checkpoint"
+        start = 0
+        if not options["restart"] and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                start = int(f.read().strip() or 0)
+            if verbosity >= 1:
+                self.stdout.write("Resuming after line %s\n" % start)
+        importer = Importer(self.get_owner(options["username"]),
+                            options["batch_size"])
+        with importer, open_archive(path) as archive:
+            for number, line in enumerate(archive, 1):
+                if 1 < number <= start:
+                    continue
+                record = json.loads(line)
+                kind = record.get("type")
+                if kind == "header":
+                    if (record.get("format") != ARCHIVE_FORMAT or
+                            record.get("version") != ARCHIVE_VERSION):
+                        raise CommandError("%s isn't a wiki archive this "
+                                           "version can read" % path)
+                elif kind == "category":
+                    importer.add_category(record["slug"], record["title"])
+                elif kind == "page":
+                    if importer.add_page(record):
+                        # Everything before this page has been inserted.
+                        self.save_checkpoint(checkpoint, number - 1)
+                        if verbosity >= 2:
+                            self.stdout.write("%s pages\n" %
+                                              importer.page_count)
+                elif kind == "revision":
+                    importer.add_revision(record)
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        if verbosity >= 1:
+            self.stdout.write(
+                "Imported %s pages, %s revisions, skipped %s existing "
+                "pages\nRun wiki_links, wiki_search_index and "
+                "wiki_revision_stats to update the data derived from "
+                "them\n" % (importer.page_count, importer.revision_count,
+                            importer.skipped))
+
+    def get_owner(self, username):
+        user = get_owner(username)
+        if user is None:
+            raise CommandError("No user to own the pages. Give one with "
+                               "--user.")
+        return user
+
+    def save_checkpoint(self, checkpoint, number):
+        with open(checkpoint + ".tmp", "w") as f:
+            f.write("%s\n" % number)
+        os.rename(checkpoint + ".tmp", checkpoint)
@@ -0,0 +1,160 @@
+import bz2
+import gzip
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from mezzanine.utils.urls import slugify
+
+from mezzanine_wiki.archive import Importer, get_owner
+from mezzanine_wiki.mediawiki import (chunk_items, convert_item, page_record,
+                                      parse_dump)
+
+
+# Most characters of revision text converted at a time.
+CHUNK_LENGTH = 16 * 1024 * 1024
+
+
+class Command(BaseCommand):
+    """
+    Imports the pages of a MediaWiki XML dump along with their history,
+    which may be compressed with bzip2 or gzip. The dump is parsed a
+    revision at a time, and the markup of the revisions read is
+    converted by a pool of worker processes in chunks, bounded by the
+    number of revisions and the length of their text, while the chunk
+    converted before is inserted. Only two chunks and a batch of
+    revisions are held in memory, however long a page's history is.
+
+    Redirects are skipped, as are pages whose slug is taken, which
+    also lets an interrupted import be run again. Revisions by users
+    that don't exist here are imported as anonymous.
+    """
+
+    help = "Imports wiki pages and their history from a MediaWiki dump."
+    args = "<dump.xml>"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=1000,
+                    help="Number of pages and revisions to insert at a "
+                         "time."),
+        make_option("--chunk-size", type="int", dest="chunk_size",
+                    default=500,
+                    help="Number of revisions to convert at a time."),
+        make_option("--workers", type="int", dest="workers",
+                    default=cpu_count(),
+                    help="Number of processes converting markup."),
+        make_option("--namespaces", dest="namespaces", default="0",
+                    help="Comma separated numbers of the namespaces to "
+                         "import. Defaults to the main namespace."),
+        make_option("--user", dest="username",
+                    help="Username to own pages whose first author doesn't "
+                         "exist. Defaults to the first superuser."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage is wiki_import_mediawiki %s" %
+                               self.args)
+        path = args[0]
+        verbosity = int(options.get("verbosity", 1))
+        workers = options["workers"]
+        namespaces = [int(ns) for ns in options["namespaces"].split(",")]
+        # Started before the database is used, which the workers don't.
+        pool = Pool(workers) if workers > 1 else None
+        self.page = self.last = None
+        self.unconverted = 0
+        try:
+            importer = Importer(self.get_owner(options["username"]),
+                                options["batch_size"])
+            with importer:
+                items = parse_dump(self.open_dump(path), namespaces)
+                chunks = chunk_items(items, options["chunk_size"],
+                                     CHUNK_LENGTH)
+                pending = None
+                while True:
+                    chunk = next(chunks, None)
+                    if pool is not None and chunk:
+                        converting = pool.map_async(convert_item, chunk)
+                    else:
+                        converting = map(convert_item, chunk or [])
+                    if pending is not None:
+                        self.add_items(importer, pending)
+                        if verbosity >= 2:
+                            self.stdout.write("%s pages\n" %
+                                              importer.page_count)
+                    if chunk is None:
+                        break
+                    pending = converting
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        if verbosity >= 1:
+            self.stdout.write(
+                "Imported %s pages, %s revisions, skipped %s existing and "
+                "%s redirect or untitled pages\nRun wiki_links, "
+                "wiki_search_index and wiki_revision_stats to update the "
+                "data derived from them\n" %
+                (importer.page_count, importer.revision_count,
+                 importer.skipped, self.unconverted))
+
+    def open_dump(self, path):
+        if path.endswith(".bz2"):
+            return bz2.BZ2File(path)
+        if path.endswith(".gz"):
+            return gzip.open(path)
+        return open(path, "rb")
+
+    def get_owner(self, username):
+        user = get_owner(username)
+        if user is None:
+            raise CommandError("No user to own the pages. Give one with "
+                               "--user.")
+        return user
+
+    def add_items(self, importer, converted):
+        """
+        Adds the items converted by ``convert_item`` to the importer.
+        Pages are added with their first revision, and given the
+        content and categories of their latest revision once all of
+        their revisions have been added.
+        """
+        if hasattr(converted, "get"):
+            converted = converted.get()
+        for kind, data in converted:
+            if kind == "page":
+                self.page = data
+            elif kind == "revision" and self.page is not None:
+                if self.last is None:
+                    record = page_record(self.page, data)
+                    if record is None:
+                        self.page = None
+                        continue
+                    importer.add_page(record)
+                importer.add_revision(data)
+                self.last = data
+            elif kind == "end":
+                if self.last is None:
+                    self.unconverted += 1
+                else:
+                    importer.update_page({
+                        "content": self.last["content"],
+                        "updated": self.last["created"],
+                        "categories": self.add_categories(
+                            importer, self.last["categories"]),
+                    })
+                self.page = self.last = None
+
+    def add_categories(self, importer, titles):
+        """
+        Adds the categories with the given titles to the importer,
+        returning their slugs.
+        """
+        categories = []
+        for title in titles:
+            slug = slugify(title)
+            if slug and slug not in categories:
+                importer.add_category(slug, title)
+                categories.append(slug)
+        return categories
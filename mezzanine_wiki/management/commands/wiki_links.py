@@ -0,0 +1,35 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from mezzanine_wiki.models import WikiPage
+from mezzanine_wiki.utils import queryset_chunks, render_wikitext_links
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the wikilinks between pages, eg for pages saved before
+    links were stored, or imported without saving each page.
+    """
+
+    help = "Rebuilds the index of wikilinks between wiki pages."
+
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=500,
+                    help="Number of pages to load at a time."),
+    )
+
+    def handle(self, **options):
+        verbosity = int(options.get("verbosity", 1))
+        count = 0
+        for chunk in queryset_chunks(WikiPage.objects.all(),
+                                     options["batch_size"]):
+            for page in chunk:
+                html, links = render_wikitext_links(page.content)
+                page.update_links(links)
+            count += len(chunk)
+            if verbosity >= 2:
+                self.stdout.write("%s pages\n" % count)
+        if verbosity >= 1:
+            self.stdout.write("Updated links for %s pages\n" % count)
@@ -0,0 +1,36 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from mezzanine_wiki.models import WikiPage
+from mezzanine_wiki.utils import queryset_chunks
+
+
+class Command(BaseCommand):
+    """
+    Stores the categories and keywords of each page with the page, for
+    the ``WIKI_DENORMALIZED_LISTS`` setting. Pages are kept up to date
+    once it's on, so this only needs running when turning it on.
+    """
+
+    help = "Stores the category and keyword lists of wiki pages."
+
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=500,
+                    help="Number of pages to load at a time."),
+    )
+
+    def handle(self, **options):
+        verbosity = int(options.get("verbosity", 1))
+        count = 0
+        pages = WikiPage.objects.prefetch_related("categories",
+                                                  "keywords__keyword")
+        for chunk in queryset_chunks(pages, options["batch_size"]):
+            for page in chunk:
+                page.update_lists()
+            count += len(chunk)
+            if verbosity >= 2:
+                self.stdout.write("%s pages\n" % count)
+        if verbosity >= 1:
+            self.stdout.write("Updated lists for %s pages\n" % count)
@@ -0,0 +1,50 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from mezzanine_wiki.models import WikiPage, WikiPageRevision
+from mezzanine_wiki.utils import (get_content_hash, get_renderer_version,
+                                  queryset_chunks, render_wikitext_many)
+
+
+class Command(BaseCommand):
+    """
+    Renders the stored content of wiki pages and revisions, eg after
+    changing the ``WIKI_TEXT_FILTER`` or ``WIKI_TEXT_FILTER_VERSION``
+    settings, so that it isn't rendered on the next request instead.
+    """
+
+    help = ("Renders wiki pages and revisions whose stored rendered "
+            "content is out of date.")
+
+    option_list = BaseCommand.option_list + (
+        make_option("--all", action="store_true", dest="all",
+                    default=False,
+                    help="Render all content, even if it's up to date."),
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=500,
+                    help="Number of rows to render at a time."),
+    )
+
+    def handle(self, **options):
+        verbosity = int(options.get("verbosity", 1))
+        for model in (WikiPage, WikiPageRevision):
+            count = self.render(model, options["all"], options["batch_size"])
+            if verbosity >= 1:
+                self.stdout.write("%s: rendered %s\n" %
+                                  (model._meta.verbose_name_plural, count))
+
+    def render(self, model, force, batch_size):
+        count = 0
+        version = get_renderer_version()
+        for chunk in queryset_chunks(model.objects.all(), batch_size):
+            if not force:
+                chunk = [obj for obj in chunk if not obj.is_rendered()]
+            rendered = render_wikitext_many([obj.content for obj in chunk])
+            for obj, html in zip(chunk, rendered):
+                model.objects.filter(pk=obj.pk).update(
+                    content_rendered=html,
+                    content_hash=get_content_hash(obj.content),
+                    renderer_version=version)
+            count += len(chunk)
+        return count
@@ -0,0 +1,65 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from mezzanine_wiki.diff import diff_stats
+from mezzanine_wiki.models import WikiPage, WikiPageRevision
+from mezzanine_wiki.utils import queryset_chunks
+
+
+class Command(BaseCommand):
+    """
+    Computes the statistics stored with each revision for existing
+    history, which revisions saved since are given when created. Pages
+    are loaded in batches and their revisions streamed oldest first,
+    so each revision is only compared with the one before it.
+    """
+
+    help = "Computes the stored statistics of wiki page revisions."
+
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=100,
+                    help="Number of pages to load at a time."),
+    )
+
+    def handle(self, **options):
+        verbosity = int(options.get("verbosity", 1))
+        count = updated = 0
+        for chunk in queryset_chunks(WikiPage.objects.all(),
+                                     options["batch_size"]):
+            for page in chunk:
+                page_count, page_updated = self.update(page)
+                count += page_count
+                updated += page_updated
+        if verbosity >= 1:
+            self.stdout.write("%s revisions, %s updated\n" %
+                              (count, updated))
+
+    def update(self, page):
+        """
+        Walks the page's revisions from oldest to newest, updating the
+        ones whose statistics differ.
+        """
+        revisions = WikiPageRevision.objects.filter(page=page)
+        parent = previous_content = None
+        previous_size = 0
+        count = updated = 0
+        for revision, content in WikiPageRevision.objects.history(page):
+            count += 1
+            size = len(content.encode("utf-8"))
+            if parent is None:
+                chars_added, chars_removed = len(content), 0
+            else:
+                chars_added, chars_removed = diff_stats(previous_content,
+                                                        content)
+            stats = {"size": size, "size_change": size - previous_size,
+                     "parent_id": parent, "chars_added": chars_added,
+                     "chars_removed": chars_removed}
+            if any(getattr(revision, k) != v for k, v in stats.items()):
+                stats["parent"] = stats.pop("parent_id")
+                revisions.filter(pk=revision.pk).update(**stats)
+                updated += 1
+            parent, previous_content, previous_size = (revision.pk, content,
+                                                       size)
+        return count, updated
@@ -0,0 +1,36 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from mezzanine_wiki.models import WikiPage
+from mezzanine_wiki.search import get_search_backend
+from mezzanine_wiki.utils import queryset_chunks
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the search index, loading pages a chunk at a time so that
+    the whole wiki is never held in memory.
+    """
+
+    help = "Rebuilds the search index for wiki pages."
+
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=500,
+                    help="Number of pages to load at a time."),
+    )
+
+    def handle(self, **options):
+        verbosity = int(options.get("verbosity", 1))
+        backend = get_search_backend()
+        pages = WikiPage.objects.prefetch_related("categories")
+        count = 0
+        for chunk in queryset_chunks(pages, options["batch_size"]):
+            for page in chunk:
+                backend.update(page)
+            count += len(chunk)
+            if verbosity >= 2:
+                self.stdout.write("%s pages\n" % count)
+        if verbosity >= 1:
+            self.stdout.write("Indexed %s pages\n" % count)
@@ -0,0 +1,52 @@
+from optparse import make_option
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from mezzanine_wiki.jobs import DatabaseExecutor
+
+
+class Command(BaseCommand):
+    """
+    Runs the jobs stored by ``DatabaseExecutor``, polling for new ones
+    until stopped. Any number of workers can run at the same time.
+    """
+
+    help = "Runs queued wiki jobs."
+
+    option_list = BaseCommand.option_list + (
+        make_option("--once", action="store_true", dest="once",
+                    default=False,
+                    help="Run the jobs that are due and exit."),
+        make_option("--stats", action="store_true", dest="stats",
+                    default=False,
+                    help="Show the number of pending, running and failed "
+                         "jobs and exit."),
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=100,
+                    help="Number of jobs to load at a time."),
+        make_option("--interval", type="float", dest="interval",
+                    default=5,
+                    help="Number of seconds to wait when no jobs are due."),
+    )
+
+    def handle(self, **options):
+        verbosity = int(options.get("verbosity", 1))
+        executor = DatabaseExecutor()
+        if options["stats"]:
+            stats = executor.stats()
+            self.stdout.write("%(pending)s pending, %(running)s running, "
+                              "%(failed)s failed\n" % stats)
+            return
+        total = 0
+        while True:
+            count = executor.run_pending(options["batch_size"])
+            total += count
+            if count and verbosity >= 2:
+                self.stdout.write("%s jobs run\n" % total)
+            if not count:
+                if options["once"]:
+                    break
+                sleep(options["interval"])
+        if verbosity >= 1:
+            self.stdout.write("Ran %s jobs\n" % total)
@@ -1,9 +1,51 @@
-from django.db.models import Manager, Q, CharField, TextField, get_models
+from django.db.models import (Manager, Q, CharField, TextField, get_models,
+                              Count)
 from mezzanine.conf import settings
 from mezzanine.core.managers import CurrentSiteManager, SearchableManager
+from mezzanine.utils.sites import current_site_id
 from django.utils.timezone import now
 
 
+def published_filter(for_user=None, prefix=""):
+    """
+    Returns the filter for ``PublishedManager.published``, with the
+    field names given a prefix so that it can also be used for models
+    related to wiki pages, eg ``page__`` for revisions.
+    """
+    from mezzanine.core.models import CONTENT_STATUS_PUBLISHED, CONTENT_STATUS_DRAFT
+    if for_user is not None and for_user.is_staff:
+        return Q()
+    if for_user is not None and for_user.has_perm('mezzanine_wiki.view_wikipage'):
+        status_filter = Q(**{prefix + "status__in": (CONTENT_STATUS_PUBLISHED,
+                                                     CONTENT_STATUS_DRAFT)})
+    else:
+        status_filter = Q(**{prefix + "status": CONTENT_STATUS_PUBLISHED})
+    return (
+        (Q(**{prefix + "publish_date__lte": now()}) |
+         Q(**{prefix + "publish_date__isnull": True})) &
+        (Q(**{prefix + "expiry_date__gte": now()}) |
+         Q(**{prefix + "expiry_date__isnull": True})) &
+        status_filter)
+
+
+def is_published(obj, for_user=None):
+    """
+    Whether ``published_filter`` matches an object that's already
+    loaded, without querying for it again.
+    """
+    from mezzanine.core.models import CONTENT_STATUS_PUBLISHED, CONTENT_STATUS_DRAFT
+    if for_user is not None and for_user.is_staff:
+        return True
+    if for_user is not None and for_user.has_perm('mezzanine_wiki.view_wikipage'):
+        statuses = (CONTENT_STATUS_PUBLISHED, CONTENT_STATUS_DRAFT)
+    else:
+        statuses = (CONTENT_STATUS_PUBLISHED,)
+    current = now()
+    return (obj.status in statuses and
+            (obj.publish_date is None or obj.publish_date <= current) and
+            (obj.expiry_date is None or obj.expiry_date >= current))
+
+
 class PublishedManager(Manager):
     """
     Provides filter for restricting items returned by status and
@@ -16,17 +58,7 @@ class PublishedManager(Manager):
         whose publish and expiry dates fall before and after the
         current date when specified.
         """
-        from mezzanine.core.models import CONTENT_STATUS_PUBLISHED, CONTENT_STATUS_DRAFT
-        if for_user is not None and for_user.is_staff:
-            return self.all()
-        if for_user is not None and for_user.has_perm('mezzanine_wiki.view_wikipage'):
-            status_filter = Q(status=CONTENT_STATUS_PUBLISHED) | Q(status=CONTENT_STATUS_DRAFT)
-        else:
-            status_filter = Q(status=CONTENT_STATUS_PUBLISHED)
-        return self.filter(
-            Q(publish_date__lte=now()) | Q(publish_date__isnull=True),
-            Q(expiry_date__gte=now()) | Q(expiry_date__isnull=True),
-            status_filter)
+        return self.filter(published_filter(for_user))
 
     def get_by_natural_key(self, slug):
         return self.get(slug=slug)
@@ -39,4 +71,83 @@ class DisplayableManager(CurrentSiteManager, PublishedManager,
     and ``SearchableManager`` for the ``Displayable`` model.
 
     """
-    pass
+
+    def linking_to(self, slug, for_user=None):
+        """
+        Published pages with a wikilink to the given slug.
+        """
+        return self.published(for_user=for_user).filter(
+            links__target_slug=slug)
+
+    def orphaned(self, for_user=None):
+        """
+        Published pages that no other page links to.
+        """
+        from mezzanine_wiki.models import WikiLink
+        targets = WikiLink.objects.for_site().values("target_slug")
+        return self.published(for_user=for_user).exclude(slug__in=targets)
+
+
+class WikiLinkManager(Manager):
+    """
+    Queries over the wikilinks between pages.
+    """
+
+    def for_site(self):
+        return self.filter(source__site_id=current_site_id())
+
+    def wanted(self):
+        """
+        Slugs that are linked to but have no page, as dicts with the
+        ``target_slug`` and ``link_count``, most linked to first.
+        """
+        from mezzanine_wiki.models import WikiPage
+        existing = WikiPage.objects.filter(slug__isnull=False).values("slug")
+        return (self.for_site().exclude(target_slug__in=existing)
+                .values("target_slug")
+                .annotate(link_count=Count("source"))
+                .order_by("-link_count", "target_slug"))
+
+
+class WikiPageRevisionManager(Manager):
+    """
+    Queries over the revisions of wiki pages.
+    """
+
+    def published(self, for_user=None):
+        """
+        Revisions of the current site's pages that are published for
+        the given user, filtered by joining the pages rather than with
+        a subquery.
+        """
+        return self.filter(published_filter(for_user, "page__"),
+                           page__site_id=current_site_id())
+
+    def history(self, page):
+        """
+        Yields each revision of the page from oldest to newest along
+        with its content, reading each row once.
+        """
+        return self.with_content(self.filter(page=page)
+                                 .order_by("created", "id"))
+
+    def with_content(self, revisions):
+        """
+        Yields each revision in a queryset of revisions along with its
+        content, reading each row once. Revisions stored as patches are
+        applied to the latest snapshot read, which is the one they were
+        stored against when each page's revisions are ordered oldest
+        first.
+        """
+        from mezzanine_wiki.utils import apply_delta
+        snapshot_id = snapshot_content = None
+        for revision in revisions.iterator():
+            if revision.snapshot_id is None:
+                content = revision.stored_content
+                snapshot_id, snapshot_content = revision.id, content
+            elif revision.snapshot_id == snapshot_id:
+                content = apply_delta(snapshot_content,
+                                      revision.stored_content)
+            else:
+                content = revision.content
+            yield revision, content
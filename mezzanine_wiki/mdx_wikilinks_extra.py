@@ -19,10 +19,19 @@ Dependencies:
 import markdown
 import re
 
+
+# Pattern for wikilinks extended format [[link|label]]
+WIKILINK_RE = r'\[\[([\w0-9_ -]+)(\|([\w0-9_ - ]+))?\]\]'
+
+
+def clean_label(label):
+    """ Replace spaces in the label with underscores. """
+    return re.sub(r'([ ]+_)|(_[ ]+)|([ ]+)', '_', label)
+
+
 def build_url(label, base, end):
     """ Build a url from the label, a base, and an end. """
-    clean_label = re.sub(r'([ ]+_)|(_[ ]+)|([ ]+)', '_', label)
-    return '%s%s%s'% (base, clean_label, end)
+    return '%s%s%s'% (base, clean_label(label), end)
 
 
 class WikiLinkExtraExtension(markdown.Extension):
@@ -33,6 +42,9 @@ class WikiLinkExtraExtension(markdown.Extension):
             'end_url' : ['/', 'String to append to end of URL.'],
             'html_class' : ['wikilink', 'CSS hook. Leave blank for none.'],
             'build_url' : [build_url, 'Callable formats URL from label.'],
+            'exists' : ['', 'Callable returning the set of given slugs '
+                              'that have a page. Leave blank to not check.'],
+            'missing_class' : ['new', 'CSS hook for links to missing pages.'],
         }
         
         # Override defaults with user settings
@@ -41,13 +53,26 @@ class WikiLinkExtraExtension(markdown.Extension):
         
     def extendMarkdown(self, md, md_globals):
         self.md = md
+        # Link targets and elements found while converting, cleared
+        # on reset.
+        md.wikilinks = set()
+        md.wikilink_elements = []
+        md.registerExtension(self)
 
-        # Pattern for wikilinks extended format [[link|label]]
-        WIKILINK_RE = r'\[\[([\w0-9_ -]+)(\|([\w0-9_ - ]+))?\]\]'
         wikilinkPattern = WikiLinksExtra(WIKILINK_RE, self.getConfigs())
         wikilinkPattern.md = md
         # append to end of inline patterns
         md.inlinePatterns.add('wikilink', wikilinkPattern, "<not_strong")
+        # Mark links to missing pages once all links are found, so that
+        # they're checked together rather than one at a time.
+        if self.getConfig('exists'):
+            existsProcessor = WikiLinksExists(md, self.getConfigs())
+            md.treeprocessors.add('wikilink_exists', existsProcessor,
+                                  "_end")
+
+    def reset(self):
+        self.md.wikilinks = set()
+        self.md.wikilink_elements = []
 
 
 class WikiLinksExtra(markdown.inlinepatterns.Pattern):
@@ -61,6 +86,7 @@ class WikiLinksExtra(markdown.inlinepatterns.Pattern):
             slug = m.group(2).strip().capitalize()
             label = m.group(2).strip()
             url = self.config['build_url'](slug, base_url, end_url)
+            self.md.wikilinks.add(clean_label(slug))
             a = markdown.util.etree.Element('a')
             if m.group(4):
                 a.text = m.group(4).strip()
@@ -69,6 +95,7 @@ class WikiLinksExtra(markdown.inlinepatterns.Pattern):
             a.set('href', url)
             if html_class:
                 a.set('class', html_class)
+            self.md.wikilink_elements.append((a, clean_label(slug)))
         else:
             a = ''
         return a
@@ -88,6 +115,27 @@ class WikiLinksExtra(markdown.inlinepatterns.Pattern):
         return base_url, end_url, html_class
     
 
+class WikiLinksExists(markdown.treeprocessors.Treeprocessor):
+    def __init__(self, md, config):
+        markdown.treeprocessors.Treeprocessor.__init__(self, md)
+        self.config = config
+
+    def run(self, root):
+        elements = self.markdown.wikilink_elements
+        missing_class = self.config['missing_class']
+        if not elements or not missing_class:
+            return
+        existing = self.config['exists'](self.markdown.wikilinks)
+        for a, slug in elements:
+            if slug not in existing:
+                classes = a.get('class')
+                if classes:
+                    classes = '%s %s' % (classes, missing_class)
+                else:
+                    classes = missing_class
+                a.set('class', classes)
+
+
 def makeExtension(configs=None) :
     return WikiLinkExtraExtension(configs=configs)
 
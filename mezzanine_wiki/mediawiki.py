@@ -0,0 +1,226 @@
+"""
+Reading MediaWiki XML dumps for the ``wiki_import_mediawiki`` command.
+
+Dumps are parsed incrementally, clearing each revision's elements once
+it's been read, so that only one revision is held in memory at a time
+however large the dump or a page's history is. The markup of each
+revision is converted to the markdown with wikilinks used here, which
+covers links, headings, bold and italic text, lists and external
+links. Anything else, such as templates and tables, is left as it is.
+"""
+import re
+from xml.etree.cElementTree import iterparse
+
+from mezzanine.core.models import CONTENT_STATUS_PUBLISHED
+from mezzanine_wiki.mdx_wikilinks_extra import clean_label
+
+
+# Characters that can't be part of a wikilink's target or label.
+INVALID_LINK_CHARS_RE = re.compile(r"[^\w -]+", re.UNICODE)
+
+LINK_RE = re.compile(r"\[\[([^\[\]|]+)(?:\|([^\[\]]*))?\]\](\w*)",
+                     re.UNICODE)
+EXTERNAL_LINK_RE = re.compile(r"(?<!\[)\[((?:https?|ftp)://[^\s\]]+)"
+                              r"(?:\s+([^\]]+))?\]")
+HEADING_RE = re.compile(r"^(={1,6})\s*(.+?)\s*\1\s*$", re.MULTILINE)
+LIST_RE = re.compile(r"^([*#]+)\s*", re.MULTILINE)
+
+
+def local_name(tag):
+    """
+    Returns an element's tag without its namespace.
+    """
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_dump(source, namespaces=(0,)):
+    """
+    Yields the pages in the given namespaces of a dump, read from a file
+    name or file object, a revision at a time. Each page is given as a
+    ``("page", page)`` item, where ``page`` is a dict with its
+    ``title`` and whether it's a ``redirect``, followed by a
+    ``("revision", revision)`` item for each of its revisions, in the
+    dump's order, which is oldest first, and an ``("end", page)`` item.
+    Revisions are dicts with the ``timestamp``, ``username``,
+    ``comment`` and ``text``.
+    """
+    context = iter(iterparse(source, events=("start", "end")))
+    event, root = next(context)
+    page = page_elem = revision = None
+    started = False
+    for event, elem in context:
+        tag = local_name(elem.tag)
+        if event == "start":
+            if tag == "page":
+                page = {"title": "", "ns": 0, "redirect": False}
+                page_elem = elem
+                started = False
+            elif tag == "revision" and page is not None:
+                revision = {"timestamp": None, "username": None,
+                            "comment": "", "text": ""}
+                # The page's title and namespace come before revisions.
+                if not started and page["ns"] in namespaces:
+                    started = True
+                    yield "page", page
+            continue
+        if revision is not None:
+            if tag in ("timestamp", "username", "comment"):
+                revision[tag] = elem.text
+            elif tag == "text":
+                revision["text"] = elem.text or ""
+            elif tag == "revision":
+                if started:
+                    yield "revision", revision
+                revision = None
+                # Drops the revision from the tree built so far.
+                elem.clear()
+                page_elem.remove(elem)
+        elif page is not None:
+            if tag == "title":
+                page["title"] = elem.text or ""
+            elif tag == "ns":
+                page["ns"] = int(elem.text or 0)
+            elif tag == "redirect":
+                page["redirect"] = True
+            elif tag == "page":
+                if page["ns"] in namespaces:
+                    if not started:
+                        yield "page", page
+                    yield "end", page
+                page = page_elem = None
+                root.clear()
+
+
+def chunk_items(items, size, max_length):
+    """
+    Groups the items yielded by ``parse_dump`` into lists with up to
+    ``size`` revisions and ``max_length`` characters of revision text,
+    so that the revisions converted at a time are bounded however long
+    a page's history is. A revision longer than ``max_length`` is put
+    in a list of its own.
+    """
+    chunk = []
+    count = length = 0
+    for item in items:
+        kind, data = item
+        if kind == "revision":
+            if chunk and (count >= size or
+                          length + len(data["text"]) > max_length):
+                yield chunk
+                chunk = []
+                count = length = 0
+            count += 1
+            length += len(data["text"])
+        chunk.append(item)
+    if chunk:
+        yield chunk
+
+
+def link_target(title):
+    """
+    Returns a title with the characters that can't be part of a
+    wikilink removed.
+    """
+    return " ".join(INVALID_LINK_CHARS_RE.sub(" ", title).split())
+
+
+def title_slug(title):
+    """
+    Returns the slug that wikilinks to a title lead to, or an empty
+    string if none of its characters can be used in a link.
+    """
+    return clean_label(link_target(title).capitalize())
+
+
+def convert_link(match, categories):
+    target, label, trail = match.groups()
+    if target.lower().startswith("category:"):
+        categories.append(target.split(":", 1)[1].strip())
+        return ""
+    target = target.lstrip(":")
+    if ":" in target:
+        # Files, templates and other namespaces are left alone.
+        return match.group(0)
+    target = target.split("#", 1)[0].strip()
+    label = (label or "").strip() or match.group(1).strip()
+    label += trail
+    if not target:
+        return label
+    slug = title_slug(target)
+    if not slug:
+        return label
+    if label == target == link_target(target):
+        return "[[%s]]" % target
+    if not INVALID_LINK_CHARS_RE.search(label):
+        return "[[%s|%s]]" % (link_target(target), label)
+    # Labels wikilinks can't show are linked with plain markdown,
+    # relative to the linking page.
+    return "[%s](../%s/)" % (label, slug)
+
+
+def convert_list(match):
+    markers = match.group(1)
+    bullet = "1." if markers[-1] == "#" else "*"
+    return "%s%s " % ("    " * (len(markers) - 1), bullet)
+
+
+def convert_markup(text):
+    """
+    Converts MediaWiki markup to markdown with wikilinks. Returns the
+    converted text and the titles of the categories it assigned.
+    """
+    categories = []
+    text = LINK_RE.sub(lambda m: convert_link(m, categories), text)
+    text = EXTERNAL_LINK_RE.sub(
+        lambda m: "[%s](%s)" % (m.group(2), m.group(1)) if m.group(2)
+        else "<%s>" % m.group(1), text)
+    text = LIST_RE.sub(convert_list, text)
+    text = HEADING_RE.sub(
+        lambda m: "%s %s" % ("#" * len(m.group(1)), m.group(2)), text)
+    text = text.replace("'''''", "***").replace("'''", "**")
+    text = text.replace("''", "*")
+    return text, categories
+
+
+def convert_item(item):
+    """
+    Converts the revision items yielded by ``parse_dump`` to revision
+    records of an archive, along with the titles of the ``categories``
+    each revision assigns. Other items are returned as they are.
+    """
+    kind, data = item
+    if kind != "revision":
+        return item
+    content, categories = convert_markup(data["text"])
+    return kind, {
+        "type": "revision",
+        "content": content,
+        "description": (data["comment"] or "")[:400],
+        "user": data["username"],
+        "created": data["timestamp"],
+        "categories": categories,
+    }
+
+
+def page_record(page, revision):
+    """
+    Returns the page record of an archive for a page yielded by
+    ``parse_dump``, given the record of its first revision, or ``None``
+    for pages that can't be imported. The page's content, updated time
+    and categories are the ones of its latest revision, which are only
+    known once all of its revisions are read.
+    """
+    slug = title_slug(page["title"])
+    if not slug or page["redirect"]:
+        return None
+    return {
+        "type": "page",
+        "title": page["title"],
+        "slug": slug,
+        "content": revision["content"],
+        "status": CONTENT_STATUS_PUBLISHED,
+        "user": revision["user"],
+        "created": revision["created"],
+        "updated": revision["created"],
+        "categories": [],
+    }
@@ -0,0 +1,332 @@
+"""
+Metrics of the time wiki views spend on each stage of a request, kept
+per process and exposed in Prometheus' text format by the
+``wiki_metrics`` view.
+
+``MetricsMiddleware`` measures each request handled by a wiki view,
+recording the total time, the number of queries and time spent in the
+database, and the time spent in the stages timed with ``timer``, such
+as rendering markup and comparing revisions. Template rendering is
+timed separately from the view. Stages can be nested in each other,
+such as markup rendered by a template, so their times can add up to
+more than the request's. Caches count their hits and misses with
+``count_cache``.
+
+Outside of a measured request, ``timer`` does nothing, and the cost of
+measuring a request is a few dict updates, so the middleware can be
+left on in production. Each process keeps its own metrics, which are
+reset when it restarts.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, local
+from time import time
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# Upper bounds of the histogram buckets for times, in seconds.
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Upper bounds of the histogram buckets for query counts.
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# The request being measured in the current thread.
+_local = local()
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    labels = []
+    for name, value in zip(names, values):
+        value = (("%s" % value).replace("\\", "\\\\").replace("\n", "\\n")
+                 .replace('"', '\\"'))
+        labels.append('%s="%s"' % (name, value))
+    return "{%s}" % ",".join(labels)
+
+
+class Counter(object):
+    """
+    Counts that only go up, for each combination of label values.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = defaultdict(int)
+        self._lock = Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield self.name, format_labels(self.labels, labels), value
+
+
+class Gauge(Counter):
+    """
+    Values that can go up and down, for each combination of label
+    values.
+    """
+
+    kind = "gauge"
+
+    def set(self, labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(object):
+    """
+    Observed values counted in buckets, with their count and sum, for
+    each combination of label values.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._values = {}
+        self._lock = Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            try:
+                counts, total = self._values[labels]
+            except KeyError:
+                counts, total = [0] * len(self.buckets), 0
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[labels] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for
+                            labels, (counts, total) in self._values.items())
+        names = self.labels + ("le",)
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (self.name + "_bucket",
+                       format_labels(names, labels + (format_value(bound),)),
+                       cumulative)
+            yield self.name + "_sum", format_labels(self.labels, labels), total
+            yield (self.name + "_count", format_labels(self.labels, labels),
+                   cumulative)
+
+
+class Registry(object):
+    """
+    The metrics of a process.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Returns the metrics in Prometheus' text format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.description))
+            lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append("%s%s %s" % (name, labels, format_value(value)))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+requests = registry.add(Counter(
+    "wiki_requests_total", "Requests handled by wiki views.",
+    ("view", "status")))
+request_seconds = registry.add(Histogram(
+    "wiki_request_seconds", "Time taken by wiki views, in seconds.",
+    ("view",)))
+stage_seconds = registry.add(Histogram(
+    "wiki_stage_seconds", "Time spent on each stage of wiki views, in "
+    "seconds.", ("view", "stage")))
+queries = registry.add(Histogram(
+    "wiki_queries", "Database queries made by wiki views.", ("view",),
+    QUERY_BUCKETS))
+cache_requests = registry.add(Counter(
+    "wiki_cache_requests_total", "Lookups in the wiki's caches.",
+    ("cache", "result")))
+jobs = registry.add(Gauge(
+    "wiki_jobs", "Wiki jobs in each state.", ("state",)))
+
+
+class RequestMetrics(object):
+    """
+    The time spent on each stage of a request to a view.
+    """
+
+    def __init__(self, view):
+        self.view = view
+        self.started = time()
+        self.stages = defaultdict(float)
+        self.queries = 0
+
+    def add_query(self, seconds):
+        self.queries += 1
+        self.stages["db"] += seconds
+
+
+class CountingCursor(object):
+    """
+    Wraps a database cursor, adding the queries executed with it and
+    the time they took to the request being measured, without keeping
+    their SQL like the debug cursor does.
+    """
+
+    def __init__(self, cursor, metrics):
+        self.cursor = cursor
+        self.metrics = metrics
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, *args, **kwargs):
+        start = time()
+        try:
+            return self.cursor.execute(*args, **kwargs)
+        finally:
+            self.metrics.add_query(time() - start)
+
+    def executemany(self, *args, **kwargs):
+        start = time()
+        try:
+            return self.cursor.executemany(*args, **kwargs)
+        finally:
+            self.metrics.add_query(time() - start)
+
+
+@contextmanager
+def timer(stage):
+    """
+    Adds the time taken by the block to the stage of the request being
+    measured.
+    """
+    current = getattr(_local, "current", None)
+    if current is None:
+        yield
+        return
+    start = time()
+    try:
+        yield
+    finally:
+        current.stages[stage] += time() - start
+
+
+def timed(stage):
+    """
+    Decorator that times calls to a function as the given stage.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count_cache(cache, hits=0, misses=0):
+    """
+    Counts hits and misses of one of the wiki's caches.
+    """
+    if hits:
+        cache_requests.inc((cache, "hit"), hits)
+    if misses:
+        cache_requests.inc((cache, "miss"), misses)
+
+
+class MetricsMiddleware(object):
+    """
+    Measures the requests handled by wiki views. Queries are counted by
+    wrapping the cursors of the default database connection made for
+    the request with ``CountingCursor``.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (getattr(view_func, "__module__", None) != "mezzanine_wiki.views"
+                or view_func.__name__ == "wiki_metrics"):
+            return None
+        current = request.wiki_metrics = _local.current = RequestMetrics(
+            view_func.__name__)
+        db = connections[DEFAULT_DB_ALIAS]
+        cursor = db.cursor
+        request.wiki_metrics_cursor = db.__dict__.get("cursor")
+        db.cursor = lambda: CountingCursor(cursor(), current)
+        return None
+
+    def process_template_response(self, request, response):
+        current = getattr(request, "wiki_metrics", None)
+        if current is not None:
+            start = time()
+
+            def rendered(response):
+                current.stages["template"] += time() - start
+            response.add_post_render_callback(rendered)
+        return response
+
+    def process_response(self, request, response):
+        current = getattr(request, "wiki_metrics", None)
+        if current is None:
+            return response
+        del request.wiki_metrics
+        _local.current = None
+        db = connections[DEFAULT_DB_ALIAS]
+        if request.wiki_metrics_cursor is None:
+            del db.cursor
+        else:
+            db.cursor = request.wiki_metrics_cursor
+        view = (current.view,)
+        requests.inc((current.view, response.status_code))
+        request_seconds.observe(view, time() - current.started)
+        queries.observe(view, current.queries)
+        for stage, seconds in current.stages.items():
+            stage_seconds.observe((current.view, stage), seconds)
+        return response
+
+
+def render_metrics():
+    """
+    Returns the metrics in Prometheus' text format, with the number of
+    jobs in each state as reported by the job executor.
+    """
+    from mezzanine_wiki.jobs import get_executor
+    for state, count in get_executor().stats().items():
+        jobs.set((state,), count)
+    return registry.render()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'WikiPage.content_rendered'
+        db.add_column(u'mezzanine_wiki_wikipage', 'content_rendered',
+                      self.gf('django.db.models.fields.TextField')(blank=True),
+                      keep_default=False)
+
+        # Adding field 'WikiPage.content_hash'
+        db.add_column(u'mezzanine_wiki_wikipage', 'content_hash',
+                      self.gf('django.db.models.fields.CharField')(max_length=40, blank=True),
+                      keep_default=False)
+
+        # Adding field 'WikiPage.renderer_version'
+        db.add_column(u'mezzanine_wiki_wikipage', 'renderer_version',
+                      self.gf('django.db.models.fields.CharField')(max_length=255, blank=True),
+                      keep_default=False)
+
+        # Adding field 'WikiPageRevision.content_rendered'
+        db.add_column(u'mezzanine_wiki_wikipagerevision', 'content_rendered',
+                      self.gf('django.db.models.fields.TextField')(blank=True),
+                      keep_default=False)
+
+        # Adding field 'WikiPageRevision.content_hash'
+        db.add_column(u'mezzanine_wiki_wikipagerevision', 'content_hash',
+                      self.gf('django.db.models.fields.CharField')(max_length=40, blank=True),
+                      keep_default=False)
+
+        # Adding field 'WikiPageRevision.renderer_version'
+        db.add_column(u'mezzanine_wiki_wikipagerevision', 'renderer_version',
+                      self.gf('django.db.models.fields.CharField')(max_length=255, blank=True),
+                      keep_default=False)
+
+    def backwards(self, orm):
+        # Deleting field 'WikiPage.content_rendered'
+        db.delete_column(u'mezzanine_wiki_wikipage', 'content_rendered')
+
+        # Deleting field 'WikiPage.content_hash'
+        db.delete_column(u'mezzanine_wiki_wikipage', 'content_hash')
+
+        # Deleting field 'WikiPage.renderer_version'
+        db.delete_column(u'mezzanine_wiki_wikipage', 'renderer_version')
+
+        # Deleting field 'WikiPageRevision.content_rendered'
+        db.delete_column(u'mezzanine_wiki_wikipagerevision', 'content_rendered')
+
+        # Deleting field 'WikiPageRevision.content_hash'
+        db.delete_column(u'mezzanine_wiki_wikipagerevision', 'content_hash')
+
+        # Deleting field 'WikiPageRevision.renderer_version'
+        db.delete_column(u'mezzanine_wiki_wikipagerevision', 'renderer_version')
+
+    models = {
+        u'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        u'auth.permission': {
+            'Meta': {'ordering': "(u'content_type__app_label', u'content_type__model', u'codename')", 'unique_together': "((u'content_type', u'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        u'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Group']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Permission']"}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'mezzanine_wiki.wikicategory': {
+            'Meta': {'object_name': 'WikiCategory'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'site': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['sites.Site']"}),
+            'slug': ('django.db.models.fields.CharField', [], {'max_length': '2000', 'null': 'True', 'blank': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '500'})
+        },
+        u'mezzanine_wiki.wikipage': {
+            'Meta': {'ordering': "('title',)", 'object_name': 'WikiPage'},
+            '_meta_title': ('django.db.models.fields.CharField', [], {'max_length': '500', 'null': 'True', 'blank': 'True'}),
+            'allow_comments': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'categories': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "'wikipages'", 'blank': 'True', 'to': u"orm['mezzanine_wiki.WikiCategory']"}),
+            u'comments_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'content': ('mezzanine_wiki.fields.WikiTextField', [], {}),
+            'content_hash': ('django.db.models.fields.CharField', [], {'max_length': '40', 'blank': 'True'}),
+            'content_rendered': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'expiry_date': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'featured_image': ('mezzanine.core.fields.FileField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'gen_description': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'in_sitemap': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            u'keywords_string': ('django.db.models.fields.CharField', [], {'max_length': '500', 'blank': 'True'}),
+            'publish_date': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            u'rating_average': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+            u'rating_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            u'rating_sum': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'renderer_version': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'short_url': ('django.db.models.fields.URLField', [], {'max_length': '200', 'null': 'True', 'blank': 'True'}),
+            'site': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['sites.Site']"}),
+            'slug': ('django.db.models.fields.CharField', [], {'max_length': '2000', 'null': 'True', 'blank': 'True'}),
+            'status': ('django.db.models.fields.IntegerField', [], {'default': '2'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '500'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'wikipages'", 'to': u"orm['auth.User']"})
+        },
+        u'mezzanine_wiki.wikipagerevision': {
+            'Meta': {'ordering': "('-created',)", 'object_name': 'WikiPageRevision'},
+            'content': ('mezzanine_wiki.fields.WikiTextField', [], {}),
+            'content_hash': ('django.db.models.fields.CharField', [], {'max_length': '40', 'blank': 'True'}),
+            'content_rendered': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '400', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'page': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['mezzanine_wiki.WikiPage']"}),
+            'renderer_version': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'wikipagerevisions'", 'to': u"orm['auth.User']"})
+        },
+        u'sites.site': {
+            'Meta': {'ordering': "(u'domain',)", 'object_name': 'Site', 'db_table': "u'django_site'"},
+            'domain': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        }
+    }
+
+    complete_apps = ['mezzanine_wiki']
\ No newline at end of file
@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
+import json
+
 from django.db import models
+from django.db.models.signals import (pre_save, post_save, post_delete,
+                                      pre_delete, m2m_changed)
+from django.dispatch import receiver
 from django.core.urlresolvers import reverse
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth.models import User
@@ -8,10 +13,21 @@ from mezzanine.conf import settings
 from mezzanine.core.fields import FileField
 from mezzanine.core.models import Displayable, Ownable, RichText, Slugged, TimeStamped
 from mezzanine.generic.fields import CommentsField, RatingField
+from mezzanine.generic.models import AssignedKeyword, Keyword
+from mezzanine_wiki.cache import page_cache, sidebar_cache, slug_cache
+from mezzanine_wiki.diff import diff_stats
 from mezzanine_wiki.fields import WikiTextField
+from mezzanine_wiki.jobs import (InlineExecutor, batch, get_executor,
+                                 on_commit, schedule)
+from mezzanine_wiki.metrics import count_cache
+from mezzanine_wiki.search import get_search_backend
 from mezzanine_wiki import defaults as wiki_settings
 from django.utils.timezone import now
-from mezzanine_wiki.managers import DisplayableManager
+from mezzanine_wiki.managers import (DisplayableManager, WikiLinkManager,
+                                     WikiPageRevisionManager)
+from mezzanine_wiki.utils import (apply_delta, atomic, get_content_hash,
+                                  get_renderer_version, make_delta,
+                                  render_wikitext_links)
 
 
 WIKIPAGE_PERMISSIONS = (
@@ -24,7 +40,80 @@ WIKIPAGE_REVISION_PERMISSIONS = (
 )
 
 
-class WikiPage(Displayable, Ownable):
+class WikiText(models.Model):
+    """
+    Abstract model that stores the rendered HTML of the ``content``
+    markup, along with what it was rendered from, so that it's only
+    rendered again once the content or the text filter changes.
+    """
+
+    content_rendered = models.TextField(_("Rendered content"), blank=True,
+                                        editable=False)
+    content_hash = models.CharField(max_length=40, blank=True,
+                                    editable=False)
+    renderer_version = models.CharField(max_length=255, blank=True,
+                                        editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        """
+        The content is rendered first unless ``render=False`` is given,
+        leaving it to be rendered when it's next shown.
+        """
+        if kwargs.pop("render", True):
+            self.render_content()
+        super(WikiText, self).save(*args, **kwargs)
+
+    def is_rendered(self):
+        """
+        Returns ``True`` if the stored rendered content is up to date.
+        """
+        return (self.renderer_version == get_renderer_version() and
+                self.content_hash == get_content_hash(self.content))
+
+    def render_content(self):
+        """
+        Renders the content if the stored copy is out of date. Returns
+        ``True`` if it was rendered.
+        """
+        if self.is_rendered():
+            return False
+        self.content_rendered, self.content_links = render_wikitext_links(
+                                                                self.content)
+        self.content_hash = get_content_hash(self.content)
+        self.renderer_version = get_renderer_version()
+        return True
+
+    def update_rendered(self):
+        """
+        Renders the content if the stored copy is out of date, and
+        stores it. Returns ``True`` if it was rendered.
+        """
+        if not self.render_content():
+            return False
+        if self.pk:
+            type(self)._default_manager.filter(pk=self.pk).update(
+                content_rendered=self.content_rendered,
+                content_hash=self.content_hash,
+                renderer_version=self.renderer_version)
+        return True
+
+    def get_content_rendered(self):
+        """
+        Returns the rendered content. Content that was stored before it
+        was rendered, or by a different text filter, is rendered and
+        stored here.
+        """
+        if self.update_rendered():
+            count_cache("rendered", misses=1)
+        else:
+            count_cache("rendered", hits=1)
+        return self.content_rendered
+
+
+class WikiPage(WikiText, Displayable, Ownable):
     """
     A wiki page.
     """
@@ -39,6 +128,15 @@ class WikiPage(Displayable, Ownable):
     rating = RatingField(verbose_name=_("Rating"))
     featured_image = FileField(verbose_name=_("Featured Image"), null=True,
                                upload_to="wiki", max_length=255, blank=True)
+    # The slugs and titles of the page's categories and keywords as
+    # JSON, kept when the ``WIKI_DENORMALIZED_LISTS`` setting is on.
+    category_list_json = models.TextField(editable=False, blank=True)
+    keyword_list_json = models.TextField(editable=False, blank=True)
+    latest_revision = models.ForeignKey("WikiPageRevision",
+                                        verbose_name=_("Latest revision"),
+                                        related_name="+", blank=True,
+                                        null=True, editable=False,
+                                        on_delete=models.SET_NULL)
 
     search_fields = ("content",)
 
@@ -48,6 +146,7 @@ class WikiPage(Displayable, Ownable):
         verbose_name = _("Wiki page")
         verbose_name_plural = _("Wiki pages")
         ordering = ("title",)
+        unique_together = (("site", "slug"),)
         permissions = WIKIPAGE_PERMISSIONS
 
     def can_view_wikipage(self, user):
@@ -79,29 +178,320 @@ class WikiPage(Displayable, Ownable):
         # Fallback to closed page.
         return False
 
+    def save(self, *args, **kwargs):
+        super(WikiPage, self).save(*args, **kwargs)
+        # Links found when the content was last rendered.
+        links = getattr(self, "content_links", None)
+        if links is not None:
+            self.update_links(links)
+            self.content_links = None
+
+    def update_rendered(self):
+        """
+        Also updates the page's wikilinks when it's rendered.
+        """
+        rendered = super(WikiPage, self).update_rendered()
+        if rendered and self.pk:
+            self.update_links(self.content_links)
+            self.content_links = None
+        return rendered
+
+    def get_content_rendered(self):
+        """
+        Pages that were rendered before show their last rendered
+        content while the ``render`` job renders it again, rather than
+        rendering it in the request.
+        """
+        if self.pk and self.content_rendered and not self.is_rendered():
+            count_cache("rendered", misses=1)
+            schedule("render", self.pk)
+            return self.content_rendered
+        return super(WikiPage, self).get_content_rendered()
+
+    def commit_revision(self, content, user, summary="",
+                        base_revision_id=None, check_base=False):
+        """
+        Saves the page with new content, along with a revision of it by
+        the user, who may be anonymous, in a single transaction. The
+        content isn't rendered here but by the ``render`` job, until
+        which the page shows its previous content. Returns the new
+        revision.
+
+        With ``check_base``, nothing is saved and ``None`` is returned
+        if the page has a newer revision than ``base_revision_id``, the
+        revision the new content is based on.
+        """
+        if user is not None and not user.is_authenticated():
+            user = None
+        self.content = content
+        revision = WikiPageRevision(description=summary, user=user)
+        revision.content = content
+        # Jobs for the changes are submitted once they're committed.
+        with batch(), atomic():
+            if self.pk is None:
+                self.save(render=False)
+                revision.page = self
+                revision.save(render=False)
+                schedule("render", self.pk)
+                return revision
+            if check_base and not self.claim_latest_revision(
+                    base_revision_id):
+                return None
+            revision.page = self
+            revision.save(update_page=False, render=False)
+            self.latest_revision = revision
+            self.save(render=False)
+            schedule("render", self.pk)
+        return revision
+
+    def claim_latest_revision(self, revision_id):
+        """
+        Returns whether the page's latest revision is still the given
+        one, in which case the page's row stays locked until the end of
+        the transaction. An edit of an older revision would overwrite
+        the revisions saved since.
+        """
+        pages = WikiPage.objects.filter(pk=self.pk,
+                                        latest_revision=revision_id)
+        return pages.update(latest_revision=revision_id) == 1
+
+    def update_lists(self):
+        """
+        Stores the page's categories and keywords with the page, so
+        that pages can be listed with them in a single query.
+        """
+        categories = [[c.slug, c.title] for c in self.categories.all()]
+        keywords = [[a.keyword.slug, a.keyword.title] for a in
+                    self.keywords.all()]
+        WikiPage.objects.filter(pk=self.pk).update(
+            category_list_json=json.dumps(categories),
+            keyword_list_json=json.dumps(keywords))
+
+    def get_category_list(self):
+        """
+        Returns the categories stored by ``update_lists``, which can
+        be linked to but not saved.
+        """
+        return [WikiCategory(slug=slug, title=title) for slug, title in
+                json.loads(self.category_list_json or "[]")]
+
+    def get_keyword_list(self):
+        """
+        Returns the keywords stored by ``update_lists``, which can be
+        linked to but not saved.
+        """
+        return [Keyword(slug=slug, title=title) for slug, title in
+                json.loads(self.keyword_list_json or "[]")]
+
+    def update_links(self, slugs):
+        """
+        Updates the page's wikilinks to the given set of target slugs,
+        only adding and removing the links that have changed. Links
+        from the page to itself aren't stored.
+        """
+        max_length = WikiLink._meta.get_field("target_slug").max_length
+        slugs = set(slug[:max_length] for slug in slugs if slug != self.slug)
+        existing = set(self.links.values_list("target_slug", flat=True))
+        removed = existing - slugs
+        if removed:
+            self.links.filter(target_slug__in=removed).delete()
+        added = slugs - existing
+        if added:
+            WikiLink.objects.bulk_create([WikiLink(source=self,
+                                                   target_slug=slug)
+                                          for slug in added])
+
     def get_absolute_url(self):
         return reverse("wiki_page_detail", kwargs={"slug": self.slug})
 
 
-class WikiPageRevision(Ownable, TimeStamped):
+def expand_deltas(collector, field, sub_objs, using):
+    """
+    ``on_delete`` handler for the snapshot of revisions stored as
+    patches, which stores them in full before their snapshot is
+    deleted, however it's deleted. Revisions being deleted along with
+    their snapshot, such as when their page is deleted, are left alone.
+    """
+    deleting = collector.data.get(sub_objs.model, ())
+    for revision in sub_objs.select_related("snapshot"):
+        if revision not in deleting:
+            revision.expand()
+
+
+class WikiPageRevision(WikiText, TimeStamped):
     """
     A wiki page revision.
     """
 
     page = models.ForeignKey("WikiPage", verbose_name=_("Wiki page"))
-    content = WikiTextField(_("Content"))
+    # Empty for revisions by anonymous users.
+    user = models.ForeignKey(User, verbose_name=_("Author"),
+                             related_name="wikipagerevisions", blank=True,
+                             null=True)
+    # Either the full content, or a patch against the content of the
+    # snapshot revision when one is set. Use ``content`` instead.
+    stored_content = WikiTextField(_("Content"), db_column="content")
+    snapshot = models.ForeignKey("self", verbose_name=_("Snapshot"),
+                                 related_name="deltas", blank=True,
+                                 null=True, editable=False,
+                                 on_delete=expand_deltas)
+    # The number of revisions in a row stored as patches against the
+    # same snapshot, up to and including this one, or 0 for snapshots.
+    chain_length = models.PositiveIntegerField(_("Patches since snapshot"),
+                                               default=0, editable=False)
     description = models.CharField(_("Description"),
                                    max_length=400, blank=True)
+    size = models.PositiveIntegerField(_("Size in bytes"), default=0,
+                                       editable=False)
+    size_change = models.IntegerField(_("Change in size"), default=0,
+                                      editable=False)
+    parent = models.ForeignKey("self", verbose_name=_("Previous revision"),
+                               related_name="children", blank=True,
+                               null=True, editable=False,
+                               on_delete=models.SET_NULL)
+    chars_added = models.PositiveIntegerField(_("Characters added"),
+                                              default=0, editable=False)
+    chars_removed = models.PositiveIntegerField(_("Characters removed"),
+                                                default=0, editable=False)
+
+    objects = WikiPageRevisionManager()
 
     class Meta:
         verbose_name = _("Wiki page revision")
         verbose_name_plural = _("Wiki page revisions")
         ordering = ("-created",)
+        index_together = (("created", "id"),)
         permissions = WIKIPAGE_REVISION_PERMISSIONS
 
     def __unicode__(self):
         return "%s" % self.created
 
+    def _get_content(self):
+        if self.snapshot_id is None:
+            return self.stored_content
+        content = getattr(self, "_content", None)
+        if content is None:
+            content = apply_delta(self.snapshot.stored_content,
+                                  self.stored_content)
+            self._content = content
+        return content
+
+    def _set_content(self, content):
+        self.stored_content = content
+        self.snapshot = None
+        self.chain_length = 0
+        self._content = None
+
+    content = property(_get_content, _set_content)
+
+    def save(self, *args, **kwargs):
+        """
+        New revisions become their page's latest revision, unless
+        ``update_page=False`` is given for callers that save the page
+        themselves.
+        """
+        update_page = kwargs.pop("update_page", True)
+        created = self.pk is None
+        if created:
+            stats_pending = self.set_stats()
+            self.compress()
+        super(WikiPageRevision, self).save(*args, **kwargs)
+        if created and update_page:
+            WikiPage.objects.filter(pk=self.page_id).update(
+                latest_revision=self)
+            page = getattr(self, WikiPageRevision.page.cache_name, None)
+            if page is not None:
+                page.latest_revision = self
+        if created and stats_pending:
+            schedule("revision_stats", self.pk)
+
+    def is_editable(self, request):
+        """
+        Restrict in-line editing to the revision's author and
+        superusers.
+        """
+        return request.user.is_superuser or (
+            self.user_id is not None and request.user.id == self.user_id)
+
+    def set_stats(self):
+        """
+        Stores the page's previous revision, the size of the content,
+        and how it changed from the previous revision, so that they can
+        be listed without loading or comparing the content of any
+        revision. The content is compared with the previous revision's
+        here when jobs are run inline, and otherwise left to the
+        ``revision_stats`` job, in which case ``True`` is returned.
+        """
+        inline = isinstance(get_executor(), InlineExecutor)
+        previous = (WikiPageRevision.objects.filter(page_id=self.page_id)
+                    .order_by("-created", "-id"))
+        if not inline:
+            previous = previous.only("id", "size", "snapshot",
+                                     "chain_length")
+        previous = previous[:1]
+        self.parent = previous[0] if previous else None
+        content = self.content
+        self.size = len(content.encode("utf-8"))
+        if self.parent is None:
+            self.size_change = self.size
+            self.chars_added, self.chars_removed = len(content), 0
+            return False
+        self.size_change = self.size - self.parent.size
+        if inline:
+            self.chars_added, self.chars_removed = diff_stats(
+                self.parent.content, content)
+        return not inline
+
+    def update_diff_stats(self):
+        """
+        Stores the number of characters added and removed since the
+        previous revision.
+        """
+        if self.parent is None:
+            return
+        self.chars_added, self.chars_removed = diff_stats(
+            self.parent.content, self.content)
+        WikiPageRevision.objects.filter(pk=self.pk).update(
+            chars_added=self.chars_added, chars_removed=self.chars_removed)
+
+    def compress(self):
+        """
+        Stores the content as a patch against the page's latest snapshot
+        (a revision stored in full), when the
+        ``WIKI_REVISION_SNAPSHOT_INTERVAL`` setting is given and fewer
+        revisions than that have been stored since the snapshot. The
+        patch is always against a snapshot, so getting the content of
+        any revision applies one patch at most. The snapshot and the
+        length of its chain of patches are those of the previous
+        revision set by ``set_stats``.
+        """
+        interval = settings.WIKI_REVISION_SNAPSHOT_INTERVAL
+        previous = self.parent
+        if (not interval or self.snapshot_id is not None or
+                previous is None or previous.chain_length + 1 >= interval):
+            return
+        if previous.snapshot_id is None:
+            snapshot = previous
+        else:
+            snapshot = previous.snapshot
+        content = self.stored_content
+        delta = make_delta(snapshot.stored_content, content)
+        if delta is not None and len(delta) < len(content):
+            self.stored_content = delta
+            self.snapshot = snapshot
+            self.chain_length = previous.chain_length + 1
+            self._content = content
+
+    def expand(self):
+        """
+        Stores the content in full if it's stored as a patch.
+        """
+        if self.snapshot_id is not None:
+            content = self.content
+            WikiPageRevision.objects.filter(pk=self.pk).update(
+                stored_content=content, snapshot=None, chain_length=0)
+            self.content = content
+
     def get_absolute_url(self):
         return reverse("wiki_page_revision", kwargs={"slug": self.page.slug,
                                                      "rev_id": self.id})
@@ -118,3 +508,221 @@ class WikiCategory(Slugged):
 
     def get_absolute_url(self):
         return reverse("wiki_page_list_category", kwargs={"slug": self.slug})
+
+
+class WikiSearchTerm(models.Model):
+    """
+    A term in the search index of ``IndexSearchBackend``, with its
+    weight for a wiki page.
+    """
+
+    page = models.ForeignKey("WikiPage", verbose_name=_("Wiki page"),
+                             related_name="search_terms")
+    term = models.CharField(_("Term"), max_length=64)
+    weight = models.FloatField(_("Weight"), default=0)
+
+    class Meta:
+        verbose_name = _("Wiki search term")
+        verbose_name_plural = _("Wiki search terms")
+        unique_together = (("term", "page"),)
+
+    def __unicode__(self):
+        return self.term
+
+
+class WikiLink(models.Model):
+    """
+    A wikilink from a wiki page to the slug of another wiki page,
+    which may not exist yet.
+    """
+
+    source = models.ForeignKey("WikiPage", verbose_name=_("Wiki page"),
+                               related_name="links")
+    target_slug = models.CharField(_("Target slug"), max_length=255,
+                                   db_index=True)
+
+    objects = WikiLinkManager()
+
+    class Meta:
+        verbose_name = _("Wiki link")
+        verbose_name_plural = _("Wiki links")
+        unique_together = (("source", "target_slug"),)
+
+    def __unicode__(self):
+        return "%s -> %s" % (self.source_id, self.target_slug)
+
+
+class WikiJob(models.Model):
+    """
+    A job stored by ``DatabaseExecutor``, waiting to be run by the
+    ``wiki_worker`` command.
+    """
+
+    name = models.CharField(_("Name"), max_length=50)
+    object_id = models.IntegerField(_("Object ID"))
+    site = models.ForeignKey("sites.Site", editable=False)
+    created = models.DateTimeField(_("Created"))
+    run_after = models.DateTimeField(_("Run after"), db_index=True)
+    # Set while a worker is running the job.
+    claimed_until = models.DateTimeField(_("Claimed until"), blank=True,
+                                         null=True)
+    attempts = models.PositiveIntegerField(_("Attempts"), default=0)
+    failed = models.BooleanField(_("Failed"), default=False)
+    error = models.TextField(_("Error"), blank=True)
+
+    class Meta:
+        verbose_name = _("Wiki job")
+        verbose_name_plural = _("Wiki jobs")
+
+    def __unicode__(self):
+        return "%s %s" % (self.name, self.object_id)
+
+
+@receiver(post_save, sender=WikiPage)
+@receiver(post_delete, sender=WikiPage)
+def wikipage_existence_changed(sender, instance, **kwargs):
+    """
+    Links to a page that was created or deleted change between
+    existing and missing, so the pages linking to it are marked to be
+    rendered again.
+    """
+    if kwargs.get("created", True):
+        linking = WikiPage.objects.filter(site_id=instance.site_id,
+                                          links__target_slug=instance.slug)
+        on_commit(page_cache.invalidate_pages, linking)
+        ids = list(linking.values_list("id", flat=True))
+        WikiPage.objects.filter(pk__in=ids).update(content_hash="")
+        for page_id in ids:
+            schedule("render", page_id)
+
+
+@receiver(post_save, sender=WikiPage)
+@receiver(post_delete, sender=WikiPage)
+def wikipage_slug_changed(sender, instance, **kwargs):
+    """
+    Discards the slugs cached for the site, which map to each page's
+    updated time as well as whether it exists.
+    """
+    on_commit(slug_cache.invalidate, instance.site_id)
+
+
+@receiver(pre_save, sender=WikiPage)
+def wikipage_uncache(sender, instance, **kwargs):
+    """
+    Removes the page from the page cache once it's saved, under its
+    previous slug too if it's being changed.
+    """
+    slugs = [instance.slug]
+    if instance.pk and settings.WIKI_PAGE_CACHE_TIMEOUT:
+        slugs.extend(WikiPage.objects.filter(pk=instance.pk)
+                     .exclude(slug=instance.slug)
+                     .values_list("slug", flat=True))
+    on_commit(page_cache.invalidate, tuple(slugs), instance.site_id)
+
+
+@receiver(post_delete, sender=WikiPage)
+def wikipage_uncache_deleted(sender, instance, **kwargs):
+    on_commit(page_cache.invalidate, (instance.slug,), instance.site_id)
+
+
+@receiver(post_save, sender=WikiPage)
+def wikipage_index(sender, instance, **kwargs):
+    schedule("index", instance.pk)
+
+
+@receiver(m2m_changed, sender=WikiPage.categories.through)
+def wikipage_categories_index(sender, instance, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        if isinstance(instance, WikiPage):
+            schedule("index", instance.pk)
+        else:
+            for page_id in kwargs["pk_set"] or []:
+                schedule("index", page_id)
+
+
+@receiver(pre_delete, sender=WikiPage)
+def wikipage_unindex(sender, instance, **kwargs):
+    get_search_backend().remove(instance)
+
+
+def wikipages_related_changed(pages):
+    """
+    Called with a queryset of pages whose categories or keywords
+    changed. The pages are removed from the page cache, and their lists
+    of categories and keywords are updated if the
+    ``WIKI_DENORMALIZED_LISTS`` setting is on.
+    """
+    on_commit(page_cache.invalidate_pages, pages)
+    if settings.WIKI_DENORMALIZED_LISTS:
+        for page_id in pages.values_list("id", flat=True):
+            schedule("lists", page_id)
+
+
+@receiver(m2m_changed, sender=WikiPage.categories.through)
+def wikipage_categories_changed(sender, instance, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        if isinstance(instance, WikiPage):
+            wikipages_related_changed(
+                WikiPage.objects.filter(pk=instance.pk))
+        else:
+            wikipages_related_changed(WikiPage.objects.filter(
+                pk__in=kwargs["pk_set"] or []))
+
+
+@receiver(pre_delete, sender=WikiCategory)
+def wikicategory_deleting(sender, instance, **kwargs):
+    # The category's pages can't be found once it's deleted.
+    instance._wikipage_ids = list(instance.wikipages.values_list("id",
+                                                                 flat=True))
+
+
+@receiver(post_save, sender=WikiCategory)
+@receiver(post_delete, sender=WikiCategory)
+def wikicategory_changed(sender, instance, **kwargs):
+    if kwargs.get("created"):
+        return
+    ids = getattr(instance, "_wikipage_ids", None)
+    if ids is None:
+        ids = instance.wikipages.values_list("id", flat=True)
+    wikipages_related_changed(WikiPage.objects.filter(pk__in=list(ids)))
+
+
+@receiver(post_save, sender=AssignedKeyword)
+@receiver(post_delete, sender=AssignedKeyword)
+def wikipage_keywords_changed(sender, instance, **kwargs):
+    if instance.content_type.model_class() is WikiPage:
+        wikipages_related_changed(
+            WikiPage.objects.filter(pk=instance.object_pk))
+
+
+@receiver(post_save, sender=Keyword)
+def keyword_changed(sender, instance, **kwargs):
+    if not kwargs.get("created"):
+        ids = instance.assignments.filter(
+            content_type__app_label="mezzanine_wiki",
+            content_type__model="wikipage").values_list("object_pk",
+                                                       flat=True)
+        wikipages_related_changed(WikiPage.objects.filter(pk__in=list(ids)))
+
+
+@receiver(post_save, sender=WikiPage)
+@receiver(post_delete, sender=WikiPage)
+@receiver(post_save, sender=WikiCategory)
+@receiver(post_delete, sender=WikiCategory)
+@receiver(m2m_changed, sender=WikiPage.categories.through)
+@receiver(post_save, sender=Keyword)
+@receiver(post_delete, sender=Keyword)
+def sidebar_changed(sender, **kwargs):
+    """
+    Outdates the cached wiki sidebar when the pages, categories or
+    keywords it lists change.
+    """
+    if kwargs.get("action", "post_").startswith("post_"):
+        on_commit(sidebar_cache.invalidate)
+
+
+@receiver(post_save, sender=AssignedKeyword)
+@receiver(post_delete, sender=AssignedKeyword)
+def sidebar_keywords_changed(sender, instance, **kwargs):
+    if instance.content_type.model_class() is WikiPage:
+        on_commit(sidebar_cache.invalidate)
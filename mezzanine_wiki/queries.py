@@ -0,0 +1,153 @@
+"""
+Finding views that make more queries than they should, such as a
+query for each item listed (the N+1 problem).
+
+Wiki views declare the most queries they should make with the
+``query_budget`` decorator, which doesn't change how they run. With
+``DEBUG`` on, ``QueryLogMiddleware`` logs requests to views that went
+over their budget or repeated a query, and the helpers in
+``mezzanine_wiki.testing`` fail tests for them.
+"""
+import re
+from collections import defaultdict
+from logging import getLogger
+
+from django.core.signals import request_started
+from django.db import connection, reset_queries
+from mezzanine.conf import settings
+
+
+logger = getLogger(__name__)
+
+# The SQLite backend records queries with their parameters separately.
+SQLITE_QUERY_RE = re.compile(r"^QUERY = u?(['\"])(.*)\1 - PARAMS = ",
+                             re.DOTALL)
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+IN_LIST_RE = re.compile(r"\bIN \((?:\?, )*\?\)")
+
+
+def query_shape(sql):
+    """
+    Returns the SQL with its values replaced by ``?``, and lists of
+    values by ``...``, so that queries that only differ in the values
+    they look up have the same shape.
+    """
+    match = SQLITE_QUERY_RE.match(sql)
+    if match is not None:
+        sql = match.group(2)
+    sql = sql.replace("%s", "?")
+    sql = STRING_RE.sub("?", sql)
+    sql = NUMBER_RE.sub("?", sql)
+    return IN_LIST_RE.sub("IN (...)", sql)
+
+
+def repeated_queries(queries, threshold):
+    """
+    Returns ``(shape, count)`` for each query shape repeated at least
+    ``threshold`` times in a list of SQL, most repeated first.
+    """
+    counts = defaultdict(int)
+    for sql in queries:
+        counts[query_shape(sql)] += 1
+    return sorted(((shape, count) for shape, count in counts.items()
+                   if count >= threshold), key=lambda item: -item[1])
+
+
+def query_budget(budget):
+    """
+    Decorator that declares the most queries a view should make to
+    show a page, whatever the number of items on it. The ``WIKI_QUERY_BUDGETS``
+    setting can change the budget of a view by its name, such as for
+    templates that show more.
+    """
+    def decorator(view):
+        view.query_budget = budget
+        return view
+    return decorator
+
+
+def get_query_budget(view):
+    """
+    Returns the query budget of a view, or ``None`` if it has none.
+    """
+    budgets = settings.WIKI_QUERY_BUDGETS or {}
+    name = getattr(view, "__name__", None)
+    if name in budgets:
+        return budgets[name]
+    return getattr(view, "query_budget", None)
+
+
+class QueryLog(object):
+    """
+    Context manager that records the SQL of the queries made on the
+    default database connection within it, in its ``queries`` list.
+    Queries made by requests within it aren't discarded when each
+    request starts, so that the test client can be used within it.
+    """
+
+    def __enter__(self):
+        self.use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        self.start = len(connection.queries)
+        self.queries = []
+        request_started.disconnect(reset_queries)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        connection.use_debug_cursor = self.use_debug_cursor
+        request_started.connect(reset_queries)
+        self.queries = [query["sql"] for query in
+                        connection.queries[self.start:]]
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated(self, threshold=None):
+        """
+        Returns the query shapes repeated at least ``threshold`` times,
+        defaulting to the ``WIKI_QUERY_REPEAT_THRESHOLD`` setting.
+        """
+        if threshold is None:
+            threshold = settings.WIKI_QUERY_REPEAT_THRESHOLD
+        return repeated_queries(self.queries, threshold)
+
+
+class QueryLogMiddleware(object):
+    """
+    With ``DEBUG`` on, logs a warning for each GET request to a wiki
+    view that made more queries than the view's budget, or that
+    repeated a query ``WIKI_QUERY_REPEAT_THRESHOLD`` times, and adds
+    the number of queries to the response in the ``X-Wiki-Queries``
+    header. Budgets are for showing pages, so requests that change
+    them aren't checked.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (settings.DEBUG and request.method in ("GET", "HEAD") and
+                getattr(view_func, "__module__", None) ==
+                "mezzanine_wiki.views"):
+            request.wiki_query_log = (view_func, len(connection.queries),
+                                      connection.use_debug_cursor)
+            connection.use_debug_cursor = True
+        return None
+
+    def process_response(self, request, response):
+        log = getattr(request, "wiki_query_log", None)
+        if log is None:
+            return response
+        del request.wiki_query_log
+        view, start, use_debug_cursor = log
+        connection.use_debug_cursor = use_debug_cursor
+        queries = [query["sql"] for query in connection.queries[start:]]
+        response["X-Wiki-Queries"] = str(len(queries))
+        budget = get_query_budget(view)
+        if budget is not None and len(queries) > budget:
+            logger.warning("%s made %s queries, over its budget of %s: %s" %
+                           (view.__name__, len(queries), budget,
+                            request.path))
+        threshold = settings.WIKI_QUERY_REPEAT_THRESHOLD
+        for shape, count in repeated_queries(queries, threshold):
+            logger.warning("%s repeated a query %s times: %s: %s" %
+                           (view.__name__, count, request.path, shape))
+        return response
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import re
+from math import log
+
+from django.db.models import Count, Sum
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from mezzanine.conf import settings
+from mezzanine.utils.importing import import_dotted_path
+
+
+# Search backends instantiated so far, keyed by dotted path.
+_backends = {}
+
+
+def get_search_backend():
+    """
+    Returns the search backend specified by the ``WIKI_SEARCH_BACKEND``
+    setting.
+    """
+    path = settings.WIKI_SEARCH_BACKEND
+    try:
+        return _backends[path]
+    except KeyError:
+        backend = _backends[path] = import_dotted_path(path)()
+        return backend
+
+
+def tokenize(text):
+    """
+    Splits text into lowercase search terms.
+    """
+    from mezzanine_wiki.models import WikiSearchTerm
+    max_length = WikiSearchTerm._meta.get_field("term").max_length
+    return [word[:max_length] for word in
+            re.findall(r"\w\w+", text.lower(), re.UNICODE)]
+
+
+class BaseSearchBackend(object):
+    """
+    Interface for wiki search backends. Backends are told about pages
+    as they're saved and deleted, and return pages matching a query,
+    best match first.
+    """
+
+    def update(self, page):
+        """
+        Indexes a page, replacing any previous entry for it.
+        """
+        raise NotImplementedError
+
+    def remove(self, page):
+        """
+        Removes a page from the index.
+        """
+        raise NotImplementedError
+
+    def search(self, query, for_user=None):
+        """
+        Returns the published pages matching the query as a sequence
+        that can be paginated, each page given ``search_score`` and
+        ``search_snippet`` attributes.
+        """
+        raise NotImplementedError
+
+    def get_fields(self, page):
+        """
+        Returns the text of a page to index for each field weighted by
+        the ``WIKI_SEARCH_WEIGHTS`` setting.
+        """
+        return {
+            "title": page.title,
+            "categories": " ".join(c.title for c in page.categories.all()),
+            "content": page.content,
+        }
+
+    def snippet(self, text, terms):
+        """
+        Returns the part of the text around the first of the terms in
+        it, with the terms highlighted.
+        """
+        length = settings.WIKI_SEARCH_SNIPPET_LENGTH
+        terms = "|".join(re.escape(term) for term in terms)
+        pattern = re.compile(r"\b(%s)" % terms, re.IGNORECASE | re.UNICODE)
+        match = pattern.search(text)
+        start = max(0, match.start() - length // 2) if match else 0
+        end = start + length
+        # Highlighted before escaping, so that terms don't match the
+        # entities escaping adds.
+        text_part = text[start:end]
+        parts = []
+        last = 0
+        for term in pattern.finditer(text_part):
+            parts.append(escape(text_part[last:term.start()]))
+            parts.append(u"<b>%s</b>" % escape(term.group(1)))
+            last = term.end()
+        parts.append(escape(text_part[last:]))
+        snippet = u"".join(parts)
+        if start > 0:
+            snippet = u"…" + snippet
+        if end < len(text):
+            snippet += u"…"
+        return mark_safe(snippet)
+
+
+class SearchResults(object):
+    """
+    Lazily paginated results from ``IndexSearchBackend``. Only the
+    pages in the requested slice are loaded and given snippets.
+    """
+
+    def __init__(self, backend, rows, terms):
+        self.backend = backend
+        self.rows = rows
+        self.terms = terms
+
+    def count(self):
+        return self.rows.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        from mezzanine_wiki.models import WikiPage
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        rows = list(self.rows[index])
+        pages = WikiPage.objects.in_bulk([row["page"] for row in rows])
+        results = []
+        for row in rows:
+            page = pages.get(row["page"])
+            if page is not None:
+                page.search_score = row["score"]
+                page.search_snippet = self.backend.snippet(page.content,
+                                                           self.terms)
+                results.append(page)
+        return results
+
+
+class IndexSearchBackend(BaseSearchBackend):
+    """
+    Search backend using an inverted index stored in the database,
+    which works with any database Django supports. Each page has one
+    row per term, weighted by the fields the term occurs in and how
+    often. Pages matching all of the terms in a query are ranked by
+    the sum of their weights.
+    """
+
+    def get_weights(self, page):
+        """
+        Returns a dict mapping each term in the page to its weight.
+        """
+        field_weights = settings.WIKI_SEARCH_WEIGHTS
+        weights = {}
+        for field, text in self.get_fields(page).items():
+            counts = {}
+            for term in tokenize(text):
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                weight = field_weights.get(field, 1) * (1 + log(count))
+                weights[term] = weights.get(term, 0) + weight
+        return weights
+
+    def update(self, page):
+        from mezzanine_wiki.models import WikiSearchTerm
+        self.remove(page)
+        WikiSearchTerm.objects.bulk_create([
+            WikiSearchTerm(page=page, term=term, weight=weight)
+            for term, weight in self.get_weights(page).items()])
+
+    def remove(self, page):
+        from mezzanine_wiki.models import WikiSearchTerm
+        WikiSearchTerm.objects.filter(page=page).delete()
+
+    def search(self, query, for_user=None):
+        from mezzanine_wiki.models import WikiPage, WikiSearchTerm
+        terms = list(set(tokenize(query)))
+        if not terms:
+            return []
+        pages = WikiPage.objects.published(for_user=for_user)
+        rows = (WikiSearchTerm.objects
+                .filter(term__in=terms, page__in=pages.values("id"))
+                .values("page")
+                .annotate(score=Sum("weight"), matched=Count("term"))
+                .filter(matched=len(terms))
+                .order_by("-score", "page"))
+        return SearchResults(self, rows, terms)
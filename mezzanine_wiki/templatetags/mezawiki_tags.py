@@ -2,40 +2,95 @@ from datetime import datetime
 from django.contrib.auth.models import User
 from django.db.models import Count
 
+from mezzanine_wiki.cache import sidebar_cache
 from mezzanine_wiki.models import WikiPage, WikiCategory
+from mezzanine.generic.models import AssignedKeyword, Keyword
 from mezzanine import template
 from mezzanine.conf import settings
-from mezzanine.utils.importing import import_dotted_path
+from mezzanine_wiki.utils import render_wikitext
+from django.utils.html import escape
 from django.utils.safestring import mark_safe
-from diff_match_patch import diff_match_patch
+from mezzanine_wiki.diff import DIFF_DELETE, DIFF_INSERT, DIFF_EQUAL
 
 
 register = template.Library()
 
 
+def diff_text(data):
+    return escape(data).replace("\n", "<br />")
+
+
 @register.filter
 def html_diff(diff):
+    """
+    Renders a list of ``(op, text)`` diffs inline.
+    """
     html = []
     for (op, data) in diff:
-        text = (data.replace("&", "&amp;").replace("<", "&lt;")\
-                .replace(">", "&gt;").replace("\n", "<br />"),)
-        if op == diff_match_patch.DIFF_INSERT:
+        text = diff_text(data)
+        if op == DIFF_INSERT:
             html.append("<span class=\"added\">%s</span>" % text)
-        elif op == diff_match_patch.DIFF_DELETE:
-            html.append("<span class=\"removed\">%s</del>" % text)
-        elif op == diff_match_patch.DIFF_EQUAL:
+        elif op == DIFF_DELETE:
+            html.append("<span class=\"removed\">%s</span>" % text)
+        elif op == DIFF_EQUAL:
             html.append("<span>%s</span>" % text)
     return mark_safe("".join(html))
 
 
+DIFF_ROW_CLASSES = {DIFF_INSERT: "added", DIFF_DELETE: "removed",
+                    DIFF_EQUAL: "", None: "empty"}
+DIFF_ROW_SIGNS = {DIFF_INSERT: "+", DIFF_DELETE: "-", DIFF_EQUAL: " "}
+
+
+@register.filter
+def html_diff_unified(rows):
+    """
+    Renders the rows from ``mezzanine_wiki.diff.unified_rows`` as a table.
+    """
+    html = ["<table class=\"diff-unified\">"]
+    for row in rows:
+        if row is None:
+            html.append("<tr class=\"skipped\"><td colspan=\"2\">&hellip;"
+                        "</td></tr>")
+            continue
+        op, line = row
+        html.append("<tr class=\"%s\"><td>%s</td><td>%s</td></tr>" %
+                    (DIFF_ROW_CLASSES[op], DIFF_ROW_SIGNS[op], escape(line)))
+    html.append("</table>")
+    return mark_safe("".join(html))
+
+
+@register.filter
+def html_diff_split(rows):
+    """
+    Renders the rows from ``mezzanine_wiki.diff.split_rows`` as a table
+    with the old and new lines side by side.
+    """
+    html = ["<table class=\"diff-split\">"]
+    for row in rows:
+        if row is None:
+            html.append("<tr class=\"skipped\"><td colspan=\"2\">&hellip;"
+                        "</td></tr>")
+            continue
+        left_op, left, right_op, right = row
+        html.append("<tr><td class=\"%s\">%s</td><td class=\"%s\">%s</td>"
+                    "</tr>" % (DIFF_ROW_CLASSES[left_op], escape(left or ""),
+                               DIFF_ROW_CLASSES[right_op],
+                               escape(right or "")))
+    html.append("</table>")
+    return mark_safe("".join(html))
+
+
 @register.as_tag
 def wiki_categories(*args):
     """
     Put a list of categories for wiki pages into the template context.
     """
-    pages = WikiPage.objects.published()
-    categories = WikiCategory.objects.filter(wikipages__in=pages)
-    return list(categories.annotate(page_count=Count("wikipages")))
+    def categories():
+        pages = WikiPage.objects.published()
+        categories = WikiCategory.objects.filter(wikipages__in=pages)
+        return list(categories.annotate(page_count=Count("wikipages")))
+    return sidebar_cache.get("categories", categories)
 
 
 @register.as_tag
@@ -43,9 +98,11 @@ def wiki_authors(*args):
     """
     Put a list of authors (users) for wiki pages into the template context.
     """
-    wiki_pages = WikiPage.objects.published()
-    authors = User.objects.filter(wikipages__in=wiki_pages)
-    return list(authors.annotate(post_count=Count("wikipages")))
+    def authors():
+        wiki_pages = WikiPage.objects.published()
+        authors = User.objects.filter(wikipages__in=wiki_pages)
+        return list(authors.annotate(post_count=Count("wikipages")))
+    return sidebar_cache.get("authors", authors)
 
 
 @register.as_tag
@@ -53,7 +110,37 @@ def wiki_recent_pages(limit=5):
     """
     Put a list of recently published wiki pages into the template context.
     """
-    return list(WikiPage.objects.published().order_by('-publish_date')[:limit])
+    def recent_pages():
+        pages = WikiPage.objects.published().order_by('-publish_date')
+        return list(pages.defer("content", "content_rendered")[:limit])
+    return sidebar_cache.get("recent_pages.%s" % limit, recent_pages)
+
+
+@register.as_tag
+def wiki_keywords(*args):
+    """
+    Put a list of keywords for wiki pages into the template context,
+    weighted for a tag cloud like ``keywords_for``.
+    """
+    def keywords():
+        assigned = AssignedKeyword.objects.filter(
+            content_type__app_label="mezzanine_wiki",
+            content_type__model="wikipage")
+        keywords = Keyword.objects.filter(assignments__in=assigned)
+        keywords = list(keywords.annotate(item_count=Count("assignments")))
+        if not keywords:
+            return []
+        settings.use_editable()
+        counts = [keyword.item_count for keyword in keywords]
+        min_count, max_count = min(counts), max(counts)
+        factor = (settings.TAG_CLOUD_SIZES - 1.)
+        if min_count != max_count:
+            factor /= (max_count - min_count)
+        for keyword in keywords:
+            keyword.weight = int(round((keyword.item_count - min_count) *
+                                       factor)) + 1
+        return keywords
+    return sidebar_cache.get("keywords", keywords)
 
 
 @register.filter
@@ -62,9 +149,14 @@ def wikitext_filter(content):
     This template filter takes a string value and passes it through the
     function specified by the WIKI_TEXT_FILTER setting.
     """
-    if settings.WIKI_TEXT_FILTER:
-        func = import_dotted_path(settings.WIKI_TEXT_FILTER)
-    else:
-        func = lambda s: s
-    return func(content)
+    return render_wikitext(content)
+
+
+@register.filter
+def wikitext_rendered(obj):
+    """
+    Takes a wiki page or revision and returns its stored rendered
+    content, so the markup isn't rendered again on every request.
+    """
+    return mark_safe(obj.get_content_rendered())
 
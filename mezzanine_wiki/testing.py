@@ -0,0 +1,73 @@
+"""
+Helpers for tests of projects using the wiki, that fail when wiki
+views make more queries than they should.
+"""
+from contextlib import contextmanager
+
+from django.core.urlresolvers import resolve
+
+from mezzanine_wiki.queries import QueryLog, get_query_budget
+
+
+def format_queries(log):
+    return "\n".join("%s. %s" % (i + 1, sql)
+                     for i, sql in enumerate(log.queries))
+
+
+@contextmanager
+def assert_max_queries(budget):
+    """
+    Fails with an ``AssertionError`` if more than ``budget`` queries
+    are made within the block.
+    """
+    with QueryLog() as log:
+        yield log
+    if len(log) > budget:
+        raise AssertionError("%s queries made, over the budget of %s:\n%s" %
+                             (len(log), budget, format_queries(log)))
+
+
+@contextmanager
+def assert_no_repeated_queries(threshold=None):
+    """
+    Fails with an ``AssertionError`` if a query is repeated at least
+    ``threshold`` times within the block, defaulting to the
+    ``WIKI_QUERY_REPEAT_THRESHOLD`` setting. Queries that only differ
+    in the values they look up count as the same query.
+    """
+    with QueryLog() as log:
+        yield log
+    repeated = log.repeated(threshold)
+    if repeated:
+        raise AssertionError("Queries repeated:\n%s" % "\n".join(
+            "%s times: %s" % (count, shape) for shape, count in repeated))
+
+
+class QueryBudgetMixin(object):
+    """
+    Mixin for ``TestCase`` classes, checking the queries made by the
+    views of the wiki's URLs.
+    """
+
+    def assertQueryBudget(self, url, data=None, budget=None,
+                          threshold=None):
+        """
+        Requests the URL with the test client, failing if its view
+        makes more queries than its budget, which defaults to the one
+        declared by the view, or repeats a query. Returns the response.
+        """
+        if budget is None:
+            budget = get_query_budget(resolve(url.split("?")[0]).func)
+            if budget is None:
+                self.fail("The view of %s has no query budget" % url)
+        with QueryLog() as log:
+            response = self.client.get(url, data or {})
+        if len(log) > budget:
+            self.fail("%s made %s queries, over its budget of %s:\n%s" %
+                      (url, len(log), budget, format_queries(log)))
+        repeated = log.repeated(threshold)
+        if repeated:
+            self.fail("%s repeated queries:\n%s" % (url, "\n".join(
+                "%s times: %s" % (count, shape)
+                for shape, count in repeated)))
+        return response
@@ -0,0 +1,1239 @@
+import json
+import logging
+import os
+import threading
+from calendar import timegm
+from datetime import datetime
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import NamedTemporaryFile, mkdtemp
+from unittest import skipIf
+
+from diff_match_patch import diff_match_patch
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.core.urlresolvers import reverse
+from django.db import IntegrityError, connection, models
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils.http import parse_http_date
+from django.utils.importlib import import_module
+from django.utils.timezone import utc
+from markdown.extensions.footnotes import FootnoteExtension
+from mezzanine.core.models import CONTENT_STATUS_DRAFT
+from mezzanine.generic.models import AssignedKeyword, Keyword
+
+from mezzanine_wiki import cache, diff, metrics, views
+from mezzanine_wiki.archive import Importer
+from mezzanine_wiki.filters import (MarkdownRenderer, WikiLinksRenderer,
+                                    md_wikilinks)
+from mezzanine_wiki.generate import generate
+from mezzanine_wiki.jobs import batch, get_executor, on_commit
+from mezzanine_wiki.models import (WikiCategory, WikiLink, WikiPage,
+                                   WikiPageRevision)
+from mezzanine_wiki.queries import (QueryLog, QueryLogMiddleware,
+                                    query_shape, repeated_queries)
+from mezzanine_wiki.search import IndexSearchBackend
+from mezzanine_wiki.testing import (QueryBudgetMixin, assert_max_queries,
+                                    assert_no_repeated_queries)
+from mezzanine_wiki.utils import (atomic, get_renderer_version,
+                                  keyset_paginate)
+try:
+    import benchmarks.run
+    import benchmarks.scenarios
+except ImportError:
+    # Not installed along with the wiki.
+    benchmarks = None
+
+
+class WikiTestCase(TestCase):
+    """
+    Requests are made with the site's domain as the host, so that the
+    site isn't looked up again for each use.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser("wiki-test", "",
+                                                  "wiki-test")
+        self.client.defaults["HTTP_HOST"] = Site.objects.get_current().domain
+
+    def generate(self, pages, **kwargs):
+        kwargs.setdefault("revisions", 2)
+        kwargs.setdefault("distribution", "constant")
+        generate(self.user, pages, **kwargs)
+        call_command("wiki_page_lists", verbosity=0)
+
+
+class PageListQueriesTest(WikiTestCase):
+    """
+    The page list, with its sidebar, makes as many queries however many
+    pages there are.
+    """
+
+    def assertQueriesFlat(self, url):
+        self.generate(15)
+        with QueryLog() as log:
+            self.client.get(url)
+        self.generate(30)
+        with assert_max_queries(len(log)):
+            with assert_no_repeated_queries():
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_list(self):
+        response = self.assertQueriesFlat(reverse("wiki_page_list"))
+        self.assertEqual(response.context["wiki_pages"].paginator.count, 30)
+
+    @override_settings(WIKI_DENORMALIZED_LISTS=True)
+    def test_list_denormalized(self):
+        self.assertQueriesFlat(reverse("wiki_page_list"))
+
+
+class ConflictTest(WikiTestCase):
+
+    def setUp(self):
+        super(ConflictTest, self).setUp()
+        self.client.login(username="wiki-test", password="wiki-test")
+        self.page = WikiPage(title="Foo", user=self.user)
+        self.page.commit_revision("one\ntwo\n", self.user)
+        self.page.commit_revision("one\ntwo\nthree\n", self.user)
+
+    def edit(self, base_revision):
+        return self.client.post(reverse("wiki_page_edit", args=["foo"]), {
+            "content": "zero\none\ntwo\n", "status": self.page.status,
+            "base_revision": base_revision})
+
+    def test_merged(self):
+        revisions = WikiPageRevision.objects.filter(page=self.page)
+        response = self.edit(revisions.order_by("id")[0].id)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(WikiPage.objects.get(pk=self.page.pk).content,
+                         "zero\none\ntwo\nthree\n")
+
+    def test_without_base(self):
+        # Blanked meanwhile, which an edit from '' would merge cleanly.
+        self.page.commit_revision("", self.user)
+        for base_revision in ("", 0):
+            response = self.edit(base_revision)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.context["conflict_diff"])
+            self.assertEqual(WikiPage.objects.get(pk=self.page.pk).content,
+                             "")
+
+    def test_empty_base(self):
+        self.page.commit_revision("", self.user)
+        base_revision = self.page.latest_revision_id
+        self.page.commit_revision("three\n", self.user)
+        response = self.edit(base_revision)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(WikiPage.objects.get(pk=self.page.pk).content,
+                         "three\n")
+
+    def test_stale_base(self):
+        revisions = WikiPageRevision.objects.filter(page=self.page)
+        base_revision = revisions.order_by("id")[0].id
+        self.assertIsNone(self.page.commit_revision(
+            "one\n", self.user, base_revision_id=base_revision,
+            check_base=True))
+        self.assertEqual(revisions.count(), 2)
+        page = WikiPage.objects.get(pk=self.page.pk)
+        self.assertEqual(page.content, "one\ntwo\nthree\n")
+
+    def test_stale_base_conflict(self):
+        base_revision = self.page.latest_revision_id
+        self.page.commit_revision("one\ntwo\n3\n", self.user)
+        response = self.client.post(
+            reverse("wiki_page_edit", args=["foo"]), {
+                "content": "one\ntwo\nTHREE\n", "status": self.page.status,
+                "base_revision": base_revision})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["conflict_diff"])
+        self.assertEqual(response.context["form"]["base_revision"].value(),
+                         self.page.latest_revision_id)
+        self.assertEqual(WikiPageRevision.objects.filter(
+            page=self.page).count(), 3)
+        self.assertEqual(WikiPage.objects.get(pk=self.page.pk).content,
+                         "one\ntwo\n3\n")
+
+    def test_integrity_error(self):
+        other = WikiPage(title="Bar", user=self.user)
+        other.commit_revision("Bar", self.user)
+        page = WikiPage.objects.get(pk=self.page.pk)
+        latest_revision_id = page.latest_revision_id
+        # Saving the page fails after its revision was saved.
+        page.slug = other.slug
+        with self.assertRaises(IntegrityError):
+            page.commit_revision("Other", self.user)
+        self.assertEqual(WikiPageRevision.objects.filter(
+            page=self.page).count(), 2)
+        page = WikiPage.objects.get(pk=self.page.pk)
+        self.assertEqual(page.slug, "foo")
+        self.assertEqual(page.content, "one\ntwo\nthree\n")
+        self.assertEqual(page.latest_revision_id, latest_revision_id)
+
+
+class RenderTest(WikiTestCase):
+    """
+    Edited pages show their previous content until the ``render`` job
+    renders them again.
+    """
+
+    def setUp(self):
+        super(RenderTest, self).setUp()
+        self.page = WikiPage(title="Foo", user=self.user)
+        self.page.commit_revision("First version", self.user)
+
+    def get(self):
+        response = self.client.get(reverse("wiki_page_detail",
+                                           args=["foo"]))
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    @override_settings(WIKI_JOB_EXECUTOR="mezzanine_wiki.jobs."
+                                         "DatabaseExecutor")
+    def test_rendered_by_job(self):
+        self.assertIn("First version", self.get())
+        # Loaded again with its rendered content, like when it's edited.
+        self.page = WikiPage.objects.get(pk=self.page.pk)
+        self.page.commit_revision("Second version", self.user)
+        self.assertIn("First version", self.get())
+        get_executor().run_pending()
+        self.assertIn("Second version", self.get())
+        self.assertTrue(WikiPage.objects.get(pk=self.page.pk).is_rendered())
+
+
+class MediaWikiImportTest(WikiTestCase):
+    """
+    Pages with more revisions than fit in a batch are imported with all
+    of them.
+    """
+
+    revision = (u"<revision><timestamp>2010-01-%02dT10:00:00Z</timestamp>"
+                u"<contributor><username>wiki-test</username></contributor>"
+                u"<text>%s</text></revision>")
+
+    def setUp(self):
+        super(MediaWikiImportTest, self).setUp()
+        self.dump = NamedTemporaryFile(suffix=".xml")
+        pages = [("Long", [u"Version %s" % i for i in range(1, 8)] +
+                  [u"Last [[Category:Things]]"]),
+                 ("Short", [u"Only"])]
+        self.dump.write(u"<mediawiki>%s</mediawiki>" % u"".join(
+            u"<page><title>%s</title><ns>0</ns>%s</page>" % (title, u"".join(
+                self.revision % (day, text) for day, text in
+                enumerate(texts, 1))) for title, texts in pages))
+        self.dump.flush()
+
+    def tearDown(self):
+        self.dump.close()
+
+    def test_long_history(self):
+        for i in range(2):
+            call_command("wiki_import_mediawiki", self.dump.name,
+                         batch_size=3, chunk_size=2, workers=1,
+                         verbosity=0)
+        page = WikiPage.objects.get(slug="Long")
+        revisions = WikiPageRevision.objects.filter(page=page)
+        self.assertEqual(revisions.count(), 8)
+        self.assertEqual(page.content, "Last ")
+        self.assertEqual(page.latest_revision.content, "Last ")
+        self.assertEqual(page.updated.day, 8)
+        self.assertEqual([c.slug for c in page.categories.all()],
+                         ["things"])
+        self.assertEqual(WikiPageRevision.objects.filter(
+            page__slug="Short").count(), 1)
+
+
+class MetricsTest(WikiTestCase):
+
+    def get_total(self):
+        values = metrics.queries._values
+        return values.get(("wiki_page_list",), (None, 0))[1]
+
+    def test_queries_counted(self):
+        self.generate(5)
+        with QueryLog() as log:
+            self.client.get(reverse("wiki_page_list"))
+        total = self.get_total()
+        middleware = settings.MIDDLEWARE_CLASSES + (
+            "mezzanine_wiki.metrics.MetricsMiddleware",)
+        with self.settings(MIDDLEWARE_CLASSES=middleware):
+            # A new client, as each one loads the middleware once.
+            client = self.client_class(**self.client.defaults)
+            client.get(reverse("wiki_page_list"))
+        # The queries made before the view, such as for the session,
+        # aren't counted.
+        counted = self.get_total() - total
+        self.assertTrue(0 < counted <= len(log))
+        # Without the debug cursor, which keeps the SQL of each query.
+        self.assertEqual(connection.queries, [])
+        self.assertNotIn("cursor", connection.__dict__)
+
+
+class QueryDetectorTest(TestCase):
+    """
+    Queries made for each item listed are caught.
+    """
+
+    def setUp(self):
+        for i in range(6):
+            User.objects.create_user("user%s" % i, "", "")
+
+    def test_query_shape(self):
+        self.assertEqual(
+            query_shape("SELECT a FROM b WHERE c = 1 AND d IN (?, ?)"),
+            query_shape("SELECT a FROM b WHERE c = 23 AND d IN (?)"))
+        self.assertEqual(query_shape("SELECT a FROM b WHERE c = 'x''y'"),
+                         "SELECT a FROM b WHERE c = ?")
+        self.assertEqual(query_shape("QUERY = u'SELECT a FROM b WHERE "
+                                     "c = %s' - PARAMS = (1,)"),
+                         "SELECT a FROM b WHERE c = ?")
+
+    def test_repeated_queries(self):
+        queries = ["SELECT a FROM b WHERE c = %s" % i for i in range(3)]
+        queries.append("SELECT d FROM e")
+        self.assertEqual(repeated_queries(queries, 3),
+                         [("SELECT a FROM b WHERE c = ?", 3)])
+        self.assertEqual(repeated_queries(queries, 4), [])
+
+    def test_n_plus_one(self):
+        users = User.objects.order_by("id")
+        with self.assertRaises(AssertionError):
+            with assert_max_queries(2):
+                for user in users:
+                    list(user.wikipagerevisions.all())
+        with self.assertRaises(AssertionError):
+            with assert_no_repeated_queries():
+                for user in users:
+                    list(user.wikipagerevisions.all())
+        with assert_max_queries(2):
+            with assert_no_repeated_queries():
+                list(users.prefetch_related("wikipagerevisions"))
+
+    @override_settings(DEBUG=True,
+                       WIKI_QUERY_BUDGETS={"wiki_page_list": 3})
+    def test_middleware(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger("mezzanine_wiki.queries")
+        logger.addHandler(handler)
+        try:
+            request = RequestFactory().get("/")
+            middleware = QueryLogMiddleware()
+            middleware.process_view(request, views.wiki_page_list, (), {})
+            for user in User.objects.all():
+                list(user.wikipagerevisions.all())
+            response = middleware.process_response(request, HttpResponse())
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(response["X-Wiki-Queries"], "7")
+        messages = [record.getMessage() for record in records]
+        self.assertEqual(len(messages), 2)
+        self.assertIn("made 7 queries, over its budget of 3", messages[0])
+        self.assertIn("repeated a query 6 times", messages[1])
+
+
+class ViewBudgetsTest(QueryBudgetMixin, WikiTestCase):
+    """
+    The wiki's most used views stay within their query budgets.
+    """
+
+    def setUp(self):
+        super(ViewBudgetsTest, self).setUp()
+        self.generate(20, revisions=8)
+        self.page = WikiPage.objects.order_by("id")[0]
+        self.revisions = WikiPageRevision.objects.filter(
+            page=self.page).order_by("id")
+
+    def test_list(self):
+        self.assertQueryBudget(reverse("wiki_page_list"))
+
+    def test_detail(self):
+        self.assertQueryBudget(reverse("wiki_page_detail",
+                                       args=[self.page.slug]))
+
+    def test_changes(self):
+        self.assertQueryBudget(reverse("wiki_page_changes"))
+
+    def test_history(self):
+        self.assertQueryBudget(reverse("wiki_page_history",
+                                       args=[self.page.slug]))
+
+    def test_revision(self):
+        self.assertQueryBudget(reverse("wiki_page_revision", args=[
+            self.page.slug, self.revisions[0].id]))
+
+    def test_diff(self):
+        for view in ("inline", "unified", "split"):
+            self.assertQueryBudget(
+                reverse("wiki_page_diff", args=[self.page.slug]), {
+                    "from_revision_pk": self.revisions[0].id,
+                    "to_revision_pk": self.revisions[7].id, "view": view})
+
+
+class OnCommitTest(TestCase):
+
+    def test_deferred_in_batch(self):
+        calls = []
+
+        def call(value):
+            calls.append(value)
+        with batch():
+            with atomic():
+                on_commit(call, 1)
+                on_commit(call, 1)
+                on_commit(call, 2)
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, [1, 2])
+
+    def test_immediate_outside_batch(self):
+        calls = []
+        on_commit(calls.append, 1)
+        self.assertEqual(calls, [1])
+
+
+class SlugCacheTest(WikiTestCase):
+    """
+    Slugs are only cached with a cache backend shared by processes.
+    """
+
+    def setUp(self):
+        super(SlugCacheTest, self).setUp()
+        self.site_id = Site.objects.get_current().id
+        self.cache_dir = mkdtemp()
+        self.default_cache = cache.cache
+        cache.cache = FileBasedCache(self.cache_dir, {})
+        cache.slug_cache._sites.clear()
+
+    def tearDown(self):
+        cache.cache = self.default_cache
+        cache.slug_cache._sites.clear()
+        rmtree(self.cache_dir)
+
+    def test_private_backend(self):
+        self.assertTrue(cache.slug_cache.is_enabled(self.site_id))
+        cache.cache = LocMemCache("slugs", {})
+        self.assertFalse(cache.slug_cache.is_enabled(self.site_id))
+
+    def test_invalidated_after_commit(self):
+        self.assertEqual(cache.slug_cache.get("foo", self.site_id), None)
+        with batch():
+            with atomic():
+                page = WikiPage.objects.create(title="Foo", user=self.user)
+            self.assertEqual(cache.slug_cache.get("foo", self.site_id), None)
+        self.assertEqual(cache.slug_cache.get("foo", self.site_id)[0],
+                         page.id)
+
+    def render_links(self, count):
+        """
+        Renders links to ``count`` slugs, every other one with a page,
+        returning the number of queries made.
+        """
+        content = " ".join("[[Page%s]]" % i for i in range(count))
+        with QueryLog() as log:
+            html, links = md_wikilinks.render_with_links(content)
+        self.assertEqual(len(links), count)
+        self.assertEqual(html.count("wikilink new"), count // 2)
+        return len(log)
+
+    def assertLinkQueriesFlat(self):
+        WikiPage.objects.bulk_create([
+            WikiPage(site_id=self.site_id, slug="Page%s" % i,
+                     title="Page%s" % i, user=self.user)
+            for i in range(0, 400, 2)])
+        queries = self.render_links(30)
+        self.assertLessEqual(queries, 1)
+        self.assertEqual(self.render_links(330), queries)
+
+    def test_many_links(self):
+        self.assertLinkQueriesFlat()
+
+    def test_many_links_private_backend(self):
+        cache.cache = LocMemCache("slugs", {})
+        self.assertLinkQueriesFlat()
+
+
+class DedupeSlugsPage(models.Model):
+    """
+    A wiki page as it was before slugs were unique on each site.
+    """
+
+    site = models.ForeignKey(Site)
+    title = models.CharField(max_length=500)
+    slug = models.CharField(max_length=2000, blank=True, null=True)
+
+    class Meta:
+        app_label = "mezzanine_wiki"
+        managed = False
+        ordering = ("title",)
+
+
+class DedupeSlugsMigrationTest(TestCase):
+
+    def setUp(self):
+        # Created here rather than along with the app's tables.
+        DedupeSlugsPage._meta.managed = True
+        try:
+            statements = connection.creation.sql_create_model(
+                DedupeSlugsPage, no_style())[0]
+        finally:
+            DedupeSlugsPage._meta.managed = False
+        cursor = connection.cursor()
+        for sql in statements:
+            cursor.execute(sql)
+
+    def test_different_titles(self):
+        site = Site.objects.get_current()
+        for title, slug in (("Foo_Bar", "Foo_Bar"), ("Foo Bar", "Foo_Bar"),
+                            ("Foo", "Foo")):
+            DedupeSlugsPage.objects.create(site=site, title=title, slug=slug)
+        migration = import_module("mezzanine_wiki.migrations."
+                                  "0016_dedupe_slugs").Migration()
+
+        class orm(object):
+            WikiPage = DedupeSlugsPage
+        migration.forwards(orm)
+        pages = DedupeSlugsPage.objects.order_by("id")
+        self.assertEqual(list(pages.values_list("title", "slug")), [
+            ("Foo_Bar", "Foo_Bar"), ("Foo Bar 2", "Foo_Bar_2"),
+            ("Foo", "Foo")])
+
+
+class RenderedContentTest(WikiTestCase):
+    """
+    Stored rendered content is only rendered again once it's out of
+    date.
+    """
+
+    def setUp(self):
+        super(RenderedContentTest, self).setUp()
+        page = WikiPage(title="Foo", user=self.user)
+        page.commit_revision("Some *text*", self.user)
+        self.revisions = WikiPageRevision.objects.filter(page=page)
+        self.revisions[0].get_content_rendered()
+        # Only the stored copy would show this.
+        self.revisions.update(content_rendered="Stored")
+
+    def test_up_to_date(self):
+        self.assertEqual(self.revisions[0].get_content_rendered(), "Stored")
+
+    def test_renderer_version(self):
+        with self.settings(WIKI_TEXT_FILTER_VERSION="changed"):
+            self.assertEqual(self.revisions[0].get_content_rendered(),
+                             "<p>Some <em>text</em></p>")
+            revision = self.revisions[0]
+            self.assertTrue(revision.is_rendered())
+            self.assertEqual(revision.renderer_version,
+                             get_renderer_version())
+
+    def test_content_hash(self):
+        self.revisions.update(stored_content="Other *text*")
+        self.assertEqual(self.revisions[0].get_content_rendered(),
+                         "<p>Other <em>text</em></p>")
+        self.assertTrue(self.revisions[0].is_rendered())
+
+
+class FootnotesRenderer(MarkdownRenderer):
+
+    def get_extensions(self):
+        return [FootnoteExtension()]
+
+
+class MarkdownReuseTest(WikiTestCase):
+    """
+    Nothing carries over from one document to the next when a thread's
+    ``Markdown`` instance is reused.
+    """
+
+    def test_wikilinks(self):
+        renderer = WikiLinksRenderer()
+        html, links = renderer.convert("[[Foo]]")
+        md = renderer.get_markdown()
+        self.assertEqual(links, set(["Foo"]))
+        html, links = renderer.convert("[[Bar]] and text")
+        self.assertIs(renderer.get_markdown(), md)
+        self.assertEqual(links, set(["Bar"]))
+        self.assertNotIn("Foo", html)
+        self.assertEqual(md.wikilink_elements, [])
+
+    def test_footnotes(self):
+        renderer = FootnotesRenderer()
+        html = renderer.render("Text[^1]\n\n[^1]: A footnote")
+        self.assertIn("A footnote", html)
+        md = renderer.get_markdown()
+        html = renderer.render("Other text")
+        self.assertIs(renderer.get_markdown(), md)
+        self.assertEqual(html, "<p>Other text</p>")
+
+
+class LinkGraphTest(WikiTestCase):
+    """
+    Backlinks, orphans and wanted pages follow the pages' wikilinks as
+    they're edited and created.
+    """
+
+    def create(self, title, content):
+        # Like pages added from the edit view, whose slugs are those
+        # of the wikilinks.
+        page = WikiPage(slug=title, title=title, user=self.user)
+        page.commit_revision(content, self.user)
+        return page
+
+    def titles(self, pages):
+        return sorted(page.title for page in pages)
+
+    def wanted(self):
+        return [link["target_slug"] for link in WikiLink.objects.wanted()]
+
+    def test_backlinks(self):
+        foo = self.create("Foo", "See [[Bar]]")
+        self.create("Bar", "Text")
+        self.assertEqual(self.titles(WikiPage.objects.linking_to("Bar")),
+                         ["Foo"])
+        foo = WikiPage.objects.get(pk=foo.pk)
+        foo.commit_revision("See [[Baz]]", self.user)
+        self.assertEqual(self.titles(WikiPage.objects.linking_to("Bar")), [])
+        self.assertEqual(self.titles(WikiPage.objects.linking_to("Baz")),
+                         ["Foo"])
+
+    def test_orphans(self):
+        self.create("Foo", "See [[Bar]]")
+        self.create("Bar", "See [[Baz]]")
+        self.create("Baz", "Text")
+        self.create("Qux", "Text")
+        self.assertEqual(self.titles(WikiPage.objects.orphaned()),
+                         ["Foo", "Qux"])
+
+    def test_wanted(self):
+        foo = self.create("Foo", "See [[Bar]]")
+        self.create("Qux", "See [[Bar]] and [[Baz]]")
+        self.assertEqual(self.wanted(), ["Bar", "Baz"])
+        rendered = WikiPage.objects.get(pk=foo.pk).content_rendered
+        self.create("Bar", "Text")
+        self.assertEqual(self.wanted(), ["Baz"])
+        # Foo is rendered again now that its link is to a page that
+        # exists.
+        foo = WikiPage.objects.get(pk=foo.pk)
+        self.assertTrue(foo.is_rendered())
+        self.assertNotEqual(foo.content_rendered, rendered)
+
+
+@override_settings(WIKI_REVISION_SNAPSHOT_INTERVAL=3)
+class DeltaStorageTest(WikiTestCase):
+    """
+    Revisions stored as patches against a snapshot have the content
+    they were saved with, however they're stored again.
+    """
+
+    def setUp(self):
+        super(DeltaStorageTest, self).setUp()
+        self.contents = ["Line\n" * 50 + "Version %s\n" % i for i in range(8)]
+        self.page = WikiPage(slug="Foo", title="Foo", user=self.user)
+        for content in self.contents:
+            self.page.commit_revision(content, self.user)
+
+    def revisions(self):
+        return WikiPageRevision.objects.order_by("created", "id")
+
+    def assertContents(self):
+        self.assertEqual([revision.content for revision in self.revisions()],
+                         self.contents)
+        self.assertEqual([content for revision, content in
+                          WikiPageRevision.objects.history(self.page)],
+                         self.contents)
+
+    def test_compressed(self):
+        self.assertEqual([(revision.snapshot_id is None,
+                           revision.chain_length)
+                          for revision in self.revisions()],
+                         [(True, 0), (False, 1), (False, 2)] * 2 +
+                         [(True, 0), (False, 1)])
+        self.assertContents()
+
+    def test_no_count(self):
+        with QueryLog() as log:
+            self.page.commit_revision("Line\n" * 50, self.user)
+        self.assertFalse([sql for sql in log.queries if "COUNT(" in sql])
+
+    def test_delete_snapshot(self):
+        snapshot = self.revisions()[0]
+        snapshot.delete()
+        del self.contents[0]
+        self.assertEqual(
+            self.revisions().filter(snapshot__isnull=True).count(), 4)
+        self.assertEqual(self.revisions()[0].chain_length, 0)
+        self.assertContents()
+
+    def test_expand_and_check(self):
+        output = StringIO()
+        call_command("wiki_compress_revisions", check=True, stdout=output)
+        self.assertIn("5 revisions stored as patches, 0 failed",
+                      output.getvalue())
+        call_command("wiki_compress_revisions", expand=True, verbosity=0)
+        self.assertFalse(self.revisions().filter(snapshot__isnull=False))
+        self.assertFalse(self.revisions().filter(chain_length__gt=0))
+        self.assertContents()
+        call_command("wiki_compress_revisions", interval=4, verbosity=0)
+        self.assertEqual([revision.chain_length
+                          for revision in self.revisions()],
+                         [0, 1, 2, 3, 0, 1, 2, 3])
+        self.assertContents()
+
+
+class SearchTest(WikiTestCase):
+    """
+    The index search backend ranks the published pages with all of the
+    terms searched for, with snippets of their content.
+    """
+
+    def setUp(self):
+        super(SearchTest, self).setUp()
+        self.backend = IndexSearchBackend()
+
+    def create(self, title, content, **kwargs):
+        page = WikiPage(slug=title, title=title, user=self.user, **kwargs)
+        page.commit_revision(content, self.user)
+        return page
+
+    def search(self, query, for_user=None):
+        results = self.backend.search(query, for_user=for_user)
+        return [page.title for page in results[:len(results)]]
+
+    def test_ranking(self):
+        self.create("Once", "An apple")
+        self.create("Apple", "An apple")
+        self.create("Twice", "An apple and another apple")
+        self.assertEqual(self.search("apple"), ["Apple", "Twice", "Once"])
+
+    def test_all_terms(self):
+        self.create("Apple", "Fruit")
+        self.create("Banana", "Fruit")
+        self.create("Both", "Apple and banana")
+        self.assertEqual(self.search("apple banana"), ["Both"])
+        self.assertEqual(self.search("banana cherry"), [])
+
+    def test_unpublished(self):
+        self.create("Published", "Apple")
+        self.create("Draft", "Apple", status=CONTENT_STATUS_DRAFT)
+        self.assertEqual(self.search("apple"), ["Published"])
+        self.assertEqual(sorted(self.search("apple", for_user=self.user)),
+                         ["Draft", "Published"])
+
+    def test_snippet(self):
+        self.create("Foo", "<script>alert('apple')</script> & apple")
+        page = self.backend.search("apple")[0]
+        self.assertEqual(page.search_snippet,
+                         "&lt;script&gt;alert(&#39;<b>apple</b>&#39;)"
+                         "&lt;/script&gt; &amp; <b>apple</b>")
+
+
+class KeysetPaginationTest(WikiTestCase):
+    """
+    Revisions are paged through by cursor, newest first, without
+    repeating or skipping any saved at the same time.
+    """
+
+    def setUp(self):
+        super(KeysetPaginationTest, self).setUp()
+        self.page = WikiPage(slug="Foo", title="Foo", user=self.user)
+        for i in range(5):
+            self.page.commit_revision("Version %s" % i, self.user)
+        self.revisions = WikiPageRevision.objects.filter(page=self.page)
+        self.ids = list(self.revisions.order_by("-created", "-id")
+                        .values_list("id", flat=True))
+
+    def paginate(self, cursor=None):
+        page = keyset_paginate(self.revisions, cursor, 2)
+        return [revision.id for revision in page], page.next_cursor
+
+    def test_pages(self):
+        ids, cursor = self.paginate()
+        while cursor is not None:
+            page_ids, cursor = self.paginate(cursor)
+            ids += page_ids
+        self.assertEqual(ids, self.ids)
+
+    def test_equal_created(self):
+        self.revisions.update(created=self.revisions[0].created)
+        self.ids.sort(reverse=True)
+        self.test_pages()
+
+    def test_invalid_cursor(self):
+        first = self.paginate()
+        for cursor in ("", "garbage", "1_2_3", "2010_1", "x_1", "_x",
+                       "99999999999999999999_1"):
+            self.assertEqual(self.paginate(cursor), first)
+        response = self.client.get(reverse("wiki_page_history",
+                                           args=["Foo"]),
+                                   {"before": "garbage"})
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(WIKI_CHANGES_PER_PAGE=2)
+    def test_older_link(self):
+        url = reverse("wiki_page_history", args=["Foo"])
+        response = self.client.get(url)
+        ids = []
+        pages = 1
+        while True:
+            ids += [revision.id for revision in response.context["revisions"]]
+            next_query = response.context["next_query"]
+            if next_query is None:
+                break
+            self.assertContains(response, "Older revisions")
+            response = self.client.get("%s?%s" % (url, next_query))
+            pages += 1
+        self.assertNotContains(response, "Older revisions")
+        self.assertEqual(ids, self.ids)
+        self.assertEqual(pages, 3)
+
+
+class RecordingDiffMatchPatch(diff_match_patch):
+    """
+    Records the deadlines every comparison is given.
+    """
+
+    deadlines = []
+
+    def diff_main(self, text1, text2, checklines=True, deadline=None):
+        self.deadlines.append(deadline)
+        return diff_match_patch.diff_main(self, text1, text2, checklines,
+                                          deadline)
+
+
+class DiffTest(WikiTestCase):
+    """
+    Revisions are compared in each of the diff views, with a coarser
+    diff once comparing them takes too long.
+    """
+
+    text1 = "First line\nSecond line\nThird line\n"
+    text2 = "First line\nSecond changed line\nThird line\n"
+
+    def setUp(self):
+        super(DiffTest, self).setUp()
+        self.default_time = diff.time
+        self.default_diff_match_patch = diff.diff_match_patch
+        RecordingDiffMatchPatch.deadlines = []
+
+    def tearDown(self):
+        diff.time = self.default_time
+        diff.diff_match_patch = self.default_diff_match_patch
+
+    def slow_clock(self):
+        """
+        Makes each comparison take a second, starting from 0.
+        """
+        ticks = iter(range(100))
+        diff.time = lambda: next(ticks)
+
+    @override_settings(WIKI_DIFF_TIMEOUT=1.0)
+    def test_coarse(self):
+        self.slow_clock()
+        diff.diff_match_patch = RecordingDiffMatchPatch
+        diffs, coarse = diff.diff_texts(self.text1, self.text2)
+        self.assertTrue(coarse)
+        # Compared by lines after comparing chars ran out of time.
+        self.assertTrue(all(text.endswith("\n") for op, text in diffs))
+        self.assertEqual("".join(text for op, text in diffs
+                                 if op != diff.DIFF_INSERT), self.text1)
+        self.assertEqual("".join(text for op, text in diffs
+                                 if op != diff.DIFF_DELETE), self.text2)
+        # Both comparisons finish within the one timeout.
+        self.assertEqual(max(RecordingDiffMatchPatch.deadlines), 1.0)
+
+    @override_settings(WIKI_DIFF_TIMEOUT=1.0)
+    def test_fine(self):
+        diffs, coarse = diff.diff_texts(self.text1, self.text2)
+        self.assertFalse(coarse)
+        self.assertIn((diff.DIFF_INSERT, "changed "), diffs)
+
+    @override_settings(WIKI_DIFF_LINE_MODE_THRESHOLD=10)
+    def test_long_texts(self):
+        diffs, coarse = diff.diff_texts(self.text1, self.text2, "words")
+        self.assertTrue(coarse)
+        self.assertIn((diff.DIFF_INSERT, "Second changed line\n"), diffs)
+
+    def get_diff(self, view):
+        page = WikiPage(slug="Foo", title="Foo", user=self.user)
+        page.commit_revision(self.text1, self.user)
+        page.commit_revision(self.text2, self.user)
+        from_revision, to_revision = (WikiPageRevision.objects
+                                      .order_by("created", "id"))
+        response = self.client.get(reverse("wiki_page_diff", args=["Foo"]),
+                                   {"from_revision_pk": from_revision.pk,
+                                    "to_revision_pk": to_revision.pk,
+                                    "view": view})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["diff_view"], view)
+        self.assertFalse(response.context["diff_coarse"])
+        return response.context["diff"]
+
+    def test_inline_view(self):
+        self.assertEqual(self.get_diff("inline"),
+                         [(diff.DIFF_EQUAL, "First line\nSecond "),
+                          (diff.DIFF_INSERT, "changed "),
+                          (diff.DIFF_EQUAL, "line\nThird line\n")])
+
+    def test_words_view(self):
+        self.assertIn((diff.DIFF_INSERT, "changed "),
+                      self.get_diff("words"))
+
+    def test_unified_view(self):
+        self.assertEqual(self.get_diff("unified"),
+                         [(diff.DIFF_EQUAL, "First line"),
+                          (diff.DIFF_DELETE, "Second line"),
+                          (diff.DIFF_INSERT, "Second changed line"),
+                          (diff.DIFF_EQUAL, "Third line")])
+
+    def test_split_view(self):
+        self.assertEqual(self.get_diff("split"),
+                         [(diff.DIFF_EQUAL, "First line",
+                           diff.DIFF_EQUAL, "First line"),
+                          (diff.DIFF_DELETE, "Second line",
+                           diff.DIFF_INSERT, "Second changed line"),
+                          (diff.DIFF_EQUAL, "Third line",
+                           diff.DIFF_EQUAL, "Third line")])
+
+
+class SidebarCacheTest(WikiTestCase):
+    """
+    The cached sidebar is outdated when pages or their categories
+    change, and refreshed in the background unless jobs run inline.
+    """
+
+    def setUp(self):
+        super(SidebarCacheTest, self).setUp()
+        self.default_cache = cache.cache
+        cache.cache = LocMemCache("sidebar", {})
+        self.page = WikiPage(slug="Foo", title="Foo", user=self.user)
+        self.page.commit_revision("Text", self.user)
+        self.category = WikiCategory.objects.create(title="Things")
+
+    def tearDown(self):
+        cache.cache = self.default_cache
+
+    def assertInvalidates(self, func):
+        version = cache.sidebar_cache.get_version()
+        func()
+        self.assertGreater(cache.sidebar_cache.get_version(), version)
+
+    def test_page_saved(self):
+        self.assertInvalidates(
+            lambda: self.page.commit_revision("Other text", self.user))
+
+    def test_categories_changed(self):
+        self.assertInvalidates(lambda: self.page.categories.add(self.category))
+        self.assertInvalidates(
+            lambda: self.page.categories.remove(self.category))
+
+    def refresh(self):
+        """
+        Caches a value and outdates it, returning what's got next.
+        """
+        self.assertEqual(cache.sidebar_cache.get("value", lambda: 1), 1)
+        cache.sidebar_cache.invalidate()
+        return cache.sidebar_cache.get("value", lambda: 2)
+
+    @override_settings(WIKI_SIDEBAR_BACKGROUND_REFRESH=True)
+    def test_refreshed_inline(self):
+        self.assertEqual(self.refresh(), 2)
+
+    @override_settings(WIKI_SIDEBAR_BACKGROUND_REFRESH=True,
+                       WIKI_JOB_EXECUTOR="mezzanine_wiki.jobs."
+                                         "ThreadExecutor")
+    def test_refreshed_in_background(self):
+        threads = set(threading.enumerate())
+        self.assertEqual(self.refresh(), 1)
+        for thread in set(threading.enumerate()) - threads:
+            thread.join()
+        self.assertEqual(cache.sidebar_cache.get("value", lambda: 3), 2)
+
+
+@override_settings(WIKI_PAGE_CACHE_TIMEOUT=60)
+class ConditionalGetTest(WikiTestCase):
+    """
+    Pages from the page cache are last modified when they or the
+    sidebar last changed, however often they're cached again.
+    """
+
+    def setUp(self):
+        super(ConditionalGetTest, self).setUp()
+        self.default_cache = cache.cache
+        self.default_time = cache.time
+        cache.cache = LocMemCache("pages", {})
+        self.page = WikiPage(slug="Foo", title="Foo", user=self.user)
+        self.page.commit_revision("Text", self.user)
+        WikiPage.objects.update(updated=datetime(2009, 6, 1, tzinfo=utc))
+        cache.time = lambda: timegm(datetime(2010, 1, 1).utctimetuple())
+        cache.sidebar_cache.invalidate()
+        cache.time = self.default_time
+        self.url = reverse("wiki_page_detail", args=["Foo"])
+
+    def tearDown(self):
+        cache.cache = self.default_cache
+        cache.time = self.default_time
+
+    def get(self, **headers):
+        return self.client.get(self.url, **headers)
+
+    def test_last_modified(self):
+        last_modified = "Fri, 01 Jan 2010 00:00:00 GMT"
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Last-Modified"], last_modified)
+        etag = response["ETag"]
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=last_modified)
+                         .status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Cached again, as when the cached copy expires.
+        cache.page_cache.invalidate(("Foo",), self.page.site_id)
+        response = self.get(HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["Last-Modified"], last_modified)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_edited(self):
+        last_modified = self.get()["Last-Modified"]
+        page = WikiPage.objects.get(pk=self.page.pk)
+        page.commit_revision("Other text", self.user)
+        response = self.get(HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Other text")
+        self.assertGreater(parse_http_date(response["Last-Modified"]),
+                           parse_http_date(last_modified))
+
+
+class ArchiveTest(WikiTestCase):
+    """
+    Pages exported to an archive are imported again with their history,
+    categories, keywords and authors, carrying on from the last batch
+    imported when an import was interrupted.
+    """
+
+    def setUp(self):
+        super(ArchiveTest, self).setUp()
+        self.archive = NamedTemporaryFile(suffix=".json")
+        self.checkpoint = self.archive.name + ".checkpoint"
+        author = User.objects.create_user("wiki-author", "", "wiki-author")
+        category = WikiCategory.objects.create(title="Things")
+        for title, revisions in (("Foo", 1), ("Bar", 5), ("Baz", 1)):
+            page = WikiPage(slug=title, title=title, user=author)
+            for i in range(revisions):
+                user = author if i % 2 else self.user
+                page.commit_revision("%s version %s" % (title, i), user,
+                                     "Summary %s" % i)
+        page.categories.add(category)
+        page.keywords.add(AssignedKeyword(
+            keyword=Keyword.objects.create(title="Keyword")))
+        call_command("wiki_export", self.archive.name, verbosity=0)
+        self.exported = self.dump()
+        WikiPage.objects.all().delete()
+        WikiCategory.objects.all().delete()
+
+    def tearDown(self):
+        self.archive.close()
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+    def dump(self):
+        """
+        Returns what's exported and imported of each page.
+        """
+        pages = []
+        for page in WikiPage.objects.order_by("slug"):
+            revisions = [(revision.content, revision.description,
+                          revision.user.username, revision.created)
+                         for revision in page.wikipagerevision_set
+                         .order_by("created", "id")]
+            pages.append((page.slug, page.title, page.content,
+                          page.status, page.user.username,
+                          page.latest_revision.content, revisions,
+                          [c.title for c in page.categories.all()],
+                          [a.keyword.title for a in page.keywords.all()]))
+        return pages
+
+    def import_archive(self, **options):
+        output = StringIO()
+        call_command("wiki_import", self.archive.name, stdout=output,
+                     **options)
+        return output.getvalue()
+
+    def test_round_trip(self):
+        self.assertIn("Imported 3 pages, 7 revisions", self.import_archive())
+        self.assertEqual(self.dump(), self.exported)
+        self.assertIn("skipped 3 existing pages", self.import_archive())
+        self.assertEqual(self.dump(), self.exported)
+
+    def test_resume(self):
+        with open(self.archive.name) as f:
+            lines = f.readlines()
+        with open(self.archive.name, "w") as f:
+            # Interrupted by a broken line in the middle of Bar, which
+            # is being inserted with its revisions.
+            bar = [i for i, line in enumerate(lines)
+                   if json.loads(line).get("slug") == "Bar"][0]
+            f.writelines(lines[:bar + 4] + ["{\n"] + lines[bar + 5:])
+        self.assertRaises(ValueError, self.import_archive, batch_size=2)
+        self.assertEqual([page[0] for page in self.dump()], ["Foo"])
+        with open(self.checkpoint) as f:
+            self.assertEqual(int(f.read()), bar)
+        with open(self.archive.name, "w") as f:
+            f.writelines(lines)
+        output = self.import_archive(batch_size=2)
+        self.assertIn("Resuming after line %s" % bar, output)
+        self.assertIn("Imported 2 pages, 6 revisions, skipped 0", output)
+        self.assertEqual(self.dump(), self.exported)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+
+@skipIf(benchmarks is None, "The benchmarks are only in the source tree.")
+class BenchmarksTest(WikiTestCase):
+    """
+    Each benchmark scenario runs against a tiny generated wiki.
+    """
+
+    def test_scenarios(self):
+        options = benchmarks.run.parse_args(["--pages", "5", "--revisions",
+                                             "3", "--repeat", "1"])
+        user = User.objects.create_superuser("benchmark", "", "benchmark")
+        generate(user, options.pages, revisions=options.revisions,
+                 distribution="constant", seed=options.seed)
+        names = []
+        for name, setup in benchmarks.scenarios.scenarios:
+            result = benchmarks.run.measure(setup(options), options.repeat)
+            self.assertGreaterEqual(result["median"], 0)
+            names.append(name)
+        self.assertIn("wiki_page_undo", names)
+
+
+class RecordingImporter(Importer):
+    """
+    Records the categories, pages and revisions it's given.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingImporter, self).__init__(*args, **kwargs)
+        self.records = []
+
+    def add_category(self, slug, title):
+        self.records.append({"type": "category", "slug": slug,
+                             "title": title})
+        return super(RecordingImporter, self).add_category(slug, title)
+
+    def add_page(self, record):
+        self.records.append(dict(record))
+        return super(RecordingImporter, self).add_page(record)
+
+    def add_revision(self, record):
+        self.records.append(dict(record))
+        return super(RecordingImporter, self).add_revision(record)
+
+
+class GenerateTest(WikiTestCase):
+    """
+    Generating a wiki with the same seed generates the same pages,
+    which are only added once.
+    """
+
+    def setUp(self):
+        super(GenerateTest, self).setUp()
+        self.module = import_module("mezzanine_wiki.generate")
+        self.default_importer = self.module.Importer
+        self.module.Importer = RecordingImporter
+
+    def tearDown(self):
+        self.module.Importer = self.default_importer
+
+    def generate_wiki(self, seed):
+        return generate(self.user, 10, revisions=3, seed=seed)
+
+    def test_same_seed(self):
+        first = self.generate_wiki(3)
+        self.assertEqual(first.page_count, 10)
+        pages = WikiPage.objects.count()
+        revisions = WikiPageRevision.objects.count()
+        second = self.generate_wiki(3)
+        self.assertEqual(second.records, first.records)
+        self.assertEqual((second.page_count, second.revision_count),
+                         (0, 0))
+        self.assertEqual(second.skipped, 10)
+        self.assertEqual(WikiPage.objects.count(), pages)
+        self.assertEqual(WikiPageRevision.objects.count(), revisions)
+
+    def test_other_seed(self):
+        self.assertNotEqual(self.generate_wiki(3).records,
+                            self.generate_wiki(4).records)
+
+
+class SectionRenderTest(WikiTestCase):
+    """
+    Content rendered a section at a time renders to the same HTML as
+    the whole document, with only the sections that changed rendered
+    again.
+    """
+
+    documents = [
+        "* One\n* Two\n\n# Heading\n\nText",
+        "1. One\n\n    Continued\n\n## Heading\n\nText",
+        "> Quoted\n> text\n\n# Heading\n\n> Quoted\n\n# Heading",
+        "Title\n=====\n\nText\n\n# Heading\n\nOther\n-----\n\nText",
+        "    code\n\n    # Comment\n\n# Heading\n\n    # Comment",
+        "[Link][1]\n\n# Heading\n\n[1]: http://example.com/",
+        "<div>\n\n# Heading\n\n</div>\n\n# Heading",
+        "Text\r\n\r\n# Heading\r\n\r\nText",
+        "Text\n \t\n# Heading\n\nText",
+        "# One\n\n[[Foo]]\n\n# Two\n\n[[Bar]] and [[Foo|foo]]",
+    ]
+
+    def setUp(self):
+        super(SectionRenderTest, self).setUp()
+        self.module = import_module("mezzanine_wiki.filters")
+        self.default_cache = self.module.cache
+        self.module.cache = LocMemCache("sections", {})
+        self.renderer = WikiLinksRenderer()
+
+    def tearDown(self):
+        self.module.cache = self.default_cache
+
+    def assertSectionsRendered(self, content):
+        whole = self.renderer.convert(content)
+        self.assertEqual(self.renderer.render_with_links(content), whole)
+        # Again, from the cache.
+        self.assertEqual(self.renderer.render_with_links(content), whole)
+
+    def test_documents(self):
+        for content in self.documents:
+            self.assertSectionsRendered(content)
+            self.assertSectionsRendered(content + "\n")
+
+    def test_existence_changed(self):
+        content = self.documents[-1]
+        self.assertSectionsRendered(content)
+        page = WikiPage(slug="Bar", title="Bar", user=self.user)
+        page.commit_revision("Text", self.user)
+        self.assertSectionsRendered(content)
+
+    def test_one_section_edited(self):
+        converted = []
+        convert = self.renderer.convert
+
+        def counting_convert(content):
+            converted.append(content)
+            return convert(content)
+
+        self.renderer.convert = counting_convert
+        content = "# One\n\nText\n\n# Two\n\nText\n\n# Three\n\nText"
+        self.renderer.render_with_links(content)
+        self.assertEqual(len(converted), 3)
+        del converted[:]
+        self.renderer.render_with_links(content.replace("Two", "Second"))
+        self.assertEqual(converted, ["# Second\n\nText\n\n"])
@@ -7,6 +7,9 @@ urlpatterns = patterns("mezzanine_wiki.views",
     url("^pages/$", "wiki_page_list", name="wiki_page_list"),
     url("^pages:new/$", "wiki_page_new", name="wiki_page_new"),
     url("^pages:changes/$", "wiki_page_changes", name="wiki_page_changes"),
+    url("^pages:orphans/$", "wiki_page_orphans", name="wiki_page_orphans"),
+    url("^pages:wanted/$", "wiki_page_wanted", name="wiki_page_wanted"),
+    url("^pages:search/$", "wiki_page_search", name="wiki_page_search"),
     url("^tag:(?P<tag>.*)/$", "wiki_page_list", name="wiki_page_list_tag"),
     url("^category:(?P<category>.*)/$", "wiki_page_list",
                                               name="wiki_page_list_category"),
@@ -16,6 +19,8 @@ urlpatterns = patterns("mezzanine_wiki.views",
                                               name="wiki_page_history"),
     url("^(?P<slug>.*)/history/(?P<rev_id>\d+)/$", "wiki_page_revision",
                                               name="wiki_page_revision"),
+    url("^(?P<slug>.*)/backlinks/$", "wiki_page_backlinks",
+                                              name="wiki_page_backlinks"),
     url("^(?P<slug>.*)/diff/$", "wiki_page_diff",
                                               name="wiki_page_diff"),
     url("^(?P<slug>.*)/revert/(?P<revision_pk>[0-9]+)/$", "wiki_page_revert",
@@ -1,5 +1,23 @@
 import re
-from django.conf import settings
+from datetime import datetime
+from hashlib import sha1
+
+from diff_match_patch import diff_match_patch
+from django.db.models import Q
+try:
+    from django.db.transaction import atomic
+except ImportError:
+    # Django < 1.6
+    from django.db.transaction import commit_on_success as atomic
+from django.utils import timezone
+from mezzanine.conf import settings
+from mezzanine.utils.importing import import_dotted_path
+from mezzanine_wiki.mdx_wikilinks_extra import WIKILINK_RE, clean_label
+from mezzanine_wiki.metrics import timed
+
+
+# Text filter functions imported so far, keyed by dotted path.
+_text_filters = {}
 
 
 def urlize_title(title):
@@ -8,3 +26,182 @@ def urlize_title(title):
 def deurlize_title(title):
     return re.sub(r'[_\s]+', ' ', title)
 
+def get_text_filter():
+    """
+    Returns the function specified by the ``WIKI_TEXT_FILTER`` setting,
+    importing it only once per process.
+    """
+    path = settings.WIKI_TEXT_FILTER
+    if not path:
+        return lambda s: s
+    try:
+        return _text_filters[path]
+    except KeyError:
+        func = _text_filters[path] = import_dotted_path(path)
+        return func
+
+def get_renderer_version():
+    """
+    Identifies the output of the current text filter, so that stored
+    rendered content can be told apart from content rendered by a
+    different filter.
+    """
+    return "%s:%s" % (settings.WIKI_TEXT_FILTER or "",
+                      settings.WIKI_TEXT_FILTER_VERSION)
+
+def get_content_hash(content):
+    return sha1(content.encode("utf-8")).hexdigest()
+
+@timed("render")
+def render_wikitext(content):
+    """
+    Renders wiki markup using the ``WIKI_TEXT_FILTER`` setting.
+    """
+    return get_text_filter()(content)
+
+def extract_wikilinks(content):
+    """
+    Returns the set of slugs linked to by wikilinks in the content.
+    """
+    return set(clean_label(m.group(1).strip().capitalize())
+               for m in re.finditer(WIKILINK_RE, content)
+               if m.group(1).strip())
+
+@timed("render")
+def render_wikitext_links(content):
+    """
+    Renders wiki markup like ``render_wikitext``, also returning the
+    set of slugs linked to. Text filters may provide this themselves
+    with a ``render_with_links`` function, otherwise the links are
+    taken from the markup.
+    """
+    func = get_text_filter()
+    render_with_links = getattr(func, "render_with_links", None)
+    if render_with_links is not None:
+        return render_with_links(content)
+    return func(content), extract_wikilinks(content)
+
+def make_delta(base, content):
+    """
+    Returns a patch that turns ``base`` into ``content``, or ``None`` if
+    the patch can't reproduce it exactly.
+    """
+    dmp = diff_match_patch()
+    delta = dmp.patch_toText(dmp.patch_make(base, content))
+    if apply_delta(base, delta) != content:
+        return None
+    return delta
+
+def apply_delta(base, delta):
+    """
+    Applies a patch created by ``make_delta`` to ``base``.
+    """
+    dmp = diff_match_patch()
+    return dmp.patch_apply(dmp.patch_fromText(delta), base)[0]
+
+@timed("render")
+def render_wikitext_many(contents):
+    """
+    Renders a sequence of wiki markup documents, using the text filter's
+    ``render_many`` function when it has one.
+    """
+    func = get_text_filter()
+    render_many = getattr(func, "render_many", None)
+    if render_many is not None:
+        return render_many(contents)
+    return [func(content) for content in contents]
+
+def queryset_chunks(queryset, batch_size=500):
+    """
+    Yields lists of objects from the queryset ordered by primary key,
+    fetching ``batch_size`` rows at a time so that large tables can be
+    processed in constant memory.
+    """
+    last_pk = None
+    while True:
+        chunk = queryset.order_by("pk")
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk[:batch_size])
+        if not chunk:
+            break
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+class KeysetPage(object):
+    """
+    A page of objects from ``keyset_paginate``, with the cursor for the
+    next page if there is one.
+    """
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+def make_cursor(obj):
+    """
+    Returns the cursor for the position after ``obj`` in objects
+    ordered by ``keyset_paginate``.
+    """
+    created = obj.created
+    if created is None:
+        return "_%s" % obj.id
+    if timezone.is_aware(created):
+        created = timezone.make_naive(created, timezone.utc)
+    return "%s_%s" % (created.strftime("%Y%m%d%H%M%S%f"), obj.id)
+
+def parse_cursor(cursor):
+    """
+    Returns the ``(created, id)`` position of a cursor created by
+    ``make_cursor``, or ``None`` if it isn't valid.
+    """
+    try:
+        created, pk = cursor.split("_")
+        pk = int(pk)
+        if not created:
+            return None, pk
+        created = datetime.strptime(created, "%Y%m%d%H%M%S%f")
+    except (AttributeError, ValueError):
+        return None
+    if settings.USE_TZ:
+        created = timezone.make_aware(created, timezone.utc)
+    return created, pk
+
+def keyset_paginate(queryset, cursor, per_page):
+    """
+    Returns a ``KeysetPage`` of objects ordered newest first by
+    ``created`` and ``id``, starting after the cursor. Each page is a
+    range scan from the cursor's position, so unlike offset pagination
+    its cost doesn't grow with how far back the page is. Objects with
+    no ``created`` date, stored before it was added, come last ordered
+    by ``id``.
+    """
+    dated = queryset.filter(created__isnull=False).order_by("-created", "-id")
+    undated = queryset.filter(created__isnull=True).order_by("-id")
+    position = parse_cursor(cursor)
+    if position is not None:
+        created, pk = position
+        if created is None:
+            dated = dated.none()
+            undated = undated.filter(id__lt=pk)
+        else:
+            dated = dated.filter(Q(created__lt=created) |
+                                 Q(created=created, id__lt=pk))
+    object_list = list(dated[:per_page + 1])
+    if len(object_list) <= per_page:
+        object_list += list(undated[:per_page + 1 - len(object_list)])
+    next_cursor = None
+    if len(object_list) > per_page:
+        object_list = object_list[:per_page]
+        next_cursor = make_cursor(object_list[-1])
+    return KeysetPage(object_list, next_cursor)
@@ -1,5 +1,7 @@
-from calendar import month_name
+from calendar import month_name, timegm
 from collections import defaultdict
+from datetime import timedelta
+from hashlib import md5
 
 from django.http import Http404
 from django.contrib.auth.models import User
@@ -8,21 +10,191 @@ from django.contrib import messages
 from django.shortcuts import get_object_or_404
 from django.core.urlresolvers import reverse
 from django.http import HttpResponseRedirect, HttpResponseForbidden, HttpResponseNotFound
+from django.http import HttpResponse, HttpResponseNotModified
 from django.contrib.auth.decorators import login_required
+from django.db import IntegrityError
 from django import VERSION
-from django.utils.translation import ugettext as _
-
-from mezzanine_wiki.models import WikiPage, WikiCategory, WikiPageRevision
+from django.utils.cache import patch_vary_headers
+from django.utils.http import (http_date, parse_etags, parse_http_date_safe,
+                               quote_etag)
+from django.utils.timezone import now
+from django.utils.translation import ugettext as _, get_language
+
+from mezzanine_wiki.models import (WikiPage, WikiCategory, WikiPageRevision,
+                                   WikiLink)
 from mezzanine.conf import settings
+from mezzanine.core.models import (CONTENT_STATUS_DRAFT,
+                                   CONTENT_STATUS_PUBLISHED)
 from mezzanine.generic.models import AssignedKeyword, Keyword
+from mezzanine.utils.device import device_from_request
 from mezzanine.utils.views import render, paginate
 from mezzanine_wiki.forms import WikiPageForm
-from mezzanine_wiki.utils import urlize_title, deurlize_title
+from mezzanine_wiki.managers import is_published
+from mezzanine_wiki.search import get_search_backend
+from mezzanine_wiki.utils import (urlize_title, deurlize_title,
+                                  keyset_paginate)
 from mezzanine_wiki import defaults as wiki_settings
+from mezzanine_wiki.cache import page_cache, sidebar_cache, slug_cache
+from mezzanine_wiki.diff import (diff_texts, get_revision_diff, merge_texts,
+                                 unified_rows, split_rows)
+from mezzanine_wiki.metrics import render_metrics, timer
+from mezzanine_wiki.queries import query_budget
 from diff_match_patch import diff_match_patch
 from urllib import urlencode, quote
 
 
+# How revisions are compared for each view of wiki_page_diff.
+DIFF_VIEWS = {
+    'inline': 'chars',
+    'words': 'words',
+    'unified': 'lines',
+    'split': 'lines',
+}
+
+def next_page_query(request, page):
+    """
+    Returns the query string for the page after a ``KeysetPage``,
+    keeping the current query's other parameters.
+    """
+    if not page.has_next():
+        return None
+    query = request.GET.copy()
+    query["before"] = page.next_cursor
+    return query.urlencode()
+
+
+def get_wiki_page(request, slug):
+    """
+    Returns the wiki page with the slug, or ``None`` if there isn't one.
+    The page is loaded along with its user in a single query, once per
+    request, and slugs known to have no page aren't queried at all.
+    """
+    wiki_pages = getattr(request, "_wiki_pages", None)
+    if wiki_pages is None:
+        wiki_pages = request._wiki_pages = {}
+    if slug not in wiki_pages:
+        if slug_cache.is_enabled() and slug_cache.get(slug) is None:
+            wiki_pages[slug] = None
+            return None
+        try:
+            wiki_pages[slug] = WikiPage.objects.select_related("user").get(
+                slug=slug)
+        except WikiPage.DoesNotExist:
+            wiki_pages[slug] = None
+    return wiki_pages[slug]
+
+
+def get_published_wiki_page(request, slug):
+    """
+    Returns the wiki page with the slug if it's published for the
+    request's user, like ``WikiPage.objects.published``, or ``None``.
+    """
+    wiki_page = get_wiki_page(request, slug)
+    if wiki_page is not None and is_published(wiki_page, request.user):
+        return wiki_page
+    return None
+
+
+def is_page_cacheable(request):
+    """
+    Whether the response to the request can come from the page cache,
+    which only holds pages as shown to anonymous users without any
+    session or pending messages.
+    """
+    return (settings.WIKI_PAGE_CACHE_TIMEOUT and request.method == "GET"
+            and not request.GET
+            and settings.SESSION_COOKIE_NAME not in request.COOKIES
+            and "messages" not in request.COOKIES
+            and not request.user.is_authenticated())
+
+
+def cached_page_response(request, cached):
+    """
+    Returns the response for a page from the page cache, or a 304 Not
+    Modified response if the client's copy is still current.
+    """
+    etag = quote_etag(cached["etag"])
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if_modified_since = request.META.get("HTTP_IF_MODIFIED_SINCE")
+    if if_none_match:
+        not_modified = (cached["etag"] in parse_etags(if_none_match) or
+                        if_none_match.strip() == "*")
+    elif if_modified_since:
+        since = parse_http_date_safe(if_modified_since)
+        not_modified = since is not None and since >= cached["last_modified"]
+    else:
+        not_modified = False
+    if not_modified:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(cached["content"],
+                                content_type=cached["content_type"])
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(cached["last_modified"])
+    patch_vary_headers(response, ("Cookie",))
+    return response
+
+
+def get_last_modified(wiki_page):
+    """
+    Returns the time a wiki page as shown was last changed, in seconds
+    since the epoch. That's when the page was saved, or when the
+    sidebar was last outdated by a change to any page, which also
+    changes whether links to it lead to a page. The current time is
+    used when either isn't known.
+    """
+    updated = wiki_page.updated or now()
+    invalidated = sidebar_cache.get_invalidated() or timegm(
+        now().utctimetuple())
+    return max(timegm(updated.utctimetuple()), invalidated)
+
+
+def set_page_lists(wiki_pages):
+    """
+    Returns a list of the wiki pages, each given ``category_list`` and
+    ``keyword_list`` attributes without a query per page.
+    """
+    if settings.WIKI_DENORMALIZED_LISTS:
+        wiki_pages = list(wiki_pages)
+        for page in wiki_pages:
+            page.category_list = page.get_category_list()
+            page.keyword_list = page.get_keyword_list()
+        return wiki_pages
+
+    # For Django 1.3 we create dicts mapping wiki page IDs to lists of
+    # categories and keywords, and assign these to each wiki page
+    #
+    # For Django 1.4 we just use prefetch related.
+    if VERSION >= (1, 4):
+        rel = ("categories", "keywords__keyword")
+        wiki_pages = list(wiki_pages.prefetch_related(*rel))
+        for page in wiki_pages:
+            page.category_list = page.categories.all()
+            page.keyword_list = [k.keyword for k in page.keywords.all()]
+        return wiki_pages
+    wiki_pages = list(wiki_pages)
+    categories = defaultdict(list)
+    if wiki_pages:
+        ids = ",".join([str(p.id) for p in wiki_pages])
+        for cat in WikiCategory.objects.raw(
+            "SELECT * FROM mezzanine_wiki_wikicategory "
+            "JOIN mezzanine_wiki_wikipage_categories "
+            "ON mezzanine_wiki_wikicategory.id = wikicategory_id "
+            "WHERE wikipage_id IN (%s)" % ids):
+            categories[cat.wikipage_id].append(cat)
+    keywords = defaultdict(list)
+    wikipage_type = ContentType.objects.get(app_label="mezzanine_wiki",
+                                            model="wikipage")
+    assigned = AssignedKeyword.objects.filter(wikipage__in=wiki_pages,
+                    content_type=wikipage_type).select_related("keyword")
+    for a in assigned:
+        keywords[a.object_pk].append(a.keyword)
+    for page in wiki_pages:
+        page.category_list = categories[page.id]
+        page.keyword_list = keywords[page.id]
+    return wiki_pages
+
+
 def wiki_index(request, template_name='mezawiki/wiki_page_detail.html'):
     """
     Redirects to the default wiki index name.
@@ -33,6 +205,7 @@ def wiki_index(request, template_name='mezawiki/wiki_page_detail.html'):
             reverse('wiki_page_detail', args=[settings.WIKI_DEFAULT_INDEX]))
 
 
+@query_budget(20)
 def wiki_page_list(request, tag=None, username=None,
                    category=None, template="mezawiki/wiki_page_list.html"):
     """
@@ -60,55 +233,20 @@ def wiki_page_list(request, tag=None, username=None,
         wiki_pages = wiki_pages.filter(user=author)
         templates.append(u"mezawiki/wiki_page_list_%s.html" % username)
 
-    # We want to iterate keywords and categories for each wiki page
-    # without triggering "num posts x 2" queries.
-    #
-    # For Django 1.3 we create dicts mapping wiki page IDs to lists of
-    # categories and keywords, and assign these to each wiki page
-    #
-    # For Django 1.4 we just use prefetch related.
-
-    if VERSION >= (1, 4):
-        rel = ("categories", "keywords__keyword")
-        wiki_pages = wiki_pages.select_related("user").prefetch_related(*rel)
-    else:
-        wiki_pages = list(wiki_pages.select_related("user"))
-        categories = defaultdict(list)
-        if wiki_pages:
-            ids = ",".join([str(p.id) for p in wiki_pages])
-            for cat in WikiCategory.objects.raw(
-                "SELECT * FROM mezzanine_wiki_wikicategory "
-                "JOIN mezzanine_wiki_wikipage_categories "
-                "ON mezzanine_wiki_wikicategory.id = wikicategory_id "
-                "WHERE wikipage_id IN (%s)" % ids):
-                categories[cat.wikipage_id].append(cat)
-        keywords = defaultdict(list)
-        wikipage_type = ContentType.objects.get(app_label="mezzanine_wiki",
-                                                model="wikipage")
-        assigned = AssignedKeyword.objects.filter(wikipage__in=wiki_pages,
-                        content_type=wikipage_type).select_related("keyword")
-        for a in assigned:
-            keywords[a.object_pk].append(a.keyword)
-    for i, page in enumerate(wiki_pages):
-        if VERSION < (1, 4):
-            setattr(wiki_pages[i], "category_list", categories[page.id])
-            setattr(wiki_pages[i], "keyword_list", keywords[page.id])
-        else:
-            setattr(wiki_pages[i], "category_list",
-                    page.categories.all())
-            setattr(wiki_pages[i], "keyword_list",
-                    [k.keyword for k in page.keywords.all()])
-
-    wiki_pages = paginate(wiki_pages,
+    # Only the pages shown are loaded, and their categories and keywords
+    # are either stored with them or loaded for all of them at once.
+    wiki_pages = paginate(wiki_pages.select_related("user"),
                           request.GET.get("page", 1),
                           settings.WIKI_PAGES_PER_PAGE,
                           settings.MAX_PAGING_LINKS)
+    wiki_pages.object_list = set_page_lists(wiki_pages.object_list)
     context = {"wiki_pages": wiki_pages,
                "tag": tag, "category": category, "author": author}
     templates.append(template)
     return render(request, templates, context)
 
 
+@query_budget(20)
 def wiki_page_detail(request, slug, year=None, month=None,
                      template="mezawiki/wiki_page_detail.html"):
     """
@@ -125,14 +263,21 @@ def wiki_page_detail(request, slug, year=None, month=None,
         return HttpResponseRedirect(
             reverse('wiki_page_detail', args=[slug])
         )
-    try:
-        wiki_page_exist = WikiPage.objects.get(slug=slug)
-        if wiki_page_exist.status == 1 and not wiki_page_exist.can_edit_wikipage(request.user):
-            return HttpResponseForbidden(
-                _("You don't have permission to view this wiki page."))
-        wiki_pages = WikiPage.objects.published(for_user=request.user)
-        wiki_page = wiki_pages.get(slug=slug)
-    except WikiPage.DoesNotExist:
+    cacheable = is_page_cacheable(request)
+    if cacheable:
+        variant = (get_language(), device_from_request(request))
+        cached = page_cache.get(slug, variant)
+        if cached is not None:
+            return cached_page_response(request, cached)
+        # Read before rendering, so that sidebar changes while
+        # rendering outdate the cached page.
+        sidebar_version = sidebar_cache.get_version()
+    wiki_page = get_wiki_page(request, slug)
+    if (wiki_page is not None and wiki_page.status == CONTENT_STATUS_DRAFT
+            and not wiki_page.can_edit_wikipage(request.user)):
+        return HttpResponseForbidden(
+            _("You don't have permission to view this wiki page."))
+    if wiki_page is None or not is_published(wiki_page, request.user):
         if can_add_wikipage(request.user):
             return HttpResponseRedirect(reverse('wiki_page_edit', args=[slug]))
         else:
@@ -140,9 +285,32 @@ def wiki_page_detail(request, slug, year=None, month=None,
                 _("You don't have permission to add new wiki page."))
     context = {"wiki_page": wiki_page}
     templates = [u"mezawiki/wiki_page_detail_%s.html" % unicode(slug), template]
-    return render(request, templates, context)
-
-
+    response = render(request, templates, context)
+    if cacheable and wiki_page.status == CONTENT_STATUS_PUBLISHED:
+        def cache_response(response):
+            # Pages with a CSRF token can't be shared between users,
+            # and pages shown while being rendered again are outdated.
+            if (request.META.get("CSRF_COOKIE_USED") or
+                    not wiki_page.is_rendered()):
+                return None
+            content = response.content
+            cached = {
+                "content": content,
+                "content_type": response["Content-Type"],
+                "etag": md5(content).hexdigest(),
+                "last_modified": get_last_modified(wiki_page),
+            }
+            timeout = settings.WIKI_PAGE_CACHE_TIMEOUT
+            if wiki_page.expiry_date:
+                expires = (wiki_page.expiry_date - now()).total_seconds()
+                timeout = max(1, min(timeout, int(expires)))
+            page_cache.set(slug, variant, sidebar_version, cached, timeout)
+            return cached_page_response(request, cached)
+        response.add_post_render_callback(cache_response)
+    return response
+
+
+@query_budget(20)
 def wiki_page_history(request, slug,
                      template="mezawiki/wiki_page_history.html"):
     """
@@ -159,20 +327,28 @@ def wiki_page_history(request, slug,
         return HttpResponseRedirect(
             reverse('wiki_page_history', args=[slug])
         )
-    try:
-        wiki_pages = WikiPage.objects.published(for_user=request.user)
-        wiki_page = wiki_pages.get(slug=slug)
-        revisions = WikiPageRevision.objects.filter(page=wiki_page)
-    except WikiPage.DoesNotExist:
+    wiki_page = get_published_wiki_page(request, slug)
+    if wiki_page is None:
         return HttpResponseRedirect(reverse('wiki_page_edit', args=[slug]))
     if not wiki_page.can_view_wikipage(request.user):
         return HttpResponseForbidden(
             _("You don't have permission to view this wiki page."))
-    context = {"wiki_page": wiki_page, "revisions": revisions}
+    # Revision content is never needed to list the history.
+    settings.use_editable()
+    revisions = (WikiPageRevision.objects.filter(page=wiki_page)
+                 .select_related("user")
+                 .defer("stored_content", "content_rendered"))
+    revisions = keyset_paginate(revisions, request.GET.get("before"),
+                                settings.WIKI_CHANGES_PER_PAGE)
+    for revision in revisions:
+        revision.page = wiki_page
+    context = {"wiki_page": wiki_page, "revisions": revisions,
+               "next_query": next_page_query(request, revisions)}
     templates = [u"mezawiki/wiki_page_history_%s.html" % unicode(slug), template]
     return render(request, templates, context)
 
 
+@query_budget(20)
 def wiki_page_revision(request, slug, rev_id,
                      template="mezawiki/wiki_page_revision.html"):
     """
@@ -187,22 +363,23 @@ def wiki_page_revision(request, slug, rev_id,
     slug = urlize_title(slug)
     if slug != slug_original:
         return HttpResponseRedirect(
-            reverse('wiki_page_revision', args=[slug])
+            reverse('wiki_page_revision', args=[slug, rev_id])
         )
-    try:
-        wiki_pages = WikiPage.objects.published(for_user=request.user)
-        wiki_page = wiki_pages.get(slug=slug)
-        revision = WikiPageRevision.objects.get(id=rev_id)
-    except WikiPage.DoesNotExist:
+    wiki_page = get_published_wiki_page(request, slug)
+    if wiki_page is None:
         return HttpResponseRedirect(reverse('wiki_page_edit', args=[slug]))
     if not wiki_page.can_view_wikipage(request.user):
         return HttpResponseForbidden(
             _("You don't have permission to view this wiki page revision."))
+    revision = get_object_or_404(
+        wiki_page.wikipagerevision_set.select_related("user"), id=rev_id)
+    revision.page = wiki_page
     context = {"wiki_page": wiki_page, "revision": revision}
     templates = [u"mezawiki/wiki_page_detail_%s.html" % unicode(slug), template]
     return render(request, templates, context)
 
 
+@query_budget(25)
 def wiki_page_diff(request, slug,
                      template="mezawiki/wiki_page_diff.html"):
     slug_original = slug
@@ -211,25 +388,38 @@ def wiki_page_diff(request, slug,
         return HttpResponseRedirect(
             reverse('wiki_page_diff', args=[slug])
         )
-    try:
-        wiki_pages = WikiPage.objects.published(for_user=request.user)
-        wiki_page = wiki_pages.get(slug=slug)
-    except WikiPage.DoesNotExist:
+    wiki_page = get_published_wiki_page(request, slug)
+    if wiki_page is None:
         return HttpResponseRedirect(reverse('wiki_page_edit', args=[slug]))
+    # Content is only loaded if the diff isn't cached.
+    revisions = wiki_page.wikipagerevision_set.defer("stored_content",
+                                                     "content_rendered")
     try:
-        from_rev = wiki_page.wikipagerevision_set.get(pk=request.REQUEST['from_revision_pk'])
-        to_rev = wiki_page.wikipagerevision_set.get(pk=request.REQUEST['to_revision_pk'])
-    except (KeyError, WikiPage.DoesNotExist):
+        from_rev = revisions.get(pk=request.REQUEST['from_revision_pk'])
+        to_rev = revisions.get(pk=request.REQUEST['to_revision_pk'])
+    except (KeyError, ValueError, WikiPageRevision.DoesNotExist):
         return HttpResponseNotFound()
-    dmp = diff_match_patch()
-    diff = dmp.diff_compute(from_rev.content, to_rev.content, True, 2)
+    diff_view = request.REQUEST.get('view')
+    if diff_view not in DIFF_VIEWS:
+        diff_view = 'inline'
+    diff, coarse = get_revision_diff(from_rev, to_rev, DIFF_VIEWS[diff_view])
+    if diff_view == 'unified':
+        diff = unified_rows(diff)
+    elif diff_view == 'split':
+        diff = split_rows(diff)
     undo_error = False
     if 'undo' in request.REQUEST and request.REQUEST['undo'] == 'error':
         undo_error = True
+    diff_query = urlencode({'from_revision_pk': from_rev.pk,
+                            'to_revision_pk': to_rev.pk})
     return render(request, 'mezawiki/wiki_page_diff.html',
-                  {'wiki_page': wiki_page, 'from_revision': from_rev, 'to_revision': to_rev, 'diff': diff, 'undo_error': undo_error})
+                  {'wiki_page': wiki_page, 'from_revision': from_rev,
+                   'to_revision': to_rev, 'diff': diff,
+                   'diff_view': diff_view, 'diff_coarse': coarse,
+                   'diff_query': diff_query, 'undo_error': undo_error})
 
 
+@query_budget(20)
 def wiki_page_revert(request, slug, revision_pk):
     slug_original = slug
     slug = urlize_title(slug)
@@ -237,21 +427,18 @@ def wiki_page_revert(request, slug, revision_pk):
         return HttpResponseRedirect(
             reverse('wiki_page_revert', args=[slug, revision_pk])
         )
-    try:
-        wiki_pages = WikiPage.objects.published(for_user=request.user)
-        wiki_page = wiki_pages.get(slug=slug)
-    except WikiPage.DoesNotExist:
+    wiki_page = get_published_wiki_page(request, slug)
+    if wiki_page is None:
         return HttpResponseRedirect(reverse('wiki_page_edit', args=[slug]))
-    src_revision = get_object_or_404(WikiPageRevision, page=wiki_page, pk=revision_pk)
-    new_revision = WikiPageRevision(page=wiki_page,
-            user=request.user if request.user.is_authenticated() else User.objects.get(id=-1))
+    src_revision = get_object_or_404(
+        WikiPageRevision.objects.select_related("user"), page=wiki_page,
+        pk=revision_pk)
     if request.method == 'POST':
         form = WikiPageForm(data=request.POST or None, instance=wiki_page)
         if form.is_valid():
-            form.save()
-            new_revision.content = form.cleaned_data["content"]
-            new_revision.description = form.cleaned_data["summary"]
-            new_revision.save()
+            page = form.save(commit=False)
+            page.commit_revision(page.content, request.user,
+                                 form.cleaned_data["summary"])
             return HttpResponseRedirect(reverse('wiki_page_detail', kwargs={'slug': slug}))
     else:
         if src_revision.user:
@@ -266,6 +453,7 @@ def wiki_page_revert(request, slug, revision_pk):
                   {'wiki_page': wiki_page, 'form': form, 'src_revision': src_revision})
 
 
+@query_budget(20)
 def wiki_page_undo(request, slug, revision_pk):
     slug_original = slug
     slug = urlize_title(slug)
@@ -273,21 +461,18 @@ def wiki_page_undo(request, slug, revision_pk):
         return HttpResponseRedirect(
             reverse('wiki_page_undo', args=[slug, revision_pk])
         )
-    try:
-        wiki_pages = WikiPage.objects.published(for_user=request.user)
-        wiki_page = wiki_pages.get(slug=slug)
-    except WikiPage.DoesNotExist:
+    wiki_page = get_published_wiki_page(request, slug)
+    if wiki_page is None:
         return HttpResponseRedirect(reverse('wiki_page_edit', args=[slug]))
-    src_revision = get_object_or_404(WikiPageRevision, page=wiki_page, pk=revision_pk)
-    new_revision = WikiPageRevision(page=wiki_page,
-            user=request.user if request.user.is_authenticated() else User.objects.get(id=-1))
+    src_revision = get_object_or_404(
+        WikiPageRevision.objects.select_related("user"), page=wiki_page,
+        pk=revision_pk)
     if request.method == 'POST':
         form = WikiPageForm(data=request.POST or None, instance=wiki_page)
         if form.is_valid():
-            form.save()
-            new_revision.content = form.cleaned_data["content"]
-            new_revision.description = form.cleaned_data["summary"]
-            new_revision.save()
+            page = form.save(commit=False)
+            page.commit_revision(page.content, request.user,
+                                 form.cleaned_data["summary"])
             return HttpResponseRedirect(reverse('wiki_page_detail', kwargs={'slug': slug}))
     else:
         if src_revision.user:
@@ -304,8 +489,9 @@ def wiki_page_undo(request, slug, revision_pk):
         except IndexError:
             prev_content = ''
         dmp = diff_match_patch()
-        rdiff = dmp.patch_make(src_revision.content, prev_content)
-        content, results = dmp.patch_apply(rdiff, wiki_page.content)
+        with timer("patch"):
+            rdiff = dmp.patch_make(src_revision.content, prev_content)
+            content, results = dmp.patch_apply(rdiff, wiki_page.content)
         if False in results:
             urldata = {'to_revision_pk': src_revision.pk}
             if prev_revision:
@@ -319,28 +505,123 @@ def wiki_page_undo(request, slug, revision_pk):
     return render(request, 'mezawiki/wiki_page_edit.html', {'wiki_page': wiki_page, 'form': form})
 
 
+@query_budget(20)
 def wiki_page_changes(request, 
                      template="mezawiki/wiki_page_changes.html"):
     """
-    Displays a recent wiki changes.
+    Displays a recent wiki changes, optionally filtered by author,
+    category and the number of days back. Changes are paged with the
+    ``before`` cursor rather than page numbers.
     """
-    wiki_pages = WikiPage.objects.published(for_user=request.user)
-    wiki_revisions = WikiPageRevision.objects.filter(page__in=wiki_pages)
-    context = {"wiki_revisions": wiki_revisions}
+    settings.use_editable()
+    wiki_revisions = WikiPageRevision.objects.published(for_user=request.user)
+    author = request.GET.get("author")
+    if author:
+        wiki_revisions = wiki_revisions.filter(user__username=author)
+    category = request.GET.get("category")
+    if category:
+        wiki_revisions = wiki_revisions.filter(page__categories__slug=category)
+    try:
+        days = int(request.GET.get("days", 0))
+    except ValueError:
+        days = 0
+    if days > 0:
+        since = now() - timedelta(days=days)
+        wiki_revisions = wiki_revisions.filter(created__gte=since)
+    wiki_revisions = wiki_revisions.select_related("page", "user").only(
+        "id", "created", "description", "parent", "size", "size_change",
+        "chars_added", "chars_removed", "page__id", "page__title",
+        "page__slug", "user__id", "user__username")
+    wiki_revisions = keyset_paginate(wiki_revisions,
+                                     request.GET.get("before"),
+                                     settings.WIKI_CHANGES_PER_PAGE)
+    next_query = next_page_query(request, wiki_revisions)
+    context = {"wiki_revisions": wiki_revisions, "next_query": next_query,
+               "author": author, "category": category, "days": days,
+               "categories": WikiCategory.objects.all()}
     return render(request, template, context)
 
 
+@query_budget(15)
+def wiki_page_backlinks(request, slug,
+                        template="mezawiki/wiki_page_backlinks.html"):
+    """
+    Displays the pages that link to a wiki page, which needn't exist.
+    """
+    slug_original = slug
+    slug = urlize_title(slug)
+    if slug != slug_original:
+        return HttpResponseRedirect(
+            reverse('wiki_page_backlinks', args=[slug])
+        )
+    wiki_pages = WikiPage.objects.linking_to(slug, for_user=request.user)
+    wiki_pages = paginate(wiki_pages.order_by("title"),
+                          request.GET.get("page", 1),
+                          settings.WIKI_PAGES_PER_PAGE,
+                          settings.MAX_PAGING_LINKS)
+    context = {"wiki_pages": wiki_pages, "slug": slug,
+               "title": deurlize_title(slug)}
+    return render(request, template, context)
+
+
+@query_budget(15)
+def wiki_page_orphans(request, template="mezawiki/wiki_page_orphans.html"):
+    """
+    Displays the pages that no other page links to.
+    """
+    settings.use_editable()
+    wiki_pages = WikiPage.objects.orphaned(for_user=request.user)
+    wiki_pages = wiki_pages.exclude(slug=settings.WIKI_DEFAULT_INDEX)
+    wiki_pages = paginate(wiki_pages.order_by("title"),
+                          request.GET.get("page", 1),
+                          settings.WIKI_PAGES_PER_PAGE,
+                          settings.MAX_PAGING_LINKS)
+    context = {"wiki_pages": wiki_pages}
+    return render(request, template, context)
+
+
+@query_budget(15)
+def wiki_page_wanted(request, template="mezawiki/wiki_page_wanted.html"):
+    """
+    Displays the slugs that are linked to but have no page yet.
+    """
+    settings.use_editable()
+    wanted = paginate(WikiLink.objects.wanted(),
+                      request.GET.get("page", 1),
+                      settings.WIKI_PAGES_PER_PAGE,
+                      settings.MAX_PAGING_LINKS)
+    context = {"wanted": wanted}
+    return render(request, template, context)
+
+
+@query_budget(15)
+def wiki_page_search(request, template="mezawiki/wiki_page_search.html"):
+    """
+    Displays the wiki pages matching the search query, best match
+    first.
+    """
+    settings.use_editable()
+    query = request.GET.get("q", "")
+    results = get_search_backend().search(query, for_user=request.user)
+    results = paginate(results,
+                       request.GET.get("page", 1),
+                       settings.WIKI_PAGES_PER_PAGE,
+                       settings.MAX_PAGING_LINKS)
+    context = {"query": query, "results": results}
+    return render(request, template, context)
+
+
+@query_budget(20)
 def wiki_page_edit(request, slug, 
                      template="mezawiki/wiki_page_edit.html"):
     """
     Displays the form for editing a page.
     """
-    try:
-        #wiki_pages = WikiPage.objects.published(for_user=request.user)
-        wiki_page = WikiPage.objects.get(slug=slug)
+    wiki_page = get_wiki_page(request, slug)
+    if wiki_page is not None:
         wiki_page.is_initial = False
         initial = {}
-    except WikiPage.DoesNotExist:
+    else:
         wiki_page = WikiPage(slug=slug)
         wiki_page.is_initial = True
         initial = {'status': 1}
@@ -359,21 +640,20 @@ def wiki_page_edit(request, slug,
                 except:
                     page.user_id = -1
                 page.title = deurlize_title(slug)
-            page.save()
-            if 'content' in form.changed_data:
-                revision = WikiPageRevision()
-                revision.content = page.content
-                revision.description = form.cleaned_data["summary"]
-                revision.page = page
-                try:
-                    revision.user = request.user
-                except:
-                    # anonymous
-                    revision.user_id = -1
-                revision.save()
+            try:
+                saved = save_page_edit(request, page, form)
+            except IntegrityError:
+                # The page was created by someone else meanwhile.
+                messages.error(request, _("This page was created while you "
+                                          "were editing it."))
+                return HttpResponseRedirect(
+                    reverse('wiki_page_edit', args=[slug]))
+            if not saved:
+                return wiki_page_conflict(request, wiki_page, form, template)
             return HttpResponseRedirect(
                 reverse('wiki_page_detail', args=[slug]))
     else:
+        initial['base_revision'] = wiki_page.latest_revision_id
         form = WikiPageForm(initial=initial, instance=wiki_page)
 
     context = {'wiki_page': wiki_page, 'form': form,
@@ -381,6 +661,66 @@ def wiki_page_edit(request, slug,
     return render(request, template, context)
 
 
+def save_page_edit(request, page, form):
+    """
+    Saves a page edited with a valid ``WikiPageForm``, along with a new
+    revision if its content changed. Returns ``False`` without saving
+    anything if the page's content changed since the revision the edit
+    was based on.
+    """
+    if 'content' not in form.changed_data:
+        page.save()
+        return True
+    revision = page.commit_revision(page.content, request.user,
+                                    form.cleaned_data["summary"],
+                                    form.cleaned_data['base_revision'],
+                                    check_base=True)
+    return revision is not None
+
+
+def wiki_page_conflict(request, wiki_page, form, template):
+    """
+    Handles an edit of a page that was changed since the edit started.
+    The edit is merged with the changes made meanwhile and saved if
+    they don't overlap, otherwise the form is shown again with the
+    differences from the page's current content. Without the revision
+    the edit started from, or if it was empty, there's no context to
+    merge the edit by, so that's always shown as a conflict.
+    """
+    current = WikiPage.objects.get(pk=wiki_page.pk)
+    current.is_initial = False
+    content = form.cleaned_data['content']
+    try:
+        base = WikiPageRevision.objects.get(
+            pk=form.cleaned_data['base_revision'], page=wiki_page)
+    except WikiPageRevision.DoesNotExist:
+        base = None
+    if base is None or not base.content:
+        clean = False
+    else:
+        merged, clean = merge_texts(base.content, content, current.content)
+    data = request.POST.copy()
+    data['base_revision'] = current.latest_revision_id
+    if clean:
+        data['content'] = merged
+        form = WikiPageForm(data, instance=current)
+        if form.is_valid() and save_page_edit(request, current, form):
+            messages.info(request, _("Your changes were merged with the "
+                                     "changes made while you were "
+                                     "editing."))
+            return HttpResponseRedirect(
+                reverse('wiki_page_detail', args=[current.slug]))
+        current = WikiPage.objects.get(pk=wiki_page.pk)
+        current.is_initial = False
+        data['base_revision'] = current.latest_revision_id
+    data['content'] = content
+    form = WikiPageForm(data, instance=current)
+    diff, coarse = diff_texts(current.content, content, 'lines')
+    context = {'wiki_page': current, 'form': form,
+               'title': current.title, 'conflict_diff': unified_rows(diff)}
+    return render(request, template, context)
+
+
 def can_add_wikipage(user):
     # Simple cases first, we don't want to waste CPU and DB hits.
 
@@ -405,6 +745,7 @@ def can_add_wikipage(user):
     return False
 
 
+@query_budget(15)
 def wiki_page_new(request, template="mezawiki/wiki_page_new.html"):
     """
     Displays the form for creating a page.
@@ -424,18 +765,14 @@ def wiki_page_new(request, template="mezawiki/wiki_page_new.html"):
                 # anonymous
                 page.user_id = -1
             page.slug = urlize_title(form.cleaned_data["title"])
-            # TODO Check slug, it is not a unique field
-            page.save()
-            revision = WikiPageRevision()
-            revision.content = page.content
-            revision.description = form.cleaned_data["summary"]
-            revision.page = page
+            if slug_cache.get(page.slug) is not None:
+                return slug_taken(request, template, form)
             try:
-                revision.user = request.user
-            except:
-                # anonymous
-                revision.user_id = -1
-            revision.save()
+                page.commit_revision(page.content, request.user,
+                                     form.cleaned_data["summary"])
+            except IntegrityError:
+                # Created by someone else since checking.
+                return slug_taken(request, template, form)
             return HttpResponseRedirect(
                 reverse('wiki_page_detail', args=[page.slug]))
     else:
@@ -445,3 +782,25 @@ def wiki_page_new(request, template="mezawiki/wiki_page_new.html"):
     return render(request, template, context)
 
 
+def slug_taken(request, template, form):
+    """
+    Shows the form for creating a page again, for a title that another
+    page already has.
+    """
+    form._errors["title"] = form.error_class(
+        [_("A page with this title already exists.")])
+    context = {'form': form}
+    return render(request, template, context)
+
+
+def wiki_metrics(request):
+    """
+    Returns the metrics recorded by ``MetricsMiddleware`` in
+    Prometheus' text format, to staff users and the addresses in the
+    ``INTERNAL_IPS`` setting.
+    """
+    if not (request.user.is_staff or
+            request.META.get("REMOTE_ADDR") in settings.INTERNAL_IPS):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(),
+                        content_type="text/plain; version=0.0.4")
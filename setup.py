@@ -24,7 +24,7 @@ try:
         #url="http://mezzanine.jupo.org/",
         zip_safe=False,
         include_package_data=True,
-        packages=find_packages(),
+        packages=find_packages(exclude=["benchmarks"]),
         install_requires=install_requires,
         entry_points="""
             [console_scripts]